@@ -0,0 +1,185 @@
+"""Admission control for processing requests.
+
+Every request that processes images is admitted against a global budget of
+in-flight pixels (``MAX_INFLIGHT_PIXELS``), since working memory grows with
+the pixels being processed, not the number of requests. A request that
+doesn't fit waits in a bounded queue for up to ``ADMISSION_TIMEOUT``
+seconds, ordered by its expected processing time with aging (see
+``scheduling``), so a preview doesn't wait behind a queued batch of large
+photos. When the queue is full or the wait times out the request is
+rejected with ``503``, and a client with ``MAX_CLIENT_REQUESTS`` requests
+already admitted or waiting gets ``429``; both carry ``Retry-After``.
+
+Rejecting early keeps memory bounded under bursts and keeps the latency of
+admitted requests close to their processing time.
+"""
+
+import asyncio
+import os
+from typing import Dict, NamedTuple, Optional
+
+from fastapi import HTTPException
+
+from scheduling import CostQueue
+
+MAX_INFLIGHT_PIXELS = int(os.getenv("MAX_INFLIGHT_PIXELS", 200_000_000))
+# Budget a request larger than MAX_INFLIGHT_PIXELS leaves free for others
+ADMISSION_HEADROOM = int(os.getenv("ADMISSION_HEADROOM", 16_000_000))
+MAX_CLIENT_REQUESTS = int(os.getenv("MAX_CLIENT_REQUESTS", 4))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 32))
+ADMISSION_TIMEOUT = float(os.getenv("ADMISSION_TIMEOUT", 10))
+RETRY_AFTER = int(os.getenv("RETRY_AFTER", 2))
+
+
+class Grant(NamedTuple):
+    """Budget held by an admitted request, returned with :meth:`AdmissionControl.release`"""
+    client: Optional[str]
+    cost: int
+
+
+class _Waiter(NamedTuple):
+    cost: int
+    future: asyncio.Future
+    background: bool
+
+
+class AdmissionControl:
+    """In-flight pixel budget with a bounded wait queue and per-client caps
+
+    Waiting requests are admitted cheapest expected first, with aging: the
+    request at the head of the queue isn't overtaken by ones behind it,
+    and a large request reaches the head once it has waited long enough,
+    so it can't be starved. A single request costing more than the whole
+    budget is clamped to it minus ``headroom``, leaving room for small
+    requests to run next to it.
+    """
+
+    def __init__(
+        self,
+        max_pixels: int = MAX_INFLIGHT_PIXELS,
+        max_client_requests: int = MAX_CLIENT_REQUESTS,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        timeout: float = ADMISSION_TIMEOUT,
+        retry_after: int = RETRY_AFTER,
+        headroom: int = ADMISSION_HEADROOM,
+    ):
+        self.max_pixels = max(1, max_pixels)
+        self.headroom = min(max(0, headroom), self.max_pixels // 2)
+        self.max_client_requests = max_client_requests
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self._clients: Dict[str, int] = {}
+        self._waiters: CostQueue[_Waiter] = CostQueue()
+        self.admitted = 0
+        self.rejected_busy = 0
+        self.rejected_client = 0
+        self.timed_out = 0
+
+    @classmethod
+    def from_env(cls) -> "AdmissionControl":
+        """Build from MAX_INFLIGHT_PIXELS, MAX_CLIENT_REQUESTS and the queue settings"""
+        return cls(
+            max_pixels=MAX_INFLIGHT_PIXELS,
+            max_client_requests=MAX_CLIENT_REQUESTS,
+            queue_size=ADMISSION_QUEUE_SIZE,
+            timeout=ADMISSION_TIMEOUT,
+            retry_after=RETRY_AFTER,
+            headroom=ADMISSION_HEADROOM,
+        )
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.background)
+
+    def _reject(self, status_code: int, detail: str) -> HTTPException:
+        return HTTPException(
+            status_code=status_code, detail=detail, headers={"Retry-After": str(self.retry_after)}
+        )
+
+    def check(self, client: str):
+        """Reject a request that couldn't be admitted, before its uploads are read"""
+        if self.max_client_requests and self._clients.get(client, 0) >= self.max_client_requests:
+            self.rejected_client += 1
+            raise self._reject(429, "Too many concurrent requests from this client")
+        if self.queued >= self.queue_size and (self._waiters or self.in_flight >= self.max_pixels):
+            self.rejected_busy += 1
+            raise self._reject(503, "Server is busy, try again later")
+
+    async def acquire(self, client: Optional[str], cost: int, seconds: float = 0.0) -> Grant:
+        """Wait for ``cost`` pixels of budget
+
+        ``seconds`` is the request's expected processing time, which orders
+        it among waiting requests. ``client`` None marks background work: it
+        waits as long as it takes and isn't subject to per-client caps or
+        the queue bound. Raises a 429 or 503 HTTPException for requests that
+        can't be admitted.
+        """
+        cost = max(1, cost)
+        if cost > self.max_pixels:
+            cost = self.max_pixels - self.headroom
+        background = client is None
+        if not background:
+            self.check(client)
+            self._clients[client] = self._clients.get(client, 0) + 1
+
+        grant = Grant(client, cost)
+        try:
+            if not self._waiters and self.in_flight + cost <= self.max_pixels:
+                self.in_flight += cost
+            else:
+                await self._wait(cost, seconds, background)
+        except BaseException:
+            self._leave(client)
+            raise
+
+        self.admitted += 1
+        return grant
+
+    def release(self, grant: Grant):
+        self.in_flight -= grant.cost
+        self._leave(grant.client)
+        self._wake()
+
+    async def _wait(self, cost: int, seconds: float, background: bool):
+        future = asyncio.get_running_loop().create_future()
+        entry = self._waiters.push(_Waiter(cost, future, background), seconds)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), None if background else self.timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Admitted just as we gave up: hand the budget back
+                self.in_flight -= cost
+            else:
+                future.cancel()
+                self._waiters.remove(entry)
+            self._wake()
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise self._reject(503, "Server is busy, try again later")
+            raise
+
+    def _wake(self):
+        while self._waiters and self.in_flight + self._waiters.peek().cost <= self.max_pixels:
+            waiter, _ = self._waiters.pop()
+            self.in_flight += waiter.cost
+            waiter.future.set_result(None)
+
+    def _leave(self, client: Optional[str]):
+        if client is None:
+            return
+        self._clients[client] -= 1
+        if not self._clients[client]:
+            del self._clients[client]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight_pixels": self.in_flight,
+            "max_pixels": self.max_pixels,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected_busy": self.rejected_busy,
+            "rejected_client": self.rejected_client,
+            "timed_out": self.timed_out,
+        }
@@ -0,0 +1,74 @@
+"""Compare two benchmark reports and flag regressions.
+
+Usage::
+
+    python -m benchmarks.compare BASELINE.json CURRENT.json [--threshold 0.1]
+
+Rows are matched by effect and size (throughput reports) or by mode and
+concurrency (load reports). A metric that is worse by more than
+``--threshold`` (a fraction) counts as a regression, and the exit status
+is 1 if there are any, so this can gate a deploy.
+"""
+
+import argparse
+import sys
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.report import load
+
+# Row identity and compared metrics per benchmark; True where higher is better
+KEYS = {
+    "throughput": ("effect", "size"),
+    "load": ("mode", "concurrency"),
+}
+METRICS = {
+    "throughput": {"mp_per_s": True, "tracemalloc_peak_mb": False, "encode_seconds": False},
+    "load": {"requests_per_s": True, "latency_p95_s": False, "latency_p99_s": False},
+}
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[Tuple[str, str, float, float, float]]:
+    """Regressions as (row, metric, baseline, current, change)"""
+    kind = current["benchmark"]
+    if baseline["benchmark"] != kind:
+        raise ValueError(f"Can't compare a '{baseline['benchmark']}' report with a '{kind}' report")
+
+    keys = KEYS[kind]
+    before = {tuple(row[key] for key in keys): row for row in baseline["results"]}
+    regressions = []
+    for row in current["results"]:
+        identity = tuple(row[key] for key in keys)
+        old = before.get(identity)
+        if old is None:
+            continue
+
+        label = " ".join(str(value) for value in identity)
+        for metric, higher_is_better in METRICS[kind].items():
+            if not old.get(metric) or row.get(metric) is None:
+                continue
+            change = (row[metric] - old[metric]) / old[metric]
+            worse = -change if higher_is_better else change
+            print(f"{label:<36}{metric:<22}{old[metric]:>12.4g}{row[metric]:>12.4g}{change * 100:>+9.1f}%")
+            if worse > threshold:
+                regressions.append((label, metric, old[metric], row[metric], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline", help="earlier report")
+    parser.add_argument("current", help="new report")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown, as a fraction")
+    args = parser.parse_args()
+
+    regressions = compare(load(args.baseline), load(args.current), args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+        for label, metric, old, new, change in regressions:
+            print(f"  {label} {metric}: {old:.4g} -> {new:.4g} ({change * 100:+.1f}%)")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Compare output encoding settings by encode time and size.
+
+Usage::
+
+    python -m benchmarks.encode [IMAGE ...] [--size 4000x3000] [--repeat 3]
+
+Without images a synthetic photo-like frame of ``--size`` is used. Each
+setting is encoded ``--repeat`` times and the fastest run is reported.
+"""
+
+import argparse
+import io
+import os
+import time
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from encoding import EncodeOptions, available_formats, encode
+
+# (label, options); the first entry is the encoding used before options existed
+SETTINGS: List[Tuple[str, EncodeOptions]] = [
+    ("jpeg q95 (old default)", EncodeOptions(quality=95, subsampling="4:2:0")),
+    ("jpeg q85 4:2:0 (default)", EncodeOptions()),
+    ("jpeg q85 4:4:4", EncodeOptions(subsampling="4:4:4")),
+    ("jpeg q85 optimize", EncodeOptions(optimize=True)),
+    ("jpeg q85 progressive", EncodeOptions(progressive=True, optimize=True)),
+    ("jpeg q75", EncodeOptions(quality=75)),
+    ("webp q80", EncodeOptions(format="WEBP")),
+    ("webp q80 optimize", EncodeOptions(format="WEBP", optimize=True)),
+    ("png", EncodeOptions(format="PNG")),
+    ("png optimize", EncodeOptions(format="PNG", optimize=True)),
+    ("avif q80", EncodeOptions(format="AVIF")),
+]
+
+
+def synthetic_image(width: int, height: int) -> Image.Image:
+    """Smooth gradients with mild noise, which compresses roughly like a photo
+
+    Built in bands of rows so that generating a 48MP frame doesn't inflate
+    the peak memory of the benchmark measuring it.
+    """
+    rng = np.random.default_rng(0)
+    output = np.empty((height, width, 3), dtype=np.uint8)
+    x = np.arange(width)
+    rows = max(1, (1 << 20) // width)
+    for top in range(0, height, rows):
+        y = np.arange(top, min(top + rows, height))[:, None]
+        pixels = np.empty((len(y), width, 3), dtype=np.float32)
+        pixels[:, :, 0] = 255 * x / width
+        pixels[:, :, 1] = 255 * y / height
+        pixels[:, :, 2] = 128 + 100 * np.sin(x / 97.0) * np.cos(y / 61.0)
+        pixels += rng.normal(0, 6, pixels.shape).astype(np.float32)
+        output[top:top + len(y)] = np.clip(pixels, 0, 255)
+    return Image.fromarray(output)
+
+
+def time_encode(image: Image.Image, options: EncodeOptions, repeat: int) -> Tuple[float, int]:
+    """Fastest of ``repeat`` encodes in seconds, and the output size"""
+    best = float("inf")
+    data = b""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = encode(image, options)
+        best = min(best, time.perf_counter() - start)
+    return best, len(data)
+
+
+def run(image: Image.Image, name: str, repeat: int):
+    formats = set(available_formats().values())
+    megapixels = image.width * image.height / 1e6
+    print(f"\n{name}: {image.width}x{image.height} ({megapixels:.1f} MP)")
+    print(f"{'setting':<26}{'ms':>9}{'MP/s':>9}{'KB':>10}{'bits/px':>9}")
+
+    for label, options in SETTINGS:
+        if options.format not in formats:
+            print(f"{label:<26}{'not available in this Pillow build':>37}")
+            continue
+        seconds, size = time_encode(image, options, repeat)
+        print(
+            f"{label:<26}{seconds * 1000:>9.1f}{megapixels / seconds:>9.1f}"
+            f"{size / 1024:>10.0f}{size * 8 / (image.width * image.height):>9.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("images", nargs="*", help="images to encode (default: synthetic)")
+    parser.add_argument("--size", default="4000x3000", help="synthetic image size, WIDTHxHEIGHT")
+    parser.add_argument("--repeat", type=int, default=3, help="encodes per setting")
+    args = parser.parse_args()
+
+    if not args.images:
+        width, height = (int(value) for value in args.size.lower().split("x"))
+        run(synthetic_image(width, height), "synthetic", args.repeat)
+
+    for path in args.images:
+        with open(path, "rb") as f:
+            image = Image.open(io.BytesIO(f.read())).convert("RGB")
+        run(image, os.path.basename(path), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Concurrent load test of ``/apply-effect`` through an in-process ASGI client.
+
+Usage (needs ``httpx``: ``pip install -r requirements-dev.txt``)::
+
+    python -m benchmarks.load [--effect lomo] [--size 1600x1200] [--batch 8]
+        [--concurrency 1,4,16] [--requests 32] [--output load.json]
+
+Requests go straight to the app through ``httpx.ASGITransport``, so the
+numbers cover upload parsing, admission, the worker pool, encoding and ZIP
+streaming but no network. Each concurrency level runs in single mode (one
+image per request) and batch mode (``--batch`` images per request).
+
+The result cache is disabled, so each request is processed in full.
+Per-client limits are off too, since all requests come from one client;
+other admission limits apply as configured and rejections are reported.
+"""
+
+import os
+
+# Measure processing, not the result cache; set before the app is imported
+os.environ.setdefault("RESULT_CACHE_BYTES", "0")
+os.environ.setdefault("RESULT_CACHE_DIR", "")
+os.environ.setdefault("MAX_CLIENT_REQUESTS", "0")
+
+import argparse
+import asyncio
+import io
+import time
+from typing import Any, Dict, List
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from benchmarks.encode import synthetic_image
+from benchmarks.report import save
+from effects import EFFECTS
+
+
+def make_uploads(width: int, height: int, count: int) -> List[bytes]:
+    """``count`` different JPEGs of the same size"""
+    base = np.asarray(synthetic_image(width, height))
+    uploads = []
+    for index in range(count):
+        buffer = io.BytesIO()
+        Image.fromarray(np.roll(base, index * 7, axis=1)).save(buffer, format="JPEG", quality=90)
+        uploads.append(buffer.getvalue())
+    return uploads
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else float("nan")
+
+
+async def scenario(
+    client: httpx.AsyncClient,
+    effect: str,
+    uploads: List[bytes],
+    batch: int,
+    concurrency: int,
+    requests: int,
+    megapixels: float,
+) -> Dict[str, Any]:
+    """Send ``requests`` requests, ``concurrency`` at a time"""
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    sent = 0
+
+    async def worker():
+        nonlocal sent
+        while sent < requests:
+            index = sent
+            sent += 1
+            files = [("files", (f"image{index}_{i}.jpg", uploads[i], "image/jpeg")) for i in range(batch)]
+            start = time.perf_counter()
+            response = await client.post("/apply-effect", data={"effect": effect}, files=files)
+            await response.aread()
+            latencies.append(time.perf_counter() - start)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    succeeded = statuses.get("200", 0)
+    return {
+        "mode": "batch" if batch > 1 else "single",
+        "batch": batch,
+        "concurrency": concurrency,
+        "requests": requests,
+        "statuses": statuses,
+        "seconds": elapsed,
+        "requests_per_s": succeeded / elapsed,
+        "mp_per_s": succeeded * batch * megapixels / elapsed,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p95_s": percentile(latencies, 95),
+        "latency_p99_s": percentile(latencies, 99),
+        "latency_max_s": max(latencies, default=float("nan")),
+    }
+
+
+async def run(effect: str, width: int, height: int, batch: int, levels: List[int], requests: int):
+    import main as server
+
+    megapixels = width * height / 1e6
+    uploads = make_uploads(width, height, batch)
+    results = []
+
+    async with server.lifespan(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            # Measure warm workers, as a load balancer would only route to them
+            while (await client.get("/ready")).status_code != 200:
+                await asyncio.sleep(0.1)
+            print(f"\n{effect} on {width}x{height} ({megapixels:.1f} MP), worker mode {server.worker_pool.mode}")
+            print(f"{'mode':<8}{'conc':>6}{'req/s':>9}{'MP/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  statuses")
+            for mode_batch in (1, batch):
+                for concurrency in levels:
+                    row = await scenario(client, effect, uploads, mode_batch, concurrency, requests, megapixels)
+                    results.append(row)
+                    print(
+                        f"{row['mode']:<8}{concurrency:>6}{row['requests_per_s']:>9.2f}{row['mp_per_s']:>8.1f}"
+                        f"{row['latency_p50_s'] * 1000:>9.0f}{row['latency_p95_s'] * 1000:>9.0f}"
+                        f"{row['latency_p99_s'] * 1000:>9.0f}  {row['statuses']}"
+                    )
+                if batch == 1:
+                    break
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--effect", default="lomo", help="effect to apply")
+    parser.add_argument("--size", default="1600x1200", help="image size, WIDTHxHEIGHT")
+    parser.add_argument("--batch", type=int, default=8, help="images per request in batch mode")
+    parser.add_argument("--concurrency", default="1,4,16", help="concurrent clients, comma-separated levels")
+    parser.add_argument("--requests", type=int, default=32, help="requests per level and mode")
+    parser.add_argument("--output", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    if args.effect not in EFFECTS:
+        parser.error(f"unknown effect '{args.effect}'")
+    width, height = (int(value) for value in args.size.lower().split("x"))
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    results = asyncio.run(run(args.effect, width, height, args.batch, levels, args.requests))
+    if args.output:
+        settings = {
+            "effect": args.effect,
+            "size": args.size,
+            "batch": args.batch,
+            "concurrency": levels,
+            "requests": args.requests,
+            "worker_mode": os.getenv("WORKER_MODE", "process"),
+        }
+        save(args.output, "load", settings, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""JSON reports shared by the benchmarks, so runs can be compared."""
+
+import json
+import os
+import platform
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+import PIL
+
+
+def environment() -> Dict[str, Any]:
+    """What a result depends on besides the code"""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def save(path: str, benchmark: str, settings: Dict[str, Any], results: List[Dict[str, Any]]):
+    report = {
+        "benchmark": benchmark,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(),
+        "settings": settings,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+    print(f"\nWrote {path}")
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
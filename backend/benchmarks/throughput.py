@@ -0,0 +1,179 @@
+"""Throughput and memory of every effect across resolutions.
+
+Usage::
+
+    python -m benchmarks.throughput [--effects lomo,soft] [--sizes 0.3,2,12,24,48]
+        [--repeat 3] [--pipeline] [--output throughput.json]
+
+Each effect in ``EFFECTS`` is called directly on a synthetic frame of each
+size (in megapixels). The fastest of ``--repeat`` runs gives the
+throughput. A separate run under tracemalloc gives peak Python/NumPy
+allocations, and peak RSS covers Pillow's buffers too. The result is then
+encoded with the default options to show the encode cost next to the
+effect. ``--pipeline`` runs each effect through the compiled pipeline the
+server uses, which bands large images within ``TILE_MEMORY_BYTES``.
+
+Peak RSS is reset before each effect where Linux allows it
+(``/proc/self/clear_refs``); elsewhere it is the peak of the whole run so
+far. For clean memory numbers, run one size at a time.
+"""
+
+import argparse
+import gc
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.encode import synthetic_image
+from benchmarks.report import save
+from effects import EFFECTS
+from encoding import EncodeOptions, encode
+from pipeline import Step, compile_steps
+
+# Megapixels -> (width, height), 4:3 frames
+SIZES: Dict[str, Tuple[int, int]] = {
+    "0.3": (640, 480),
+    "2": (1600, 1200),
+    "12": (4000, 3000),
+    "24": (5664, 4248),
+    "48": (8000, 6000),
+}
+
+
+def peak_rss() -> Optional[int]:
+    """Peak resident set size in bytes since the last :func:`reset_peak_rss`"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def current_rss() -> Optional[int]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak RSS counter; False where the OS doesn't allow it"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def effect_runner(name: str, pipeline: bool) -> Callable[[Image.Image, int], Image.Image]:
+    if pipeline:
+        compiled = compile_steps((Step(name),))
+        return lambda image, seed: compiled(image, np.random.default_rng(seed))
+    effect = EFFECTS[name]
+    return lambda image, seed: effect(image, np.random.default_rng(seed))
+
+
+def measure(name: str, image: Image.Image, repeat: int, pipeline: bool) -> Dict[str, Any]:
+    """Time, memory and encode cost of one effect on one image"""
+    apply = effect_runner(name, pipeline)
+    megapixels = image.width * image.height / 1e6
+
+    gc.collect()
+    baseline = current_rss()
+    exact_peak = reset_peak_rss()
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        result = None
+        start = time.perf_counter()
+        result = apply(image, 0)
+        best = min(best, time.perf_counter() - start)
+    rss = peak_rss()
+
+    result = None
+    gc.collect()
+    tracemalloc.start()
+    result = apply(image, 0)
+    _, traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    options = EncodeOptions()
+    start = time.perf_counter()
+    data = encode(result, options)
+    encode_seconds = time.perf_counter() - start
+
+    return {
+        "effect": name,
+        "size": f"{image.width}x{image.height}",
+        "megapixels": round(megapixels, 2),
+        "seconds": best,
+        "mp_per_s": megapixels / best,
+        "peak_rss_mb": rss / 2**20 if rss is not None else None,
+        "peak_rss_over_baseline_mb": (rss - baseline) / 2**20 if exact_peak and baseline is not None else None,
+        "tracemalloc_peak_mb": traced / 2**20,
+        "encode_seconds": encode_seconds,
+        "encode_bytes": len(data),
+        "encode_share": encode_seconds / (best + encode_seconds),
+    }
+
+
+def run(names: List[str], sizes: List[str], repeat: int, pipeline: bool) -> List[Dict[str, Any]]:
+    results = []
+    for size in sizes:
+        width, height = SIZES[size] if size in SIZES else (int(value) for value in size.lower().split("x"))
+        image = synthetic_image(width, height)
+        print(f"\n{width}x{height} ({width * height / 1e6:.1f} MP)")
+        print(f"{'effect':<22}{'ms':>9}{'MP/s':>8}{'RSS+MB':>9}{'traced MB':>11}{'enc ms':>9}{'enc %':>7}")
+
+        for name in names:
+            row = measure(name, image, repeat, pipeline)
+            results.append(row)
+            rss = row["peak_rss_over_baseline_mb"]
+            print(
+                f"{name:<22}{row['seconds'] * 1000:>9.1f}{row['mp_per_s']:>8.1f}"
+                f"{rss if rss is not None else float('nan'):>9.0f}{row['tracemalloc_peak_mb']:>11.0f}"
+                f"{row['encode_seconds'] * 1000:>9.1f}{row['encode_share'] * 100:>7.0f}"
+            )
+        image = None
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--effects", default="all", help="comma-separated effect names (default: all)")
+    parser.add_argument(
+        "--sizes", default=",".join(SIZES), help=f"megapixels ({', '.join(SIZES)}) or WIDTHxHEIGHT, comma-separated"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per effect and size")
+    parser.add_argument("--pipeline", action="store_true", help="run effects through the compiled pipeline")
+    parser.add_argument("--output", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    names = list(EFFECTS) if args.effects == "all" else [name.strip() for name in args.effects.split(",")]
+    unknown = [name for name in names if name not in EFFECTS]
+    if unknown:
+        parser.error(f"unknown effect '{unknown[0]}'")
+    sizes = [size.strip() for size in args.sizes.split(",")]
+
+    results = run(names, sizes, args.repeat, args.pipeline)
+    if args.output:
+        save(args.output, "throughput", {"sizes": sizes, "repeat": args.repeat, "pipeline": args.pipeline}, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Apply effects to a directory of photos without going through the API.
+
+Usage::
+
+    python -m bulk INPUT_DIR OUTPUT_DIR --effects lomo,analog_kodak
+    python -m bulk --list files.txt --base /photos OUTPUT_DIR --pipeline warm,lomo
+        [--seed 42] [--max-size 2048] [--format webp] [--workers 8] [--overwrite]
+
+Inputs are found by walking ``INPUT_DIR`` (or read from a file list, one
+path per line, ``-`` for stdin) as they are processed, so the run starts
+at once and memory doesn't grow with the size of the catalog. Each file
+is read, processed and written by a worker process, with at most two
+files per worker in flight. Results keep the input's path relative to
+the input directory (or ``--base``): directly under ``OUTPUT_DIR`` for a
+single effect or ``--pipeline``, under ``OUTPUT_DIR/<effect>/`` for
+several effects, which share one decode.
+
+Outputs are written to a temporary file and renamed into place, so an
+existing output is always complete: rerunning the same command after an
+interruption skips the files that are done. With ``--seed`` every file
+gets a seed derived from its relative path, so resumed and reordered
+runs give the same grain.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from PIL import Image
+
+from encoding import SUBSAMPLING, EncodeOptions, available_formats, output_filename
+from geometry import Geometry
+from pipeline import Step, parse_steps
+from processing import load, run_steps
+
+# Seconds between progress lines
+REPORT_INTERVAL = 5.0
+
+
+class Task(NamedTuple):
+    """One input file and where each of its results goes"""
+    source: str
+    relative: str
+    targets: Tuple[Tuple[Tuple[Step, ...], str], ...]
+    seed: Optional[List[int]]
+
+
+class Settings(NamedTuple):
+    """Processing options shared by every file"""
+    max_size: Optional[int]
+    options: EncodeOptions
+    geometry: Geometry
+
+
+def image_extensions() -> Set[str]:
+    """File extensions Pillow can open"""
+    return {ext for ext, fmt in Image.registered_extensions().items() if fmt in Image.OPEN}
+
+
+def walk(directory: str) -> Iterator[str]:
+    """Image files under ``directory``, in a stable order"""
+    extensions = image_extensions()
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in extensions:
+                yield os.path.join(root, name)
+
+
+def read_list(path: str) -> Iterator[str]:
+    """Paths listed one per line in ``path``, or stdin for ``-``"""
+    f = sys.stdin if path == "-" else open(path)
+    try:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def file_seed(seed: Optional[int], relative: str) -> Optional[List[int]]:
+    """Seed for one file, stable across runs whatever order files come in"""
+    if seed is None:
+        return None
+    digest = hashlib.sha256(relative.encode("utf-8")).digest()
+    return [seed, int.from_bytes(digest[:8], "big")]
+
+
+def output_options(options: EncodeOptions, source: str) -> EncodeOptions:
+    """Resolve the "original" format from the file's header"""
+    if options.format != "ORIGINAL":
+        return options
+    try:
+        with Image.open(source) as image:
+            return options.resolve(image.format)
+    except OSError:
+        return options.resolve(None)
+
+
+def write_atomic(path: str, data: bytes):
+    """Write ``data`` to ``path`` so the file only appears once it is complete"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def process_file(task: Task, settings: Settings) -> Tuple[int, int]:
+    """Decode one file once, write a result per effect; returns (pixels, bytes written)"""
+    with open(task.source, "rb") as f:
+        data = f.read()
+    image, source = load(data, settings.max_size, settings.geometry)
+
+    written = 0
+    for steps, target in task.targets:
+        output = run_steps(image, steps, task.seed, settings.options, source)
+        write_atomic(target, output)
+        written += len(output)
+    return image.width * image.height, written
+
+
+class Progress:
+    """Counts and throughput of a run, printed every ``REPORT_INTERVAL`` seconds"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.pixels = 0
+        self.bytes = 0
+
+    def line(self) -> str:
+        elapsed = time.perf_counter() - self.start
+        return (
+            f"{self.done} done, {self.skipped} skipped, {self.failed} failed in {elapsed:.0f}s: "
+            f"{self.done / elapsed:.1f} images/s, {self.pixels / 1e6 / elapsed:.1f} MP/s, "
+            f"{self.bytes / 2**20 / elapsed:.1f} MB/s written"
+        )
+
+    def report(self, force: bool = False):
+        now = time.perf_counter()
+        if force or now - self.last_report >= REPORT_INTERVAL:
+            self.last_report = now
+            print(self.line(), flush=True)
+
+
+def plan_tasks(
+    paths: Iterator[str],
+    base: str,
+    output: str,
+    chains: List[Tuple[str, Tuple[Step, ...]]],
+    seed: Optional[int],
+    options: EncodeOptions,
+    overwrite: bool,
+    progress: Progress,
+) -> Iterator[Task]:
+    """Tasks for the files that still need processing"""
+    for path in paths:
+        relative = os.path.relpath(path, base)
+        if relative.startswith(os.pardir + os.sep) or os.path.isabs(relative):
+            progress.failed += 1
+            print(f"Error processing {path}: not under {base}")
+            continue
+
+        filename = output_filename(relative, output_options(options, path))
+        targets = tuple(
+            (steps, os.path.join(output, directory, filename) if directory else os.path.join(output, filename))
+            for directory, steps in chains
+        )
+        if not overwrite and all(os.path.exists(target) for _, target in targets):
+            progress.skipped += 1
+            continue
+        yield Task(path, relative, targets, file_seed(seed, relative))
+
+
+def run(tasks: Iterator[Task], settings: Settings, workers: int, progress: Progress):
+    """Process ``tasks`` on ``workers`` processes, keeping at most two per worker in flight"""
+    pending: Set[Future] = set()
+    sources = {}
+
+    def collect(done: Set[Future]):
+        for future in done:
+            task = sources.pop(future)
+            try:
+                pixels, written = future.result()
+            except Exception as e:
+                progress.failed += 1
+                print(f"Error processing {task.source}: {e}")
+                continue
+            progress.done += 1
+            progress.pixels += pixels
+            progress.bytes += written
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for task in tasks:
+            future = pool.submit(process_file, task, settings)
+            sources[future] = task
+            pending.add(future)
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            progress.report()
+
+        while pending:
+            done, pending = wait(pending, timeout=REPORT_INTERVAL, return_when=FIRST_COMPLETED)
+            collect(done)
+            progress.report()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", nargs="?", help="directory to process recursively")
+    parser.add_argument("output", help="directory for the results")
+    parser.add_argument("--list", help="file with one input path per line instead of a directory, - for stdin")
+    parser.add_argument("--base", default=".", help="directory --list paths are relative to in the output (default: .)")
+    parser.add_argument("--effects", help="comma-separated effects, one output per effect")
+    parser.add_argument("--pipeline", help="effect chain as for /apply-pipeline, one output per file")
+    parser.add_argument("--seed", type=int, help="make grain reproducible; each file gets its own seed")
+    parser.add_argument("--max-size", type=int, help="downscale so the longest side is at most this")
+    parser.add_argument("--crop", help="left,top,width,height to keep before processing")
+    parser.add_argument("--aspect", help="keep the largest centered box of this ratio, e.g. 4:5")
+    parser.add_argument("--size", help="resize to exactly WIDTHxHEIGHT")
+    parser.add_argument("--format", default="jpeg", choices=[*available_formats(), "original"], help="output format")
+    parser.add_argument("--quality", type=int, help="1-100, default per format")
+    parser.add_argument("--subsampling", choices=SUBSAMPLING, help="JPEG chroma subsampling")
+    parser.add_argument("--progressive", action="store_true", help="write progressive JPEGs")
+    parser.add_argument("--optimize", action="store_true", help="smaller files for more CPU")
+    parser.add_argument("--keep-metadata", action="store_true", help="copy EXIF and ICC profiles")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: CPU count)")
+    parser.add_argument("--overwrite", action="store_true", help="process files whose outputs already exist")
+    args = parser.parse_args(argv)
+
+    if (args.input is None) == (args.list is None):
+        parser.error("give either an input directory or --list")
+    if (args.effects is None) == (args.pipeline is None):
+        parser.error("give exactly one of --effects and --pipeline")
+    if args.quality is not None and not 1 <= args.quality <= 100:
+        parser.error("--quality must be between 1 and 100")
+    if args.max_size is not None and args.max_size <= 0:
+        parser.error("--max-size must be positive")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    try:
+        if args.pipeline is not None:
+            chains = [("", parse_steps(args.pipeline))]
+        else:
+            steps = parse_steps(args.effects)
+            names = [step.effect for step in steps]
+            repeated = next((name for name in names if names.count(name) > 1), None)
+            if repeated is not None:
+                # Each effect writes to its own directory
+                parser.error(f"effect '{repeated}' is given more than once")
+            chains = [(step.effect, (step,)) for step in steps] if len(steps) > 1 else [("", steps)]
+        geometry = Geometry.parse(args.crop, args.aspect, args.size)
+    except ValueError as e:
+        parser.error(str(e))
+
+    fmt = "ORIGINAL" if args.format == "original" else available_formats()[args.format]
+    options = EncodeOptions(fmt, args.quality, args.subsampling, args.progressive, args.optimize, args.keep_metadata)
+    settings = Settings(args.max_size, options, geometry)
+
+    paths = walk(args.input) if args.input is not None else read_list(args.list)
+    base = args.input if args.input is not None else args.base
+    progress = Progress()
+    tasks = plan_tasks(paths, base, args.output, chains, args.seed, options, args.overwrite, progress)
+    try:
+        run(tasks, settings, args.workers, progress)
+    except KeyboardInterrupt:
+        print("\nInterrupted; rerun the same command to continue")
+        progress.report(force=True)
+        sys.exit(130)
+
+    progress.report(force=True)
+    if progress.failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Content-addressed cache of processed images.
+
+Results are keyed by a hash of the input bytes plus everything that affects
+the output (effect, seed, size, encoding). A memory tier keeps the most
+recently used results within a byte budget, and an optional disk tier
+holds a larger working set, evicting the least recently used files once it
+outgrows its size limit.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+def result_key(digest: str, **params: Any) -> str:
+    """Cache key (and ETag) for processing ``digest`` with ``params``"""
+    encoded = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{digest}:{encoded}".encode("utf-8")).hexdigest()
+
+
+class _DiskTier:
+    """Directory of cached results with least-recently-used eviction
+
+    The lock covers only the index; files are read, written and removed
+    outside it, since results are renamed into place whole.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self._bytes += size
+        self._remove(self._evict())
+
+    @property
+    def size(self) -> int:
+        return self._bytes
+
+    @property
+    def entries(self) -> int:
+        return len(self._files)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._files:
+                return None
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            with self._lock:
+                self._forget(key)
+            return None
+
+        with self._lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+        return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+
+        # Write to a temp file first so readers never see a partial result
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+
+        with self._lock:
+            self._forget(key)
+            self._files[key] = len(data)
+            self._bytes += len(data)
+            evicted = self._evict()
+        self._remove(evicted)
+
+    def _forget(self, key: str):
+        size = self._files.pop(key, None)
+        if size is not None:
+            self._bytes -= size
+
+    def _evict(self) -> List[str]:
+        """Drop least recently used entries until within the limit; returns their keys"""
+        evicted = []
+        while self._bytes > self.max_bytes and self._files:
+            key, size = self._files.popitem(last=False)
+            self._bytes -= size
+            evicted.append(key)
+        return evicted
+
+    def _remove(self, keys: List[str]):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+
+class ResultCache:
+    """Two-tier LRU cache of processed image bytes"""
+
+    def __init__(self, memory_bytes: int, disk_dir: Optional[str] = None, disk_bytes: int = 0):
+        self.memory_bytes = memory_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        self._disk = _DiskTier(disk_dir, disk_bytes) if disk_dir and disk_bytes > 0 else None
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        """Build a cache from RESULT_CACHE_BYTES, RESULT_CACHE_DIR and RESULT_CACHE_DISK_BYTES"""
+        return cls(
+            memory_bytes=int(os.getenv("RESULT_CACHE_BYTES", 64 * 1024 * 1024)),
+            disk_dir=os.getenv("RESULT_CACHE_DIR") or None,
+            disk_bytes=int(os.getenv("RESULT_CACHE_DISK_BYTES", 1024 * 1024 * 1024)),
+        )
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return cached bytes for ``key`` or None; may read from disk"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                self.bytes_saved += len(data)
+                return data
+
+        # Disk reads don't hold up lookups on other threads
+        data = self._disk.get(key) if self._disk else None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+
+            self.disk_hits += 1
+            self.bytes_saved += len(data)
+            self._remember(key, data)
+            return data
+
+    def put(self, key: str, data: bytes):
+        """Store a result in both tiers; may write to disk"""
+        with self._lock:
+            self._remember(key, data)
+        if self._disk:
+            self._disk.put(key, data)
+
+    def _remember(self, key: str, data: bytes):
+        if len(data) > self.memory_bytes:
+            return
+
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old)
+        self._memory[key] = data
+        self._memory_size += len(data)
+
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_entries": self._disk.entries if self._disk else 0,
+                "disk_bytes": self._disk.size if self._disk else 0,
+            }
@@ -0,0 +1,347 @@
+"""Image effects applied by the Lensify API."""
+
+from typing import Optional, Tuple
+
+from PIL import Image, ImageEnhance, ImageFilter
+import numpy as np
+
+import grain
+import kernels
+import lut
+import masks
+from overlay import Overlay
+
+# Per-channel color grades, precomputed as (red, green, blue) lookup tables
+WARM_LUTS = (lut.linear(1.1), lut.IDENTITY, lut.linear(0.9))
+COOL_LUTS = (lut.linear(0.9), lut.IDENTITY, lut.linear(1.1))
+KODAK_LUTS = (lut.linear(1.15, 10), lut.linear(1.05, 5), lut.linear(0.92, -5))
+FUJI_LUTS = (lut.linear(0.95), lut.linear(1.12, 8), lut.linear(1.08, 5))
+POLAROID_LUTS = (lut.linear(1.08, 12), lut.linear(1.03, 8), lut.linear(0.88, -8))
+EXPIRED_LUTS = (lut.linear(1.12, 15), lut.linear(0.92, -10), lut.linear(1.05, 5))
+CROSS_PROCESS_LUTS = (lut.curve(0.8, 1.3), lut.curve(1.4, 0.9, 0.1), lut.curve(1.1, 1.1, 0.05))
+
+# Sepia transformation matrix for vintage
+SEPIA_MATRIX = np.array([
+    [0.393, 0.769, 0.189],
+    [0.349, 0.686, 0.168],
+    [0.272, 0.534, 0.131]
+])
+
+# Orange/red light leak, relative strength per RGB channel
+LIGHT_LEAK_TINT = np.array([1.0, 0.6, 0.2], dtype=np.float32)
+
+
+# Float stages of the analog effects, shared with the pipeline compiler.
+# Randomness is drawn up front by a plan function (``plan(height, width,
+# rng)``); the stage then takes the float32 pixels left by the effect's
+# color grade, the plan and the first image row the pixels hold, and
+# modifies them in place. Planning first lets tiled processing apply a
+# stage band by band with the same result as the whole image.
+
+def kodak_finish(pixels: np.ndarray, plan: grain.GrainPlan, top: int = 0):
+    """Kodak grain and slight contrast boost"""
+    grain.apply_grain(pixels, 8, plan, top)
+    np.clip(pixels, 0, 255, out=pixels)
+    
+    pixels -= 128
+    pixels *= 1.1
+    pixels += 128
+    np.clip(pixels, 0, 255, out=pixels)
+
+
+def fuji_grain(pixels: np.ndarray, plan: grain.GrainPlan, top: int = 0):
+    """Fine Fuji grain"""
+    grain.apply_grain(pixels, 6, plan, top)
+    np.clip(pixels, 0, 255, out=pixels)
+
+
+def polaroid_finish(pixels: np.ndarray, plan: grain.GrainPlan, top: int = 0):
+    """Coarse instant film grain and slight overexposure"""
+    grain.apply_grain(pixels, 12, plan, top)
+    np.clip(pixels, 0, 255, out=pixels)
+    
+    pixels *= 1.05
+    pixels += 10
+    np.clip(pixels, 0, 255, out=pixels)
+
+
+def cross_process_grain(pixels: np.ndarray, plan: grain.GrainPlan, top: int = 0):
+    """Slight cross-processing grain"""
+    grain.apply_grain(pixels, 5, plan, top)
+    np.clip(pixels, 0, 255, out=pixels)
+
+
+def plan_expired(height: int, width: int, rng: np.random.Generator) -> Tuple:
+    """Light leak, grain and scratch placement for :func:`expired_artifacts`"""
+    # Add random light leaks
+    leak_intensity = rng.uniform(20, 40)
+    leak_x = rng.integers(0, width)
+    leak_y = rng.integers(0, height)
+    leak_radius = min(width, height) // 4
+    leak = Overlay(height, width)
+    leak.add_disc(leak_y, leak_x, leak_radius, np.array([leak_intensity, leak_intensity * 0.7, 0]))
+    
+    grain_plan = grain.plan_grain(height, width, rng)
+    
+    # Random vertical scratches
+    scratches = Overlay(height, width)
+    for _ in range(rng.integers(2, 6)):
+        scratch_x = rng.integers(0, width)
+        scratch_width = rng.integers(1, 3)
+        scratch_intensity = rng.uniform(30, 60)
+        scratches.add_columns(scratch_x, min(scratch_x + scratch_width, width), scratch_intensity)
+    
+    return leak, grain_plan, scratches
+
+
+def expired_artifacts(pixels: np.ndarray, plan: Tuple, top: int = 0):
+    """Light leak, heavy grain and vertical scratches of expired film"""
+    leak, grain_plan, scratches = plan
+    
+    # Light leak, then heavy grain, with scratches on top
+    leak.apply(pixels, top)
+    grain.apply_grain(pixels, 15, grain_plan, top)
+    np.clip(pixels, 0, 255, out=pixels)
+    scratches.apply(pixels, top)
+
+
+def plan_light_leaks(height: int, width: int, rng: np.random.Generator) -> Tuple:
+    """Placement and color of the leaks drawn by :func:`light_leaks`"""
+    leaks = Overlay(height, width)
+    falloff = np.sqrt(height**2 + width**2) / 3
+    
+    # Create multiple light leaks
+    for _ in range(rng.integers(1, 3)):
+        leak_intensity = rng.uniform(40, 80)
+        
+        # Random corner or edge placement
+        corner = rng.choice(['top-left', 'top-right', 'bottom-left', 'bottom-right', 'edge'])
+        
+        if corner == 'top-left':
+            leak_center = (height // 4, width // 4)
+        elif corner == 'top-right':
+            leak_center = (height // 4, 3 * width // 4)
+        elif corner == 'bottom-left':
+            leak_center = (3 * height // 4, width // 4)
+        elif corner == 'bottom-right':
+            leak_center = (3 * height // 4, 3 * width // 4)
+        else:  # edge
+            if rng.random() > 0.5:  # vertical edge
+                leak_center = (rng.integers(0, height), 0 if rng.random() > 0.5 else width-1)
+            else:  # horizontal edge
+                leak_center = (0 if rng.random() > 0.5 else height-1, rng.integers(0, width))
+        
+        # Warm light leak (orange/red)
+        leaks.add_glow(*leak_center, falloff, leak_intensity, LIGHT_LEAK_TINT)
+    
+    return leaks, grain.plan_grain(height, width, rng)
+
+
+def light_leaks(pixels: np.ndarray, plan: Tuple, top: int = 0):
+    """One or two warm light leaks from the corners or edges, plus subtle grain"""
+    leaks, grain_plan = plan
+    
+    # Every leak in one low-resolution overlay
+    leaks.apply(pixels, top)
+    
+    # Add subtle grain
+    grain.apply_grain(pixels, 4, grain_plan, top)
+    np.clip(pixels, 0, 255, out=pixels)
+
+
+def saturate(image: Image.Image, factor: float) -> Image.Image:
+    """Scale color saturation with ``ImageEnhance.Color``"""
+    return ImageEnhance.Color(image).enhance(factor)
+
+
+class ImageEffects:
+    """Effects take a PIL image and return the processed RGB image.
+    
+    Every effect accepts an optional NumPy ``Generator``; the analog effects
+    draw all of their randomness (grain, leaks, scratches) from it so a
+    seeded generator gives reproducible output.
+    """
+    
+    @staticmethod
+    def vintage(image: Image.Image, rng: Optional[np.random.Generator] = None) -> Image.Image:
+        """Apply vintage effect"""
+        # Reduce saturation
+        enhancer = ImageEnhance.Color(image)
+        image = enhancer.enhance(0.8)
+        
+        # Add sepia tone
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        
+        return kernels.color_matrix(image, SEPIA_MATRIX)
+    
+    @staticmethod
+    def black_white(image: Image.Image, rng: Optional[np.random.Generator] = None) -> Image.Image:
+        """Convert to black and white"""
+        return image.convert("L").convert("RGB")
+    
+    @staticmethod
+    def cinematic(image: Image.Image, rng: Optional[np.random.Generator] = None) -> Image.Image:
+        """Apply cinematic effect"""
+        # Increase contrast and reduce brightness slightly
+        contrast = ImageEnhance.Contrast(image)
+        image = contrast.enhance(1.2)
+        
+        brightness = ImageEnhance.Brightness(image)
+        image = brightness.enhance(0.9)
+        
+        return image
+    
+    @staticmethod
+    def lomo(image: Image.Image, rng: Optional[np.random.Generator] = None) -> Image.Image:
+        """Apply lomo effect"""
+        # Increase saturation and add vignette effect
+        image = saturate(image, 1.5)
+        
+        # Darken edges (simple vignette)
+        width, height = image.size
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        
+        pixels = np.asarray(image, dtype=np.float32)
+        
+        # Apply cached vignette mask
+        pixels *= masks.vignette(width, height)[:, :, None]
+        
+        return kernels.to_image(pixels)
+    
+    @staticmethod
+    def warm(image: Image.Image, rng: Optional[np.random.Generator] = None) -> Image.Image:
+        """Apply warm filter"""
+        # Warm filter: enhance reds and reduce blues
+        return lut.apply(image, WARM_LUTS)
+    
+    @staticmethod
+    def cool(image: Image.Image, rng: Optional[np.random.Generator] = None) -> Image.Image:
+        """Apply cool filter"""
+        # Cool filter: enhance blues and reduce reds
+        return lut.apply(image, COOL_LUTS)
+    
+    @staticmethod
+    def sharp(image: Image.Image, rng: Optional[np.random.Generator] = None) -> Image.Image:
+        """Apply sharpening filter"""
+        return image.filter(ImageFilter.SHARPEN)
+    
+    @staticmethod
+    def soft(image: Image.Image, rng: Optional[np.random.Generator] = None) -> Image.Image:
+        """Apply soft/blur filter"""
+        return image.filter(ImageFilter.BLUR)
+    
+    @staticmethod
+    def analog_kodak(image: Image.Image, rng: Optional[np.random.Generator] = None) -> Image.Image:
+        """Apply Kodak film analog effect"""
+        rng = rng or np.random.default_rng()
+        
+        # Kodak color grading - warmer tones, enhanced contrast
+        # Boost reds and oranges, slightly desaturate blues
+        pixels = lut.apply_float(image, KODAK_LUTS)
+        
+        # Add film grain and a slight contrast boost
+        kodak_finish(pixels, grain.plan_grain(*pixels.shape[:2], rng))
+        
+        return kernels.to_image(pixels)
+    
+    @staticmethod
+    def analog_fuji(image: Image.Image, rng: Optional[np.random.Generator] = None) -> Image.Image:
+        """Apply Fuji film analog effect"""
+        rng = rng or np.random.default_rng()
+        
+        # Fuji color grading - cooler tones, enhanced greens
+        pixels = lut.apply_float(image, FUJI_LUTS)
+        
+        # Add fine film grain
+        fuji_grain(pixels, grain.plan_grain(*pixels.shape[:2], rng))
+        
+        # Subtle saturation boost
+        return saturate(kernels.to_image(pixels), 1.15)
+    
+    @staticmethod
+    def analog_polaroid(image: Image.Image, rng: Optional[np.random.Generator] = None) -> Image.Image:
+        """Apply Polaroid instant film effect"""
+        rng = rng or np.random.default_rng()
+        
+        # Polaroid characteristic warm color cast
+        pixels = lut.apply_float(image, POLAROID_LUTS)
+        height, width = pixels.shape[:2]
+        
+        # Add characteristic Polaroid border fade
+        pixels *= masks.border_fade(width, height)[:, :, None]
+        
+        # Add coarse grain for instant film texture and slight overexposure
+        polaroid_finish(pixels, grain.plan_grain(height, width, rng))
+        
+        return kernels.to_image(pixels)
+    
+    @staticmethod
+    def analog_expired(image: Image.Image, rng: Optional[np.random.Generator] = None) -> Image.Image:
+        """Apply expired film effect with color shifts and artifacts"""
+        rng = rng or np.random.default_rng()
+        
+        # Expired film color shifts - magenta/green cast
+        pixels = lut.apply_float(image, EXPIRED_LUTS)
+        
+        # Random light leak, heavy grain and scratches
+        expired_artifacts(pixels, plan_expired(*pixels.shape[:2], rng))
+        
+        return kernels.to_image(pixels)
+    
+    @staticmethod
+    def analog_cross_process(image: Image.Image, rng: Optional[np.random.Generator] = None) -> Image.Image:
+        """Apply cross-processing effect (developing slide film in print chemicals)"""
+        rng = rng or np.random.default_rng()
+        
+        # Cross-processing color inversion characteristics
+        # Characteristic S-curve per channel: red boosts highlights,
+        # green compresses midtones, blue boosts shadows
+        pixels = lut.apply_float(image, CROSS_PROCESS_LUTS)
+        
+        # Add slight grain
+        cross_process_grain(pixels, grain.plan_grain(*pixels.shape[:2], rng))
+        
+        return kernels.to_image(pixels)
+    
+    @staticmethod
+    def analog_light_leak(image: Image.Image, rng: Optional[np.random.Generator] = None) -> Image.Image:
+        """Apply light leak effect with orange/red casting"""
+        rng = rng or np.random.default_rng()
+        
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        
+        pixels = np.array(image, dtype=np.float32)
+        light_leaks(pixels, plan_light_leaks(*pixels.shape[:2], rng))
+        
+        return kernels.to_image(pixels)
+
+# Effects whose output depends on the random generator
+RANDOM_EFFECTS = frozenset({
+    "analog_kodak",
+    "analog_fuji",
+    "analog_polaroid",
+    "analog_expired",
+    "analog_cross_process",
+    "analog_light_leak",
+})
+
+# Available effects
+EFFECTS = {
+    "vintage": ImageEffects.vintage,
+    "black_white": ImageEffects.black_white,
+    "cinematic": ImageEffects.cinematic,
+    "lomo": ImageEffects.lomo,
+    "warm": ImageEffects.warm,
+    "cool": ImageEffects.cool,
+    "sharp": ImageEffects.sharp,
+    "soft": ImageEffects.soft,
+    "analog_kodak": ImageEffects.analog_kodak,
+    "analog_fuji": ImageEffects.analog_fuji,
+    "analog_polaroid": ImageEffects.analog_polaroid,
+    "analog_expired": ImageEffects.analog_expired,
+    "analog_cross_process": ImageEffects.analog_cross_process,
+    "analog_light_leak": ImageEffects.analog_light_leak,
+}
@@ -0,0 +1,152 @@
+"""Crop and resize geometry applied while an upload is decoded.
+
+A :class:`Geometry` picks the region of the upload to keep (a crop box,
+and/or the largest centered box of an aspect ratio) and the size to
+resize it to. It is applied before any effect runs, so discarded pixels
+are never processed, and position-dependent effects (vignettes, border
+fades, leaks) are laid out on the output frame. For JPEGs the decoder is
+asked for a DCT-scaled version just large enough to cover the output, so
+a small crop of a large photo also decodes less.
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+Box = Tuple[int, int, int, int]
+
+# Longest side allowed for an explicit output size
+MAX_OUTPUT_SIDE = 10000
+
+
+def scaled_size(size: Tuple[int, int], max_size: Optional[int] = None) -> Tuple[int, int]:
+    """Size of an image after limiting its longest side to ``max_size``"""
+    width, height = size
+    if not max_size or max(width, height) <= max_size:
+        return size
+
+    scale = max_size / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def downscale(image: Image.Image, max_size: Optional[int] = None) -> Image.Image:
+    """Downscale an opened, not yet loaded image to fit ``max_size``
+
+    JPEGs are decoded in draft mode, letting libjpeg scale by 1/2, 1/4 or
+    1/8 during the DCT, and the remaining factor is taken with ``reduce()``
+    before the final resample, so a small preview never pays for a
+    full-resolution decode.
+    """
+    size = scaled_size(image.size, max_size)
+    if size == image.size:
+        return image
+
+    # No-op for formats without DCT scaling
+    image.draft(None, size)
+    return image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+
+def _integers(value: str, separator: str, count: int, name: str, form: str) -> Tuple[int, ...]:
+    parts = value.lower().replace(" ", "").split(separator)
+    try:
+        numbers = tuple(int(part) for part in parts)
+    except ValueError:
+        numbers = ()
+    if len(numbers) != count:
+        raise ValueError(f"Invalid {name} '{value}', expected '{form}'")
+    return numbers
+
+
+@dataclass(frozen=True)
+class Geometry:
+    """Region to keep and output size, applied before effects
+
+    ``crop`` is ``(left, top, width, height)`` in upload pixels, clamped to
+    the image. ``aspect`` keeps the largest centered box of that ratio
+    inside the crop. ``size`` resizes the result to exactly
+    ``(width, height)``; without an ``aspect`` the box is first cropped to
+    the size's ratio, so nothing is stretched.
+    """
+
+    crop: Optional[Box] = None
+    aspect: Optional[Tuple[int, int]] = None
+    size: Optional[Tuple[int, int]] = None
+
+    @classmethod
+    def parse(cls, crop: Optional[str] = None, aspect: Optional[str] = None, size: Optional[str] = None) -> "Geometry":
+        """Parse the ``crop``, ``aspect`` and ``size`` form fields
+
+        Raises ``ValueError`` with a message suitable for the client.
+        """
+        crop_box = _integers(crop, ",", 4, "crop", "left,top,width,height") if crop else None
+        if crop_box and (crop_box[0] < 0 or crop_box[1] < 0 or crop_box[2] <= 0 or crop_box[3] <= 0):
+            raise ValueError("Crop needs a non-negative position and a positive width and height")
+
+        ratio = _integers(aspect, ":", 2, "aspect ratio", "width:height") if aspect else None
+        if ratio and min(ratio) <= 0:
+            raise ValueError("Aspect ratio sides must be positive")
+
+        output = _integers(size, "x", 2, "size", "WIDTHxHEIGHT") if size else None
+        if output and not (0 < min(output) and max(output) <= MAX_OUTPUT_SIDE):
+            raise ValueError(f"Size sides must be between 1 and {MAX_OUTPUT_SIDE}")
+
+        return cls(crop=crop_box, aspect=ratio, size=output)
+
+    def __bool__(self) -> bool:
+        return any((self.crop, self.aspect, self.size))
+
+    def box(self, size: Tuple[int, int]) -> Box:
+        """Region of an image of ``size`` to keep, as (left, upper, right, lower)
+
+        Raises ``ValueError`` when the crop lies outside the image.
+        """
+        width, height = size
+        left, upper, right, lower = 0, 0, width, height
+        if self.crop:
+            x, y, crop_width, crop_height = self.crop
+            left, upper = min(x, width), min(y, height)
+            right, lower = min(x + crop_width, width), min(y + crop_height, height)
+            if right <= left or lower <= upper:
+                raise ValueError(f"Crop {self.crop} lies outside the {width}x{height} image")
+
+        ratio = self.aspect or self.size
+        if ratio:
+            box_width, box_height = right - left, lower - upper
+            # Largest box of the ratio that fits, centered
+            fit_width = min(box_width, max(1, round(box_height * ratio[0] / ratio[1])))
+            fit_height = min(box_height, max(1, round(fit_width * ratio[1] / ratio[0])))
+            left += (box_width - fit_width) // 2
+            upper += (box_height - fit_height) // 2
+            right, lower = left + fit_width, upper + fit_height
+        return left, upper, right, lower
+
+    def output_size(self, size: Tuple[int, int], max_size: Optional[int] = None) -> Tuple[int, int]:
+        """Size of the processed image for an upload of ``size``"""
+        left, upper, right, lower = self.box(size)
+        return scaled_size(self.size or (right - left, lower - upper), max_size)
+
+    def apply(self, image: Image.Image, max_size: Optional[int] = None) -> Image.Image:
+        """Crop and resize an opened, not yet loaded image"""
+        if not self:
+            return downscale(image, max_size)
+
+        box = self.box(image.size)
+        size = self.output_size(image.size, max_size)
+        box_width, box_height = box[2] - box[0], box[3] - box[1]
+        if size == (box_width, box_height):
+            return image.crop(box)
+
+        # Ask the decoder for the smallest DCT scale that still covers the output
+        width, height = image.size
+        image.draft(None, (math.ceil(width * size[0] / box_width), math.ceil(height * size[1] / box_height)))
+        scale_x, scale_y = image.size[0] / width, image.size[1] / height
+        scaled_box = (box[0] * scale_x, box[1] * scale_y, box[2] * scale_x, box[3] * scale_y)
+        return image.resize(size, Image.Resampling.LANCZOS, box=scaled_box, reducing_gap=2.0)
+
+    def cache_params(self) -> Dict[str, Any]:
+        """Result cache parameters; empty without geometry so existing keys stay valid"""
+        if not self:
+            return {}
+        return {"crop": self.crop, "aspect": self.aspect, "size": self.size}
@@ -0,0 +1,100 @@
+"""Film grain from a bank of precomputed Gaussian noise tiles.
+
+Drawing a full-resolution Gaussian array per image is the most expensive
+step of the analog effects. Instead a small bank of unit-variance float32
+tiles is generated once per process and laid over the image block by
+block, each block picking a random tile and offset from the caller's
+generator. Grain is uncorrelated between pixels, so the block
+seams are invisible and the result is statistically the same as
+``np.random.normal(0, sigma, shape)`` at a fraction of the cost. With a
+seeded generator the output is fully reproducible.
+"""
+
+import threading
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+import kernels
+
+TILE_SIZE = 256
+TILE_COUNT = 4
+
+# Fixed seed so every worker process builds the same bank
+_BANK_SEED = 0x1E55
+
+_bank: Optional[np.ndarray] = None
+_bank_lock = threading.Lock()
+
+
+def noise_bank() -> np.ndarray:
+    """Unit-variance noise tiles, shaped (TILE_COUNT, 2 * TILE_SIZE, 2 * TILE_SIZE, 3)
+
+    Tiles are twice the block size so any ``TILE_SIZE`` window inside them
+    can be used, which gives each block a random offset.
+    """
+    global _bank
+    if _bank is None:
+        with _bank_lock:
+            if _bank is None:
+                rng = np.random.default_rng(_BANK_SEED)
+                bank = rng.standard_normal((TILE_COUNT, 2 * TILE_SIZE, 2 * TILE_SIZE, 3), dtype=np.float32)
+                bank.setflags(write=False)
+                _bank = bank
+    return _bank
+
+
+class GrainPlan(NamedTuple):
+    """Random tile choice and offset for every block of an image"""
+    tiles: np.ndarray
+    offsets: np.ndarray
+
+
+def plan_grain(height: int, width: int, rng: np.random.Generator) -> GrainPlan:
+    """Draw the grain layout of a ``height`` x ``width`` image
+
+    Blocks sit on a fixed ``TILE_SIZE`` grid of the full image, so any band
+    of rows can be grained separately with :func:`apply_grain` and matches
+    graining the whole image at once.
+    """
+    rows = -(-height // TILE_SIZE)
+    columns = -(-width // TILE_SIZE)
+    blocks = rows * columns
+
+    # One draw per block for tile and offset
+    tiles = rng.integers(0, TILE_COUNT, blocks)
+    offsets = rng.integers(0, TILE_SIZE, (blocks, 2))
+    return GrainPlan(tiles.reshape(rows, columns), offsets.reshape(rows, columns, 2))
+
+
+def apply_grain(pixels: np.ndarray, sigma: float, plan: GrainPlan, top: int = 0) -> np.ndarray:
+    """Add planned grain with standard deviation ``sigma`` to ``pixels`` in place
+
+    ``pixels`` is a float32 (rows, width, 3) array holding the image rows
+    starting at ``top``. Values are not clipped; callers clip once after
+    their last additive step.
+    """
+    bank = noise_bank()
+    height, width = pixels.shape[:2]
+    sigma = np.float32(sigma)
+    scratch = kernels.scratch("grain", (TILE_SIZE, TILE_SIZE, 3))
+
+    for row in range(top // TILE_SIZE, -(-(top + height) // TILE_SIZE)):
+        # Rows of this block row that fall inside the band
+        y0 = max(row * TILE_SIZE, top)
+        y1 = min((row + 1) * TILE_SIZE, top + height)
+        h = y1 - y0
+        skip = y0 - row * TILE_SIZE
+
+        for column, x in enumerate(range(0, width, TILE_SIZE)):
+            w = min(TILE_SIZE, width - x)
+            oy, ox = plan.offsets[row, column]
+            noise = bank[plan.tiles[row, column], oy + skip:oy + skip + h, ox:ox + w]
+
+            scaled = scratch[:h, :w]
+            np.multiply(noise, sigma, out=scaled)
+            target = pixels[y0 - top:y1 - top, x:x + w]
+            target += scaled
+
+    return pixels
+
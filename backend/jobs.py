@@ -0,0 +1,284 @@
+"""Background jobs for large batches.
+
+Submitting a job stores its uploads in a job directory and returns at
+once. The images are processed in the background, each result written
+next to the inputs, and clients poll the job for progress and download
+single results or a ZIP of everything. Jobs are deleted ``JOB_TTL``
+seconds after they finish; a job still being processed is never expired,
+however long it takes.
+
+A fixed number of dispatchers hand images to the worker pool, taking
+them from clients in turn, so one client's thousand-image job does not
+hold up another client's five images. Each client may have at most
+``MAX_CLIENT_JOBS`` unfinished jobs and ``MAX_CLIENT_JOB_BYTES`` of
+uploads stored, so no single client can fill the job directory.
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from metrics import ERRORS
+
+JOB_TTL = int(os.getenv("JOB_TTL", 3600))
+MAX_JOB_FILES = int(os.getenv("MAX_JOB_FILES", 1000))
+# Unfinished jobs per client, and bytes of uploads per client across its stored jobs
+MAX_CLIENT_JOBS = int(os.getenv("MAX_CLIENT_JOBS", 2))
+MAX_CLIENT_JOB_BYTES = int(os.getenv("MAX_CLIENT_JOB_BYTES", 1024 * 1024 * 1024))
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobLimitExceeded(Exception):
+    """A client has too many unfinished jobs or too much stored"""
+
+
+@dataclass
+class Job:
+    """A batch of images processed in the background
+
+    ``params`` is whatever the submitter needs to process an image; the
+    manager only passes it through.
+    """
+
+    id: str
+    client: str
+    directory: str
+    filenames: List[str]
+    params: Dict[str, Any]
+    size: int = 0
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    running: int = 0
+    cancelled: bool = False
+    statuses: List[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.statuses:
+            self.statuses = [PENDING] * len(self.filenames)
+
+    @property
+    def total(self) -> int:
+        return len(self.filenames)
+
+    @property
+    def done(self) -> int:
+        return self.statuses.count(DONE)
+
+    @property
+    def failed(self) -> int:
+        return self.statuses.count(FAILED)
+
+    @property
+    def complete(self) -> bool:
+        return PENDING not in self.statuses
+
+    @property
+    def status(self) -> str:
+        if self.complete:
+            return "done" if self.done else "failed"
+        if self.running or self.done or self.failed:
+            return "running"
+        return "queued"
+
+    def expires_at(self, ttl: int) -> Optional[float]:
+        """When the job is deleted, counted from when it finished; None until then"""
+        return self.finished + ttl if self.finished is not None else None
+
+    def input_path(self, index: int) -> str:
+        return os.path.join(self.directory, "inputs", str(index))
+
+    def result_path(self, index: int) -> str:
+        return os.path.join(self.directory, "results", str(index))
+
+
+def _write(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class JobManager:
+    """Job store in a temp directory plus fair background dispatch
+
+    ``run_item(job, index)`` processes one image and returns its encoded
+    bytes. ``concurrency`` dispatchers run at a time, which should match
+    the worker pool's capacity.
+    """
+
+    def __init__(
+        self,
+        run_item: Callable[[Job, int], Awaitable[bytes]],
+        directory: Optional[str] = None,
+        ttl: int = JOB_TTL,
+        concurrency: int = 1,
+        max_client_jobs: int = MAX_CLIENT_JOBS,
+        max_client_bytes: int = MAX_CLIENT_JOB_BYTES,
+    ):
+        self.run_item = run_item
+        self.directory = directory
+        self.ttl = ttl
+        self.max_client_jobs = max_client_jobs
+        self.max_client_bytes = max_client_bytes
+        self.concurrency = max(1, concurrency)
+        self._owns_directory = directory is None
+        self._jobs: Dict[str, Job] = {}
+        self._queues: "OrderedDict[str, Deque[Tuple[Job, int]]]" = OrderedDict()
+        self._pending: Optional[asyncio.Semaphore] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @classmethod
+    def from_env(cls, run_item: Callable[[Job, int], Awaitable[bytes]], concurrency: int = 1) -> "JobManager":
+        """Build a manager from JOB_DIR, JOB_TTL and the per-client limits"""
+        return cls(
+            run_item,
+            directory=os.getenv("JOB_DIR") or None,
+            ttl=JOB_TTL,
+            concurrency=concurrency,
+            max_client_jobs=MAX_CLIENT_JOBS,
+            max_client_bytes=MAX_CLIENT_JOB_BYTES,
+        )
+
+    async def start(self):
+        if self._tasks:
+            return
+
+        if self._owns_directory:
+            self.directory = tempfile.mkdtemp(prefix="lensify-jobs-")
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            await asyncio.to_thread(self._remove_orphans)
+
+        self._pending = asyncio.Semaphore(0)
+        self._tasks = [asyncio.create_task(self._dispatch()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._clean()))
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._jobs.clear()
+        self._queues.clear()
+        if self._owns_directory and self.directory:
+            await asyncio.to_thread(shutil.rmtree, self.directory, True)
+            self.directory = None
+
+    def check(self, client: str, size: int = 0):
+        """Raise :class:`JobLimitExceeded` if ``client`` can't store another job of ``size`` bytes
+
+        Limits of 0 are off.
+        """
+        jobs = [job for job in self._jobs.values() if job.client == client]
+        if self.max_client_jobs and sum(1 for job in jobs if not job.complete) >= self.max_client_jobs:
+            raise JobLimitExceeded(f"At most {self.max_client_jobs} unfinished jobs per client")
+        if self.max_client_bytes and sum(job.size for job in jobs) + size > self.max_client_bytes:
+            raise JobLimitExceeded(f"At most {self.max_client_bytes} bytes of job uploads stored per client")
+
+    async def submit(self, client: str, filenames: List[str], inputs: List[bytes], params: Dict[str, Any]) -> Job:
+        """Store a job's inputs and queue its images
+
+        Raises :class:`JobLimitExceeded` when the client is over its limits.
+        """
+        size = sum(len(data) for data in inputs)
+        self.check(client, size)
+        job_id = uuid.uuid4().hex
+        job = Job(job_id, client, os.path.join(self.directory, job_id), filenames, params, size)
+
+        def store():
+            os.makedirs(os.path.join(job.directory, "inputs"))
+            os.makedirs(os.path.join(job.directory, "results"))
+            for index, data in enumerate(inputs):
+                _write(job.input_path(index), data)
+
+        await asyncio.to_thread(store)
+        self._jobs[job_id] = job
+
+        queue = self._queues.setdefault(client, deque())
+        for index in range(job.total):
+            queue.append((job, index))
+            self._pending.release()
+        return job
+
+    @property
+    def queued_clients(self) -> int:
+        """Clients with images waiting to be dispatched"""
+        return len(self._queues)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def delete(self, job: Job):
+        """Cancel a job's remaining images and remove its files"""
+        job.cancelled = True
+        self._jobs.pop(job.id, None)
+        await asyncio.to_thread(shutil.rmtree, job.directory, True)
+
+    async def read_input(self, job: Job, index: int) -> bytes:
+        return await asyncio.to_thread(_read, job.input_path(index))
+
+    async def read_result(self, job: Job, index: int) -> bytes:
+        return await asyncio.to_thread(_read, job.result_path(index))
+
+    def _remove_orphans(self):
+        # Jobs live in memory, so job directories left by a previous process are orphans
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and len(entry.name) == 32 and all(c in "0123456789abcdef" for c in entry.name):
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _next(self) -> Tuple[Job, int]:
+        """Next image, taking clients in round-robin order"""
+        client, queue = next(iter(self._queues.items()))
+        item = queue.popleft()
+        del self._queues[client]
+        if queue:
+            self._queues[client] = queue
+        return item
+
+    async def _dispatch(self):
+        while True:
+            await self._pending.acquire()
+            job, index = self._next()
+            if job.cancelled:
+                continue
+
+            job.running += 1
+            try:
+                data = await self.run_item(job, index)
+                await asyncio.to_thread(_write, job.result_path(index), data)
+                job.statuses[index] = DONE
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not job.cancelled:
+                    ERRORS.inc(cause="processing")
+                    print(f"Error processing {job.filenames[index]}: {e}")
+                job.statuses[index] = FAILED
+            finally:
+                job.running -= 1
+
+            if job.complete and job.finished is None:
+                job.finished = time.time()
+                # Inputs are no longer needed once every image is processed
+                await asyncio.to_thread(shutil.rmtree, os.path.join(job.directory, "inputs"), True)
+
+    async def _clean(self):
+        while True:
+            await asyncio.sleep(max(1, min(60, self.ttl // 4)))
+            now = time.time()
+            for job in list(self._jobs.values()):
+                expires_at = job.expires_at(self.ttl)
+                if expires_at is not None and expires_at <= now:
+                    await self.delete(job)
@@ -0,0 +1,85 @@
+"""Float32 kernel helpers and per-worker scratch buffers.
+
+Effects work on float32 pixels modified in place. The buffers they need
+come from :func:`scratch`, a small pool kept per worker thread, so a
+worker processing images (or bands) of the same size reuses the same
+memory instead of allocating, page-faulting and freeing hundreds of
+megabytes per request. Operations whose NumPy form would build a
+temporary as large as the image (table lookups index through an intp
+array, matrix products go through float64) are run over chunks of
+rows instead, with chunk-sized scratch.
+"""
+
+import math
+import os
+import threading
+from typing import Iterator, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Scratch memory a worker thread keeps between images; buffers beyond it are freed after use
+SCRATCH_BYTES = int(os.getenv("SCRATCH_BYTES", 128 * 1024 * 1024))
+
+# Pixels per chunk for the chunked kernels, small enough to stay in cache
+CHUNK_PIXELS = 64 * 1024
+
+_local = threading.local()
+
+
+def scratch(name: str, shape: Tuple[int, ...], dtype=np.float32) -> np.ndarray:
+    """Uninitialized array for ``name``, reusing this thread's buffer when it is large enough
+
+    A buffer is only valid until the next call with the same name on the
+    same thread, so every concurrent use needs its own name.
+    """
+    buffers = getattr(_local, "buffers", None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+
+    dtype = np.dtype(dtype)
+    size = math.prod(shape) * dtype.itemsize
+    buffer = buffers.get(name)
+    if buffer is None or buffer.nbytes < size:
+        buffer = np.empty(size, dtype=np.uint8)
+        kept = sum(other.nbytes for key, other in buffers.items() if key != name)
+        if kept + size <= SCRATCH_BYTES:
+            buffers[name] = buffer
+    return buffer[:size].view(dtype).reshape(shape)
+
+
+def scratch_bytes() -> int:
+    """Scratch memory kept by the calling thread"""
+    return sum(buffer.nbytes for buffer in getattr(_local, "buffers", {}).values())
+
+
+def row_chunks(height: int, width: int) -> Iterator[slice]:
+    """Slices of about ``CHUNK_PIXELS`` pixels covering ``height`` rows"""
+    rows = max(1, CHUNK_PIXELS // max(width, 1))
+    for top in range(0, height, rows):
+        yield slice(top, min(top + rows, height))
+
+
+def to_image(pixels: np.ndarray) -> Image.Image:
+    """RGB image of float ``pixels``, truncated like ``astype(np.uint8)``"""
+    levels = scratch("levels", pixels.shape, np.uint8)
+    np.copyto(levels, pixels, casting="unsafe")
+    # fromarray copies RGB data, so the scratch can be reused right away
+    return Image.fromarray(levels)
+
+
+def color_matrix(image: Image.Image, matrix: np.ndarray) -> Image.Image:
+    """Mix RGB channels by a 3x3 ``matrix``, clipping and truncating like the float64 version"""
+    source = np.asarray(image)
+    height, width = source.shape[:2]
+    transposed = np.asarray(matrix, dtype=np.float32).T
+    out = scratch("levels", source.shape, np.uint8)
+
+    for rows in row_chunks(height, width):
+        chunk = scratch("chunk", source[rows].shape)
+        mixed = scratch("mixed", source[rows].shape)
+        np.copyto(chunk, source[rows])
+        np.matmul(chunk, transposed, out=mixed)
+        np.clip(mixed, 0, 255, out=mixed)
+        np.copyto(out[rows], mixed, casting="unsafe")
+    return Image.fromarray(out)
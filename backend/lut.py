@@ -0,0 +1,78 @@
+"""Per-channel lookup tables for point color operations.
+
+Every color grade in the effects is a function of a single 0-255 channel
+value, so it can be evaluated once for all 256 levels and applied to the
+image with a single table lookup instead of float math over every pixel.
+Tables keep the exact float result so effects that continue in float
+(grain, vignettes) see the same values as before.
+"""
+
+from typing import Callable, Sequence
+
+import numpy as np
+from PIL import Image
+
+import kernels
+
+LEVELS = np.arange(256, dtype=np.float64)
+
+IDENTITY = LEVELS.copy()
+
+# Offsets that turn an (R, G, B) pixel into indices of the concatenated tables
+_CHANNEL_OFFSETS = np.array([0, 256, 512], dtype=np.uint16)
+
+
+def build(fn: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+    """Evaluate ``fn`` over all 256 levels, clipped to the 0-255 range"""
+    return np.clip(fn(LEVELS), 0, 255)
+
+
+def linear(scale: float, offset: float = 0.0) -> np.ndarray:
+    """Table for ``clip(x * scale + offset, 0, 255)``"""
+    return build(lambda x: x * scale + offset)
+
+
+def curve(exponent: float, scale: float, offset: float = 0.0) -> np.ndarray:
+    """Table for ``clip((x / 255) ** exponent * scale + offset, 0, 1) * 255``"""
+    return build(lambda x: np.clip(np.power(x / 255.0, exponent) * scale + offset, 0, 1) * 255.0)
+
+
+def apply(image: Image.Image, luts: Sequence[np.ndarray]) -> Image.Image:
+    """Apply one table per RGB channel in a single pass"""
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    # Truncate like ``astype(np.uint8)`` so results match the float pipeline
+    return image.point(np.concatenate(luts).astype(np.uint8).tolist())
+
+
+def compose(first: Sequence[np.ndarray], second: Sequence[np.ndarray]) -> np.ndarray:
+    """Tables that apply ``second`` to the truncated output of ``first``"""
+    return np.stack([after[before.astype(np.uint8)] for before, after in zip(first, second)])
+
+
+def apply_into(source: np.ndarray, luts: Sequence[np.ndarray], out: np.ndarray) -> np.ndarray:
+    """Apply one table per channel to (height, width, 3) ``source`` into ``out``
+
+    ``source`` may be uint8 or float, and may be ``out`` itself; float
+    values are truncated to levels. The lookup runs over chunks of rows
+    with scratch indices, since ``take`` would otherwise build an intp
+    index array eight times the size of the image.
+    """
+    table = np.concatenate(luts).astype(out.dtype)
+    height, width = source.shape[:2]
+    for rows in kernels.row_chunks(height, width):
+        indices = kernels.scratch("lut_indices", source[rows].shape, np.uint16)
+        # Truncate before adding offsets; float sums can round up to the next level
+        np.copyto(indices, source[rows], casting="unsafe")
+        indices += _CHANNEL_OFFSETS
+        table.take(indices, out=out[rows], mode="clip")
+    return out
+
+
+def apply_float(image: Image.Image, luts: Sequence[np.ndarray], dtype=np.float32) -> np.ndarray:
+    """Apply one table per RGB channel, returning unrounded float pixels"""
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    source = np.asarray(image)
+    return apply_into(source, luts, np.empty(source.shape, dtype=dtype))
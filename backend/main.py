@@ -1,15 +1,154 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+import time
+
+# Taken before the imports below, which dominate cold start
+STARTED = time.perf_counter()
+
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from typing import List
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple, Union
+from multiprocessing import shared_memory
+import asyncio
 import io
-import zipfile
-from PIL import Image, ImageEnhance, ImageFilter
-import numpy as np
-import uvicorn
+import math
 import os
 
-app = FastAPI(title="Lensify API", version="1.0.0")
+from admission import AdmissionControl, Grant
+from cache import ResultCache, result_key
+from effects import EFFECTS, RANDOM_EFFECTS
+from encoding import SUBSAMPLING, EncodeOptions, available_formats, extension, media_type, output_filename
+from geometry import Geometry
+from jobs import DONE, MAX_JOB_FILES, PENDING, Job, JobLimitExceeded, JobManager
+import metrics
+from metrics import ERRORS, INPUT_PIXELS, OUTPUT_BYTES, CallbackGauge, MetricsMiddleware, observe_stage
+from pipeline import Step, cache_params, is_random, parse_steps
+from processing import decode_into_shared, decoded_shape, process_batch, process_pipeline, process_shared
+from scheduling import CostModel
+from uploads import MAX_FILES, NotAnImage, RequestBudget, RequestSizeLimit, Upload, ingest
+from warmup import WARMUP_SIZE, Startup, preload, wait_for_workers, warm_up, warmup_effects
+from workers import WorkerLost, WorkerPool
+from zipstream import ZipStream
+
+# Longest side of images processed with preview=true
+PREVIEW_MAX_SIZE = int(os.getenv("PREVIEW_MAX_SIZE", 512))
+
+# Most same-sized images of a batch processed as one stack in a single worker call
+MAX_STACK_IMAGES = int(os.getenv("MAX_STACK_IMAGES", 8))
+
+# Most expected seconds of work in one stack, so cheap requests never wait long for a worker
+MAX_STACK_SECONDS = float(os.getenv("MAX_STACK_SECONDS", 1))
+
+# CPU-heavy work runs on this pool so the event loop stays responsive
+worker_pool = WorkerPool.from_env()
+
+# Expected worker seconds per effect, calibrated at startup; orders queued work
+cost_model = CostModel.from_env()
+
+# Processed images keyed by input hash and processing options
+result_cache = ResultCache.from_env()
+
+# Bounds the pixels being processed at once; sheds load with 503/429
+admission = AdmissionControl.from_env()
+
+CallbackGauge("lensify_inflight_pixels", "Pixels admitted for processing", lambda: admission.in_flight)
+CallbackGauge("lensify_admission_queued", "Requests waiting for admission", lambda: admission.stats()["queued"])
+CallbackGauge("lensify_cache_hit_rate", "Result cache hit rate", lambda: result_cache.stats()["hit_rate"])
+CallbackGauge(
+    "lensify_worker_backlog_seconds",
+    "Expected seconds of work running or queued on the worker pool",
+    lambda: worker_pool.stats()["backlog_seconds"]
+)
+
+# Effects run in every worker before the instance reports ready
+startup_effects = warmup_effects()
+
+# Startup phase timings; /ready turns 200 once the workers are warm
+startup = Startup(STARTED)
+CallbackGauge("lensify_ready", "1 once the workers have warmed up", lambda: int(startup.ready))
+
+
+async def run_job_item(job: Job, index: int) -> bytes:
+    """Process one image of a background job"""
+    params = job.params
+    key = params["keys"][index]
+    seconds = cost_model.seconds(params["steps"], params["pixels"][index])
+    if key is not None:
+        cached = await asyncio.to_thread(result_cache.get, key)
+        if cached is not None:
+            return cached
+    
+    data = await job_manager.read_input(job, index)
+    grant = await admit(None, params["pixels"][index], seconds)
+    args = (
+        data,
+        params["steps"],
+        file_seed(params["seed"], index),
+        params["max_size"],
+        params["options"][index],
+        params["geometry"]
+    )
+    try:
+        try:
+            return await run_and_cache(key, process_pipeline, *args, cost=seconds)
+        except WorkerLost:
+            # Another task may have killed the worker; retry once on the restarted pool
+            return await run_and_cache(key, process_pipeline, *args, cost=seconds)
+    finally:
+        admission.release(grant)
+
+# Large batches submitted to /jobs, processed in the background
+job_manager = JobManager.from_env(run_job_item, concurrency=worker_pool.capacity)
+
+
+# Waits for the workers to warm up, at startup and after the pool is restarted
+warming: Optional[asyncio.Task] = None
+
+
+async def warm_workers():
+    """Wait for the workers to warm up, then calibrate the cost model from their timings"""
+    await wait_for_workers(worker_pool, startup)
+    cost_model.calibrate(startup.workers.values())
+
+
+def rewarm_workers():
+    """A worker died and the pool was restarted: not ready until the new workers are warm"""
+    global warming
+    startup.restart()
+    if warming is not None:
+        warming.cancel()
+    warming = asyncio.create_task(warm_workers())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global warming
+    startup.mark("imports")
+    worker_pool.start(initializer=warm_up, initargs=(startup_effects, WARMUP_SIZE))
+    worker_pool.on_restart = rewarm_workers
+    await job_manager.start()
+    preload()
+    startup.mark("start")
+    
+    # Serve /health right away; workers warm up in the background
+    warming = asyncio.create_task(warm_workers())
+    yield
+    warming.cancel()
+    await job_manager.shutdown()
+    worker_pool.shutdown()
+
+
+app = FastAPI(title="Lensify API", version="1.0.0", lifespan=lifespan)
+
+# Cut off oversized request bodies before they are parsed. Added first so
+# it runs inside CORS and browsers can read the 413.
+app.add_middleware(RequestSizeLimit)
+
+# Request counts, latency and the optional Server-Timing header; error
+# statuses only count for the endpoints that process images
+app.add_middleware(
+    MetricsMiddleware, error_endpoints=("/apply-effect", "/apply-pipeline", "/apply-effects", "/jobs")
+)
 
 # Configure CORS - Get allowed origins from environment
 allowed_origins = os.getenv(
@@ -23,344 +162,437 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Location", "Retry-After", "Server-Timing"],
 )
 
-# Image effects
-class ImageEffects:
-    @staticmethod
-    def vintage(image: Image.Image) -> Image.Image:
-        """Apply vintage effect"""
-        # Reduce saturation
-        enhancer = ImageEnhance.Color(image)
-        image = enhancer.enhance(0.8)
-        
-        # Add sepia tone
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        
-        pixels = np.array(image)
-        # Sepia transformation matrix
-        sepia_filter = np.array([
-            [0.393, 0.769, 0.189],
-            [0.349, 0.686, 0.168],
-            [0.272, 0.534, 0.131]
-        ])
-        
-        sepia_img = pixels @ sepia_filter.T
-        sepia_img = np.clip(sepia_img, 0, 255)
-        
-        return Image.fromarray(sepia_img.astype(np.uint8))
-    
-    @staticmethod
-    def black_white(image: Image.Image) -> Image.Image:
-        """Convert to black and white"""
-        return image.convert("L").convert("RGB")
-    
-    @staticmethod
-    def cinematic(image: Image.Image) -> Image.Image:
-        """Apply cinematic effect"""
-        # Increase contrast and reduce brightness slightly
-        contrast = ImageEnhance.Contrast(image)
-        image = contrast.enhance(1.2)
-        
-        brightness = ImageEnhance.Brightness(image)
-        image = brightness.enhance(0.9)
-        
-        return image
-    
-    @staticmethod
-    def lomo(image: Image.Image) -> Image.Image:
-        """Apply lomo effect"""
-        # Increase saturation and add vignette effect
-        enhancer = ImageEnhance.Color(image)
-        image = enhancer.enhance(1.5)
-        
-        # Darken edges (simple vignette)
-        width, height = image.size
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        
-        pixels = np.array(image)
-        
-        # Create vignette mask
-        Y, X = np.ogrid[:height, :width]
-        center_x, center_y = width // 2, height // 2
-        mask = np.sqrt((X - center_x)**2 + (Y - center_y)**2)
-        mask = mask / mask.max()
-        mask = np.clip(1.2 - mask, 0.6, 1.0)
-        
-        # Apply vignette
-        for i in range(3):
-            pixels[:, :, i] = pixels[:, :, i] * mask
-        
-        return Image.fromarray(pixels.astype(np.uint8))
-    
-    @staticmethod
-    def warm(image: Image.Image) -> Image.Image:
-        """Apply warm filter"""
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        
-        pixels = np.array(image).astype(float)
-        # Warm filter: enhance reds and reduce blues
-        pixels[:, :, 0] = np.clip(pixels[:, :, 0] * 1.1, 0, 255)  # Red
-        pixels[:, :, 2] = np.clip(pixels[:, :, 2] * 0.9, 0, 255)  # Blue
-        
-        return Image.fromarray(pixels.astype(np.uint8))
+
+def client_id(request: Request) -> str:
+    """Client address used for per-client limits
     
-    @staticmethod
-    def cool(image: Image.Image) -> Image.Image:
-        """Apply cool filter"""
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        
-        pixels = np.array(image).astype(float)
-        # Cool filter: enhance blues and reduce reds
-        pixels[:, :, 0] = np.clip(pixels[:, :, 0] * 0.9, 0, 255)  # Red
-        pixels[:, :, 2] = np.clip(pixels[:, :, 2] * 1.1, 0, 255)  # Blue
-        
-        return Image.fromarray(pixels.astype(np.uint8))
-    
-    @staticmethod
-    def sharp(image: Image.Image) -> Image.Image:
-        """Apply sharpening filter"""
-        return image.filter(ImageFilter.SHARPEN)
-    
-    @staticmethod
-    def soft(image: Image.Image) -> Image.Image:
-        """Apply soft/blur filter"""
-        return image.filter(ImageFilter.BLUR)
-    
-    @staticmethod
-    def analog_kodak(image: Image.Image) -> Image.Image:
-        """Apply Kodak film analog effect"""
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        
-        pixels = np.array(image).astype(float)
-        
-        # Kodak color grading - warmer tones, enhanced contrast
-        # Boost reds and oranges, slightly desaturate blues
-        pixels[:, :, 0] = np.clip(pixels[:, :, 0] * 1.15 + 10, 0, 255)  # Red boost
-        pixels[:, :, 1] = np.clip(pixels[:, :, 1] * 1.05 + 5, 0, 255)   # Slight green boost
-        pixels[:, :, 2] = np.clip(pixels[:, :, 2] * 0.92 - 5, 0, 255)   # Blue reduction
-        
-        # Add film grain
-        height, width = pixels.shape[:2]
-        grain = np.random.normal(0, 8, (height, width, 3))
-        pixels = np.clip(pixels + grain, 0, 255)
-        
-        # Slight contrast boost
-        pixels = np.clip((pixels - 128) * 1.1 + 128, 0, 255)
-        
-        return Image.fromarray(pixels.astype(np.uint8))
+    Behind a proxy this is only the real client's address when uvicorn
+    trusts the proxy's ``X-Forwarded-For`` (``FORWARDED_ALLOW_IPS``).
+    """
+    return request.client.host if request.client else ""
+
+def upload_pixels(upload: Upload, max_size: Optional[int], geometry: Geometry = Geometry()) -> int:
+    """Pixels processed for an upload once it is cropped and downscaled"""
+    return math.prod(geometry.output_size((upload.width, upload.height), max_size))
+
+def parse_geometry(crop: Optional[str], aspect: Optional[str], size: Optional[str]) -> Geometry:
+    """Crop and resize form fields, rejecting bad values with a 400"""
+    try:
+        return Geometry.parse(crop, aspect, size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def check_geometry(uploads: List[UploadFile], contents: List[Upload], geometry: Geometry):
+    """Reject a crop that lies outside any of the uploads"""
+    for file, upload in zip(uploads, contents):
+        try:
+            geometry.box((upload.width, upload.height))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"{file.filename}: {e}")
+
+async def read_upload(file: UploadFile, budget: RequestBudget) -> Optional[Upload]:
+    """Validate an upload's header and size, then read and hash it
+
+    Returns None for files that aren't readable images; raises a 413
+    HTTPException when a size or pixel limit is exceeded.
+    """
+    start = time.perf_counter()
+    try:
+        upload = await asyncio.to_thread(ingest, file.file, file.filename, file.size, budget)
+    except NotAnImage as e:
+        ERRORS.inc(cause="not_an_image")
+        print(f"Error processing {file.filename}: {e}")
+        return None
+    finally:
+        observe_stage("read", time.perf_counter() - start)
     
-    @staticmethod
-    def analog_fuji(image: Image.Image) -> Image.Image:
-        """Apply Fuji film analog effect"""
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        
-        pixels = np.array(image).astype(float)
-        
-        # Fuji color grading - cooler tones, enhanced greens
-        pixels[:, :, 0] = np.clip(pixels[:, :, 0] * 0.95, 0, 255)      # Slight red reduction
-        pixels[:, :, 1] = np.clip(pixels[:, :, 1] * 1.12 + 8, 0, 255)  # Green boost
-        pixels[:, :, 2] = np.clip(pixels[:, :, 2] * 1.08 + 5, 0, 255)  # Blue boost
-        
-        # Add fine film grain
-        height, width = pixels.shape[:2]
-        grain = np.random.normal(0, 6, (height, width, 3))
-        pixels = np.clip(pixels + grain, 0, 255)
-        
-        # Subtle saturation boost
-        img_temp = Image.fromarray(pixels.astype(np.uint8))
-        enhancer = ImageEnhance.Color(img_temp)
-        img_temp = enhancer.enhance(1.15)
-        
-        return img_temp
+    INPUT_PIXELS.observe(upload.width * upload.height)
+    return upload
+
+def worker_lost(filename: str, e: WorkerLost) -> HTTPException:
+    """503 for a request whose worker died; the restarted pool can take a retry"""
+    ERRORS.inc(cause="worker_lost")
+    print(f"Error processing {filename}: {e}")
+    return HTTPException(
+        status_code=503, detail="Worker restarted, try again", headers={"Retry-After": str(admission.retry_after)}
+    )
+
+async def admit(client: Optional[str], cost: int, seconds: float = 0.0) -> Grant:
+    """Acquire admission for ``cost`` pixels expected to take ``seconds``, timing the wait"""
+    start = time.perf_counter()
+    try:
+        return await admission.acquire(client, cost, seconds)
+    finally:
+        observe_stage("admission", time.perf_counter() - start)
+
+def encode_options(
+    output_format: str,
+    quality: Optional[int],
+    subsampling: Optional[str],
+    progressive: bool,
+    optimize: bool,
+    keep_metadata: bool
+) -> EncodeOptions:
+    """Validate the output encoding form fields"""
+    name = output_format.strip().lower()
+    formats = available_formats()
+    if name == "original":
+        fmt = "ORIGINAL"
+    elif name in formats:
+        fmt = formats[name]
+    else:
+        choices = ", ".join([*formats, "original"])
+        raise HTTPException(status_code=400, detail=f"Format '{output_format}' not supported, expected one of {choices}")
     
-    @staticmethod
-    def analog_polaroid(image: Image.Image) -> Image.Image:
-        """Apply Polaroid instant film effect"""
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        
-        pixels = np.array(image).astype(float)
-        height, width = pixels.shape[:2]
-        
-        # Polaroid characteristic warm color cast
-        pixels[:, :, 0] = np.clip(pixels[:, :, 0] * 1.08 + 12, 0, 255)  # Warm red
-        pixels[:, :, 1] = np.clip(pixels[:, :, 1] * 1.03 + 8, 0, 255)   # Slight yellow
-        pixels[:, :, 2] = np.clip(pixels[:, :, 2] * 0.88 - 8, 0, 255)   # Reduced blue
-        
-        # Add characteristic Polaroid border fade
-        Y, X = np.ogrid[:height, :width]
-        center_x, center_y = width // 2, height // 2
-        
-        # Create border fade effect
-        border_fade = np.minimum(
-            np.minimum(X, width - X),
-            np.minimum(Y, height - Y)
+    if subsampling is not None and subsampling not in SUBSAMPLING:
+        raise HTTPException(
+            status_code=400, detail=f"Subsampling '{subsampling}' not supported, expected one of {', '.join(SUBSAMPLING)}"
         )
-        border_fade = border_fade.astype(float) / min(width, height) * 4
-        border_fade = np.clip(border_fade, 0.7, 1.0)
-        
-        for i in range(3):
-            pixels[:, :, i] = pixels[:, :, i] * border_fade
-        
-        # Add coarse grain for instant film texture
-        grain = np.random.normal(0, 12, (height, width, 3))
-        pixels = np.clip(pixels + grain, 0, 255)
-        
-        # Slight overexposure effect
-        pixels = np.clip(pixels * 1.05 + 10, 0, 255)
-        
-        return Image.fromarray(pixels.astype(np.uint8))
     
-    @staticmethod
-    def analog_expired(image: Image.Image) -> Image.Image:
-        """Apply expired film effect with color shifts and artifacts"""
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        
-        pixels = np.array(image).astype(float)
-        height, width = pixels.shape[:2]
-        
-        # Expired film color shifts - magenta/green cast
-        pixels[:, :, 0] = np.clip(pixels[:, :, 0] * 1.12 + 15, 0, 255)  # Red/magenta boost
-        pixels[:, :, 1] = np.clip(pixels[:, :, 1] * 0.92 - 10, 0, 255)  # Green reduction
-        pixels[:, :, 2] = np.clip(pixels[:, :, 2] * 1.05 + 5, 0, 255)   # Slight blue boost
-        
-        # Add random light leaks
-        leak_intensity = np.random.uniform(20, 40)
-        leak_x = np.random.randint(0, width)
-        leak_y = np.random.randint(0, height)
-        leak_radius = min(width, height) // 4
-        
-        Y, X = np.ogrid[:height, :width]
-        leak_mask = (X - leak_x)**2 + (Y - leak_y)**2 <= leak_radius**2
-        
-        # Apply light leak
-        pixels[leak_mask, 0] = np.clip(pixels[leak_mask, 0] + leak_intensity, 0, 255)
-        pixels[leak_mask, 1] = np.clip(pixels[leak_mask, 1] + leak_intensity * 0.7, 0, 255)
-        
-        # Heavy grain and scratches
-        grain = np.random.normal(0, 15, (height, width, 3))
-        pixels = np.clip(pixels + grain, 0, 255)
-        
-        # Random vertical scratches
-        for _ in range(np.random.randint(2, 6)):
-            scratch_x = np.random.randint(0, width)
-            scratch_width = np.random.randint(1, 3)
-            scratch_intensity = np.random.uniform(30, 60)
+    return EncodeOptions(
+        format=fmt,
+        quality=quality,
+        subsampling=subsampling,
+        progressive=progressive,
+        optimize=optimize,
+        keep_metadata=keep_metadata,
+    )
+
+def cache_key(
+    digest: str,
+    effect: str,
+    seed: Optional[List[int]],
+    max_size: Optional[int],
+    options: EncodeOptions,
+    geometry: Geometry = Geometry()
+) -> Optional[str]:
+    """Result cache key, or None when the output is random and can't be reused"""
+    if effect not in RANDOM_EFFECTS:
+        seed = None
+    elif seed is None:
+        return None
+    return result_key(
+        digest, effect=effect, seed=seed, max_size=max_size, **geometry.cache_params(), **options.cache_params()
+    )
+
+def pipeline_cache_key(
+    digest: str,
+    steps: Tuple[Step, ...],
+    seed: Optional[List[int]],
+    max_size: Optional[int],
+    options: EncodeOptions,
+    geometry: Geometry = Geometry()
+) -> Optional[str]:
+    """Result cache key for an effect chain, or None when it can't be reused"""
+    if not is_random(steps):
+        seed = None
+    elif seed is None:
+        return None
+    return result_key(
+        digest, pipeline=cache_params(steps), seed=seed, max_size=max_size,
+        **geometry.cache_params(), **options.cache_params()
+    )
+
+def combined_etag(keys: List[Optional[str]]) -> Optional[str]:
+    """ETag for a response made of several cached results"""
+    if not keys or any(key is None for key in keys):
+        return None
+    return result_key("", keys=keys)
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Check an If-None-Match header against a strong ETag"""
+    if not if_none_match or not etag:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or f'"{etag}"' in candidates
+
+async def run_and_cache(key: Optional[str], fn: Callable[..., bytes], *args: Any, cost: float = 0.0) -> bytes:
+    """Compute a result on the worker pool, expected to take ``cost`` seconds, and store it under ``key``"""
+    processed_data = await worker_pool.run(fn, *args, cost=cost)
+    OUTPUT_BYTES.observe(len(processed_data))
+    if key is not None:
+        await asyncio.to_thread(result_cache.put, key, processed_data)
+    return processed_data
+
+async def cached_run(key: Optional[str], fn: Callable[..., bytes], *args: Any, cost: float = 0.0) -> bytes:
+    """Return a cached result for ``key`` or compute it on the worker pool"""
+    if key is not None:
+        cached = await asyncio.to_thread(result_cache.get, key)
+        if cached is not None:
+            return cached
+    return await run_and_cache(key, fn, *args, cost=cost)
+
+def completed(result: Any) -> asyncio.Future:
+    """Future that already holds ``result``"""
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(result)
+    return future
+
+def stack_size(images: int, seconds: float) -> int:
+    """Images per worker call for a group of ``images`` same-sized images expected to take ``seconds`` each
+
+    Stacks only grow once every worker has an image of its own, so
+    stacking never costs parallelism, and hold at most MAX_STACK_SECONDS
+    of expected work, so a stack of large photos doesn't hold a worker
+    while cheap requests wait.
+    """
+    size = min(MAX_STACK_IMAGES, images // worker_pool.workers)
+    if seconds > 0:
+        size = min(size, int(MAX_STACK_SECONDS / seconds))
+    return max(1, size)
+
+async def run_stack(keys: List[Optional[str]], *args: Any, cost: float = 0.0) -> List[Union[bytes, Exception]]:
+    """Process a stack of images in one worker call and cache each result"""
+    results = await worker_pool.run(process_batch, *args, cost=cost)
+    for key, result in zip(keys, results):
+        if isinstance(result, bytes):
+            OUTPUT_BYTES.observe(len(result))
+            if key is not None:
+                await asyncio.to_thread(result_cache.put, key, result)
+    return results
+
+async def stack_result(stack: asyncio.Future, position: int) -> bytes:
+    """One image's result from a stack"""
+    result = (await stack)[position]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+async def batch_tasks(
+    contents: List[Upload],
+    keys: List[Optional[str]],
+    steps: Tuple[Step, ...],
+    seed: Optional[int],
+    max_size: Optional[int],
+    file_options: List[EncodeOptions],
+    geometry: Geometry,
+    costs: List[float]
+) -> List[asyncio.Future]:
+    """One task per upload of a batch, processing uncached images of the same size as stacks
+
+    ``costs`` are the expected seconds of each upload, which order the
+    tasks on the worker pool.
+    """
+    cached = [
+        await asyncio.to_thread(result_cache.get, key) if key is not None else None
+        for key in keys
+    ]
+    tasks: List[Optional[asyncio.Future]] = [completed(data) if data is not None else None for data in cached]
+    
+    # Output size is known from the headers, before anything is decoded
+    groups: Dict[Tuple[int, int], List[int]] = {}
+    for index, upload in enumerate(contents):
+        if cached[index] is None:
+            groups.setdefault(geometry.output_size((upload.width, upload.height), max_size), []).append(index)
+    
+    for indices in groups.values():
+        size = stack_size(len(indices), costs[indices[0]])
+        for start in range(0, len(indices), size):
+            chunk = indices[start:start + size]
+            if len(chunk) == 1:
+                index = chunk[0]
+                tasks[index] = asyncio.ensure_future(
+                    run_and_cache(
+                        keys[index], process_pipeline, contents[index].data, steps,
+                        file_seed(seed, index), max_size, file_options[index], geometry,
+                        cost=costs[index]
+                    )
+                )
+                continue
             
-            end_x = min(scratch_x + scratch_width, width)
-            pixels[:, scratch_x:end_x, :] = np.clip(
-                pixels[:, scratch_x:end_x, :] + scratch_intensity, 0, 255
+            stack = asyncio.ensure_future(
+                run_stack(
+                    [keys[index] for index in chunk],
+                    [contents[index].data for index in chunk],
+                    steps,
+                    [file_seed(seed, index) for index in chunk],
+                    max_size,
+                    [file_options[index] for index in chunk],
+                    geometry,
+                    cost=sum(costs[index] for index in chunk)
+                )
             )
-        
-        return Image.fromarray(pixels.astype(np.uint8))
+            for position, index in enumerate(chunk):
+                tasks[index] = asyncio.ensure_future(stack_result(stack, position))
+    return tasks
+
+def file_seed(seed: Optional[int], index: int) -> Optional[List[int]]:
+    """Derive an independent, reproducible seed for each file of a batch"""
+    return None if seed is None else [seed, index]
+
+async def wait_for_first_success(tasks: List[asyncio.Future]) -> bool:
+    """Wait until one task succeeds; False if every task failed"""
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        if any(task.exception() is None for task in done):
+            return True
+    return False
+
+async def stream_zip(filenames: List[str], tasks: List[asyncio.Future], rejected: Sequence[str] = ()):
+    """Yield ZIP entries as each processed image becomes available.
     
-    @staticmethod
-    def analog_cross_process(image: Image.Image) -> Image.Image:
-        """Apply cross-processing effect (developing slide film in print chemicals)"""
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        
-        pixels = np.array(image).astype(float)
-        
-        # Cross-processing color inversion characteristics
-        # Boost contrast in highlights, compress shadows
-        pixels = pixels / 255.0  # Normalize to 0-1
-        
-        # Apply characteristic S-curve to each channel differently
-        # Red channel - boost highlights
-        pixels[:, :, 0] = np.power(pixels[:, :, 0], 0.8)
-        pixels[:, :, 0] = np.clip(pixels[:, :, 0] * 1.3, 0, 1)
-        
-        # Green channel - compress midtones
-        pixels[:, :, 1] = np.power(pixels[:, :, 1], 1.4)
-        pixels[:, :, 1] = np.clip(pixels[:, :, 1] * 0.9 + 0.1, 0, 1)
-        
-        # Blue channel - boost shadows
-        pixels[:, :, 2] = np.power(pixels[:, :, 2], 1.1)
-        pixels[:, :, 2] = np.clip(pixels[:, :, 2] * 1.1 + 0.05, 0, 1)
-        
-        pixels = pixels * 255.0  # Back to 0-255
-        
-        # Add slight grain
-        height, width = pixels.shape[:2]
-        grain = np.random.normal(0, 5, (height, width, 3))
-        pixels = np.clip(pixels + grain, 0, 255)
-        
-        return Image.fromarray(pixels.astype(np.uint8))
+    Files that failed are left out of the archive and listed in its comment,
+    after the ``rejected`` uploads that weren't images at all.
+    """
+    zip_stream = ZipStream()
+    failed_files = list(rejected)
     
-    @staticmethod
-    def analog_light_leak(image: Image.Image) -> Image.Image:
-        """Apply light leak effect with orange/red casting"""
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        
-        pixels = np.array(image).astype(float)
-        height, width = pixels.shape[:2]
-        
-        # Create multiple light leaks
-        for _ in range(np.random.randint(1, 3)):
-            leak_intensity = np.random.uniform(40, 80)
-            
-            # Random corner or edge placement
-            corner = np.random.choice(['top-left', 'top-right', 'bottom-left', 'bottom-right', 'edge'])
-            
-            if corner == 'top-left':
-                leak_center = (height // 4, width // 4)
-            elif corner == 'top-right':
-                leak_center = (height // 4, 3 * width // 4)
-            elif corner == 'bottom-left':
-                leak_center = (3 * height // 4, width // 4)
-            elif corner == 'bottom-right':
-                leak_center = (3 * height // 4, 3 * width // 4)
-            else:  # edge
-                if np.random.random() > 0.5:  # vertical edge
-                    leak_center = (np.random.randint(0, height), 0 if np.random.random() > 0.5 else width-1)
-                else:  # horizontal edge
-                    leak_center = (0 if np.random.random() > 0.5 else height-1, np.random.randint(0, width))
+    try:
+        for filename, task in zip(filenames, tasks):
+            try:
+                processed_data = await task
+            except Exception as e:
+                ERRORS.inc(cause="processing")
+                print(f"Error processing {filename}: {e}")
+                failed_files.append(filename)
+                continue
             
-            # Create gradient for light leak
-            Y, X = np.ogrid[:height, :width]
-            distance = np.sqrt((Y - leak_center[0])**2 + (X - leak_center[1])**2)
-            max_distance = np.sqrt(height**2 + width**2) / 3
-            
-            leak_mask = np.exp(-distance / max_distance) * leak_intensity
-            
-            # Apply warm light leak (orange/red)
-            pixels[:, :, 0] = np.clip(pixels[:, :, 0] + leak_mask, 0, 255)
-            pixels[:, :, 1] = np.clip(pixels[:, :, 1] + leak_mask * 0.6, 0, 255)
-            pixels[:, :, 2] = np.clip(pixels[:, :, 2] + leak_mask * 0.2, 0, 255)
+            with metrics.stage("zip"):
+                chunk = zip_stream.add(f"processed_{filename}", processed_data)
+            yield chunk
         
-        # Add subtle grain
-        grain = np.random.normal(0, 4, (height, width, 3))
-        pixels = np.clip(pixels + grain, 0, 255)
+        if failed_files:
+            zip_stream.comment = "Failed files:\n" + "\n".join(failed_files)
+        with metrics.stage("zip"):
+            chunk = zip_stream.finish()
+        yield chunk
+    finally:
+        # Client went away mid-stream: stop the remaining work
+        for task in tasks:
+            task.cancel()
+
+async def release_after(stream: AsyncIterator[bytes], grant: Grant):
+    """Pass a response stream through, releasing its admission once it ends"""
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        admission.release(grant)
+
+async def stream_shared_zip(
+    filenames: List[str],
+    tasks: List[asyncio.Future],
+    shared: shared_memory.SharedMemory
+):
+    """Stream a ZIP, releasing the shared decoded image once it is done"""
+    try:
+        async for chunk in stream_zip(filenames, tasks):
+            yield chunk
+    finally:
+        shared.close()
+        shared.unlink()
+
+async def read_uploads(files: List[UploadFile], max_files: int) -> Tuple[List[UploadFile], List[Upload], List[str]]:
+    """Read a request's uploads, skipping files that aren't images
+    
+    Returns the image uploads, their contents and the names of the skipped files.
+    """
+    if len(files) > max_files:
+        raise HTTPException(status_code=413, detail=f"At most {max_files} files can be uploaded at once")
+    
+    # The header decides what is an image; the client's content type can't be trusted
+    budget = RequestBudget()
+    read = [(file, await read_upload(file, budget)) for file in files]
+    uploads = [file for file, upload in read if upload is not None]
+    contents = [upload for _, upload in read if upload is not None]
+    rejected = [file.filename for file, upload in read if upload is None]
+    if not uploads:
+        raise HTTPException(status_code=400, detail="No valid images processed")
+    return uploads, contents, rejected
+
+async def process_uploads(
+    files: List[UploadFile],
+    client: str,
+    steps: Tuple[Step, ...],
+    make_key: Callable[[str, Optional[List[int]], EncodeOptions], Optional[str]],
+    seed: Optional[int],
+    max_size: Optional[int],
+    options: EncodeOptions,
+    geometry: Geometry,
+    if_none_match: Optional[str]
+) -> Response:
+    """Run the effect chain ``steps`` on each upload
+
+    Returns the single processed image, or a ZIP streamed in upload order
+    for batches, listing files that failed or weren't images in its
+    comment. ``make_key(digest, seed, options)`` gives each file's result
+    cache key.
+    """
+    admission.check(client)
+    uploads, contents, rejected = await read_uploads(files, MAX_FILES)
+    check_geometry(uploads, contents, geometry)
+    
+    # "original" can differ per file, so resolve it before keying the cache
+    file_options = [options.resolve(upload.format) for upload in contents]
+    keys = [
+        make_key(upload.digest, file_seed(seed, index), opts)
+        for index, (upload, opts) in enumerate(zip(contents, file_options))
+    ]
+    # A batch stays a ZIP when some of its files were rejected, so they can be reported
+    single = len(uploads) == 1 and not rejected
+    etag = keys[0] if single else combined_etag(keys)
+    etag_headers = {"ETag": f'"{etag}"'} if etag else {}
+    
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=etag_headers)
+    
+    pixels = [upload_pixels(upload, max_size, geometry) for upload in contents]
+    costs = [cost_model.seconds(steps, count) for count in pixels]
+    grant = await admit(client, sum(pixels), sum(costs))
+    
+    # If single image, return it directly
+    if single:
+        try:
+            processed_data = await cached_run(
+                keys[0], process_pipeline, contents[0].data, steps, file_seed(seed, 0), max_size, file_options[0], geometry,
+                cost=costs[0]
+            )
+        except WorkerLost as e:
+            raise worker_lost(uploads[0].filename, e)
+        except Exception as e:
+            ERRORS.inc(cause="processing")
+            print(f"Error processing {uploads[0].filename}: {e}")
+            raise HTTPException(status_code=400, detail="No valid images processed")
+        finally:
+            admission.release(grant)
         
-        return Image.fromarray(pixels.astype(np.uint8))
-
-# Available effects
-EFFECTS = {
-    "vintage": ImageEffects.vintage,
-    "black_white": ImageEffects.black_white,
-    "cinematic": ImageEffects.cinematic,
-    "lomo": ImageEffects.lomo,
-    "warm": ImageEffects.warm,
-    "cool": ImageEffects.cool,
-    "sharp": ImageEffects.sharp,
-    "soft": ImageEffects.soft,
-    "analog_kodak": ImageEffects.analog_kodak,
-    "analog_fuji": ImageEffects.analog_fuji,
-    "analog_polaroid": ImageEffects.analog_polaroid,
-    "analog_expired": ImageEffects.analog_expired,
-    "analog_cross_process": ImageEffects.analog_cross_process,
-    "analog_light_leak": ImageEffects.analog_light_leak,
-}
+        return StreamingResponse(
+            io.BytesIO(processed_data),
+            media_type=media_type(file_options[0]),
+            headers={
+                "Content-Disposition": f"attachment; filename=processed_{output_filename(uploads[0].filename, file_options[0])}",
+                **etag_headers
+            }
+        )
+    
+    # Multiple images: process concurrently and stream the ZIP in upload order
+    # Wait for the first success so an all-failed batch still gets a 400
+    try:
+        tasks = await batch_tasks(contents, keys, steps, seed, max_size, file_options, geometry, costs)
+        succeeded = await wait_for_first_success(tasks)
+    except BaseException:
+        admission.release(grant)
+        raise
+    if not succeeded:
+        admission.release(grant)
+        lost = [task.exception() for task in tasks if isinstance(task.exception(), WorkerLost)]
+        if lost:
+            raise worker_lost(f"{len(uploads)} files", lost[0])
+        for file, task in zip(uploads, tasks):
+            ERRORS.inc(cause="processing")
+            print(f"Error processing {file.filename}: {task.exception()}")
+        raise HTTPException(status_code=400, detail="No valid images processed")
+    
+    filenames = [output_filename(file.filename, opts) for file, opts in zip(uploads, file_options)]
+    return StreamingResponse(
+        release_after(stream_zip(filenames, tasks, rejected), grant),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=lensify_processed_images.zip", **etag_headers}
+    )
 
 @app.get("/")
 async def root():
@@ -370,6 +602,36 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "Lensify API"}
 
+@app.get("/ready")
+async def readiness_check():
+    """503 until every worker has warmed up, then 200; startup timings either way
+    
+    A pool broken by a dead worker is restarted here, so an instance taken
+    out of rotation by this check recovers without traffic.
+    """
+    worker_pool.restart_if_broken()
+    return JSONResponse(startup.stats(), status_code=200 if startup.ready else 503)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Result cache hit rate and size"""
+    return result_cache.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admission/stats")
+async def admission_stats():
+    """Pixels in flight, queued requests and rejections"""
+    return admission.stats()
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """Worker pool queue and the measured cost of each effect"""
+    return {**worker_pool.stats(), "cost_model": cost_model.stats()}
+
 @app.get("/effects")
 async def get_effects():
     """Get list of available effects"""
@@ -377,8 +639,22 @@ async def get_effects():
 
 @app.post("/apply-effect")
 async def apply_effect(
+    request: Request,
     effect: str = Form(...),
-    files: List[UploadFile] = File(...)
+    files: List[UploadFile] = File(...),
+    seed: Optional[int] = Form(None, ge=0),
+    max_size: Optional[int] = Form(None, gt=0),
+    crop: Optional[str] = Form(None),
+    aspect: Optional[str] = Form(None),
+    size: Optional[str] = Form(None),
+    preview: bool = Form(False),
+    output_format: str = Form("jpeg", alias="format"),
+    quality: Optional[int] = Form(None, ge=1, le=100),
+    subsampling: Optional[str] = Form(None),
+    progressive: bool = Form(False),
+    optimize: bool = Form(False),
+    keep_metadata: bool = Form(False),
+    if_none_match: Optional[str] = Header(None)
 ):
     """Apply effect to uploaded images"""
     if effect not in EFFECTS:
@@ -387,61 +663,369 @@ async def apply_effect(
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
     
-    # Process images
-    processed_images = []
+    if preview and max_size is None:
+        max_size = PREVIEW_MAX_SIZE
+    
+    options = encode_options(output_format, quality, subsampling, progressive, optimize, keep_metadata)
+    geometry = parse_geometry(crop, aspect, size)
+    
+    return await process_uploads(
+        files,
+        client_id(request),
+        (Step(effect),),
+        lambda digest, file_seed, opts: cache_key(digest, effect, file_seed, max_size, opts, geometry),
+        seed,
+        max_size,
+        options,
+        geometry,
+        if_none_match
+    )
+
+@app.post("/apply-pipeline")
+async def apply_pipeline(
+    request: Request,
+    pipeline: str = Form(...),
+    files: List[UploadFile] = File(...),
+    seed: Optional[int] = Form(None, ge=0),
+    max_size: Optional[int] = Form(None, gt=0),
+    crop: Optional[str] = Form(None),
+    aspect: Optional[str] = Form(None),
+    size: Optional[str] = Form(None),
+    preview: bool = Form(False),
+    output_format: str = Form("jpeg", alias="format"),
+    quality: Optional[int] = Form(None, ge=1, le=100),
+    subsampling: Optional[str] = Form(None),
+    progressive: bool = Form(False),
+    optimize: bool = Form(False),
+    keep_metadata: bool = Form(False),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Apply a chain of effects to uploaded images in one pass"""
+    try:
+        steps = parse_steps(pipeline)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+    
+    if preview and max_size is None:
+        max_size = PREVIEW_MAX_SIZE
+    
+    options = encode_options(output_format, quality, subsampling, progressive, optimize, keep_metadata)
+    geometry = parse_geometry(crop, aspect, size)
+    
+    return await process_uploads(
+        files,
+        client_id(request),
+        steps,
+        lambda digest, file_seed, opts: pipeline_cache_key(digest, steps, file_seed, max_size, opts, geometry),
+        seed,
+        max_size,
+        options,
+        geometry,
+        if_none_match
+    )
+
+@app.post("/apply-effects")
+async def apply_effects(
+    request: Request,
+    file: UploadFile = File(...),
+    effects: str = Form("all"),
+    seed: Optional[int] = Form(None, ge=0),
+    max_size: Optional[int] = Form(None, gt=0),
+    crop: Optional[str] = Form(None),
+    aspect: Optional[str] = Form(None),
+    size: Optional[str] = Form(None),
+    preview: bool = Form(False),
+    output_format: str = Form("jpeg", alias="format"),
+    quality: Optional[int] = Form(None, ge=1, le=100),
+    subsampling: Optional[str] = Form(None),
+    progressive: bool = Form(False),
+    optimize: bool = Form(False),
+    keep_metadata: bool = Form(False),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Apply several effects to one image, decoding it only once"""
+    if effects.strip() == "all":
+        effect_names = list(EFFECTS)
+    else:
+        effect_names = [name.strip() for name in effects.split(",") if name.strip()]
+    
+    if not effect_names:
+        raise HTTPException(status_code=400, detail="No effects requested")
+    
+    unknown = [name for name in effect_names if name not in EFFECTS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Effect '{unknown[0]}' not found")
     
-    for file in files:
-        if not file.content_type.startswith("image/"):
+    if preview and max_size is None:
+        max_size = PREVIEW_MAX_SIZE
+    
+    options = encode_options(output_format, quality, subsampling, progressive, optimize, keep_metadata)
+    geometry = parse_geometry(crop, aspect, size)
+    
+    client = client_id(request)
+    admission.check(client)
+    upload = await read_upload(file, RequestBudget())
+    if upload is None:
+        raise HTTPException(status_code=400, detail="No valid images processed")
+    check_geometry([file], [upload], geometry)
+    
+    image_data, digest = upload.data, upload.digest
+    options = options.resolve(upload.format)
+    # Same seed as /apply-effect so each effect matches a single-effect call
+    keys = [cache_key(digest, name, file_seed(seed, 0), max_size, options, geometry) for name in effect_names]
+    etag = combined_etag(keys)
+    etag_headers = {"ETag": f'"{etag}"'} if etag else {}
+    
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=etag_headers)
+    
+    cached = [
+        await asyncio.to_thread(result_cache.get, key) if key is not None else None
+        for key in keys
+    ]
+    stem = os.path.splitext(file.filename)[0]
+    filenames = [f"{stem}_{name}{extension(options)}" for name in effect_names]
+    headers = {"Content-Disposition": "attachment; filename=lensify_effects.zip", **etag_headers}
+    
+    if all(data is not None for data in cached):
+        tasks = [completed(data) for data in cached]
+        return StreamingResponse(stream_zip(filenames, tasks), media_type="application/zip", headers=headers)
+    
+    try:
+        shape = decoded_shape(image_data, max_size, geometry)
+    except Exception as e:
+        ERRORS.inc(cause="decode")
+        print(f"Error processing {file.filename}: {e}")
+        raise HTTPException(status_code=400, detail="No valid images processed")
+    
+    uncached = sum(1 for data in cached if data is None)
+    pixels = upload_pixels(upload, max_size, geometry)
+    costs = [cost_model.seconds((Step(name),), pixels) for name in effect_names]
+    seconds = sum(cost for cost, data in zip(costs, cached) if data is None)
+    grant = await admit(client, pixels * uncached, seconds)
+    
+    # Decode once into shared memory; every effect worker reads the same pixels
+    shared = shared_memory.SharedMemory(create=True, size=math.prod(shape))
+    try:
+        source = await worker_pool.run(
+            decode_into_shared, image_data, shared.name, shape, max_size, geometry, cost=cost_model.seconds((), pixels)
+        )
+    except BaseException as e:
+        shared.close()
+        shared.unlink()
+        admission.release(grant)
+        if not isinstance(e, Exception):
+            raise
+        if isinstance(e, WorkerLost):
+            raise worker_lost(file.filename, e)
+        ERRORS.inc(cause="decode")
+        print(f"Error processing {file.filename}: {e}")
+        raise HTTPException(status_code=400, detail="No valid images processed")
+    
+    tasks = [
+        completed(data) if data is not None
+        else asyncio.ensure_future(
+            run_and_cache(
+                key, process_shared, shared.name, shape, name, file_seed(seed, 0), options, source, cost=cost
+            )
+        )
+        for name, key, data, cost in zip(effect_names, keys, cached, costs)
+    ]
+    
+    return StreamingResponse(
+        release_after(stream_shared_zip(filenames, tasks, shared), grant),
+        media_type="application/zip",
+        headers=headers
+    )
+
+def job_expected_seconds(job: Job) -> Optional[float]:
+    """Expected seconds until a job finishes, from the cost model; None once it has"""
+    if job.complete:
+        return None
+    remaining = sum(
+        cost_model.seconds(job.params["steps"], job.params["pixels"][index])
+        for index, status in enumerate(job.statuses)
+        if status == PENDING
+    )
+    # Clients with queued images take turns, so each gets an equal share of the workers
+    return remaining * max(1, job_manager.queued_clients) / worker_pool.workers
+
+def job_status(job: Job) -> dict:
+    """Progress of a background job, with its expected completion"""
+    expected = job_expected_seconds(job)
+    return {
+        "id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "done": job.done,
+        "failed": job.failed,
+        "created_at": job.created,
+        "expected_seconds": expected,
+        "expected_done_at": time.time() + expected if expected is not None else None,
+        "expires_at": job.expires_at(job_manager.ttl),
+        "files": [
+            {"index": index, "filename": filename, "status": status}
+            for index, (filename, status) in enumerate(zip(job.filenames, job.statuses))
+        ],
+        "rejected": job.params["rejected"],
+    }
+
+def job_limit(e: JobLimitExceeded) -> HTTPException:
+    """429 for a client over its job limits"""
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(admission.retry_after)})
+
+def find_job(job_id: str) -> Job:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job
+
+async def stream_job_zip(job: Job):
+    """Stream a finished job's results from disk"""
+    zip_stream = ZipStream()
+    failed_files = list(job.params["rejected"])
+    
+    for index, filename in enumerate(job.filenames):
+        if job.statuses[index] != DONE:
+            failed_files.append(filename)
             continue
-        
+        yield zip_stream.add(f"processed_{filename}", await job_manager.read_result(job, index))
+    
+    if failed_files:
+        zip_stream.comment = "Failed files:\n" + "\n".join(failed_files)
+    yield zip_stream.finish()
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    effect: Optional[str] = Form(None),
+    pipeline: Optional[str] = Form(None),
+    seed: Optional[int] = Form(None, ge=0),
+    max_size: Optional[int] = Form(None, gt=0),
+    crop: Optional[str] = Form(None),
+    aspect: Optional[str] = Form(None),
+    size: Optional[str] = Form(None),
+    preview: bool = Form(False),
+    output_format: str = Form("jpeg", alias="format"),
+    quality: Optional[int] = Form(None, ge=1, le=100),
+    subsampling: Optional[str] = Form(None),
+    progressive: bool = Form(False),
+    optimize: bool = Form(False),
+    keep_metadata: bool = Form(False)
+):
+    """Queue a batch for background processing"""
+    if (effect is None) == (pipeline is None):
+        raise HTTPException(status_code=400, detail="Exactly one of 'effect' and 'pipeline' is required")
+    
+    if effect is not None:
+        if effect not in EFFECTS:
+            raise HTTPException(status_code=400, detail=f"Effect '{effect}' not found")
+        steps = (Step(effect),)
+    else:
         try:
-            # Read and process image
-            image_data = await file.read()
-            image = Image.open(io.BytesIO(image_data))
-            
-            # Apply effect
-            processed_image = EFFECTS[effect](image)
-            
-            # Convert to bytes
-            img_bytes = io.BytesIO()
-            processed_image.save(img_bytes, format="JPEG", quality=95)
-            img_bytes.seek(0)
-            
-            processed_images.append({
-                "filename": file.filename,
-                "data": img_bytes.getvalue()
-            })
-            
-        except Exception as e:
-            print(f"Error processing {file.filename}: {e}")
-            continue
+            steps = parse_steps(pipeline)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     
-    if not processed_images:
-        raise HTTPException(status_code=400, detail="No valid images processed")
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded")
     
-    # If single image, return it directly
-    if len(processed_images) == 1:
-        return StreamingResponse(
-            io.BytesIO(processed_images[0]["data"]),
-            media_type="image/jpeg",
-            headers={"Content-Disposition": f"attachment; filename=processed_{processed_images[0]['filename']}"}
+    if preview and max_size is None:
+        max_size = PREVIEW_MAX_SIZE
+    
+    options = encode_options(output_format, quality, subsampling, progressive, optimize, keep_metadata)
+    geometry = parse_geometry(crop, aspect, size)
+    
+    # Same load shedding as the synchronous endpoints, before the uploads are read
+    client = client_id(request)
+    admission.check(client)
+    try:
+        job_manager.check(client)
+    except JobLimitExceeded as e:
+        raise job_limit(e)
+    
+    uploads, contents, rejected = await read_uploads(files, MAX_JOB_FILES)
+    check_geometry(uploads, contents, geometry)
+    
+    file_options = [options.resolve(upload.format) for upload in contents]
+    # A single effect shares cached results with /apply-effect
+    keys = [
+        cache_key(upload.digest, effect, file_seed(seed, index), max_size, opts, geometry) if effect is not None
+        else pipeline_cache_key(upload.digest, steps, file_seed(seed, index), max_size, opts, geometry)
+        for index, (upload, opts) in enumerate(zip(contents, file_options))
+    ]
+    
+    try:
+        job = await job_manager.submit(
+            client,
+            [output_filename(file.filename, opts) for file, opts in zip(uploads, file_options)],
+            [upload.data for upload in contents],
+            {
+                "steps": steps,
+                "seed": seed,
+                "max_size": max_size,
+                "options": file_options,
+                "geometry": geometry,
+                "keys": keys,
+                "pixels": [upload_pixels(upload, max_size, geometry) for upload in contents],
+                "rejected": rejected,
+            }
         )
+    except JobLimitExceeded as e:
+        raise job_limit(e)
     
-    # Multiple images, create ZIP
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for img in processed_images:
-            filename = f"processed_{img['filename']}"
-            zip_file.writestr(filename, img["data"])
+    return JSONResponse(job_status(job), status_code=202, headers={"Location": f"/jobs/{job.id}"})
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Progress of a background job"""
+    return job_status(find_job(job_id))
+
+@app.get("/jobs/{job_id}/files/{index}")
+async def get_job_file(job_id: str, index: int):
+    """One processed image of a background job"""
+    job = find_job(job_id)
+    if not 0 <= index < job.total:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' has no file {index}")
+    if job.statuses[index] == PENDING:
+        raise HTTPException(status_code=409, detail=f"File {index} is still being processed")
+    if job.statuses[index] != DONE:
+        raise HTTPException(status_code=404, detail=f"File {index} could not be processed")
     
-    zip_buffer.seek(0)
+    filename = job.filenames[index]
+    return StreamingResponse(
+        io.BytesIO(await job_manager.read_result(job, index)),
+        media_type=media_type(job.params["options"][index]),
+        headers={"Content-Disposition": f"attachment; filename=processed_{filename}"}
+    )
+
+@app.get("/jobs/{job_id}/zip")
+async def get_job_zip(job_id: str):
+    """All processed images of a finished background job"""
+    job = find_job(job_id)
+    if not job.complete:
+        raise HTTPException(status_code=409, detail=f"Job '{job_id}' is still being processed")
+    if not job.done:
+        raise HTTPException(status_code=400, detail="No valid images processed")
     
     return StreamingResponse(
-        zip_buffer,
+        stream_job_zip(job),
         media_type="application/zip",
-        headers={"Content-Disposition": "attachment; filename=lensify_processed_images.zip"}
+        headers={"Content-Disposition": f"attachment; filename=lensify_job_{job.id}.zip"}
     )
 
+@app.delete("/jobs/{job_id}", status_code=204)
+async def delete_job(job_id: str):
+    """Cancel a background job and delete its files"""
+    await job_manager.delete(find_job(job_id))
+    return Response(status_code=204)
+
 if __name__ == "__main__":
+    import uvicorn
+    
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(app, host="0.0.0.0", port=port, proxy_headers=True, forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS"))
@@ -0,0 +1,112 @@
+"""Cached spatial masks for vignette and border fade effects.
+
+Masks only depend on the image size, and batches from the same phone share
+one resolution, so each mask is built once as float32 and kept in a
+size-capped LRU cache. Cached masks are read-only; apply them with a
+broadcast multiply such as ``pixels * mask[:, :, None]``.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+import numpy as np
+
+
+class MaskCache:
+    """Thread-safe LRU cache of float32 masks bounded by total bytes"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._masks: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """Bytes currently held by cached masks"""
+        return self._bytes
+
+    def get(self, key: Hashable, build: Callable[[], np.ndarray]) -> np.ndarray:
+        """Return the mask for ``key``, building and caching it on a miss"""
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                self.hits += 1
+                return mask
+            self.misses += 1
+
+        mask = np.ascontiguousarray(build(), dtype=np.float32)
+        mask.setflags(write=False)
+
+        if mask.nbytes > self.max_bytes:
+            return mask
+
+        with self._lock:
+            if key not in self._masks:
+                self._masks[key] = mask
+                self._bytes += mask.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._masks.popitem(last=False)
+                self._bytes -= evicted.nbytes
+        return mask
+
+    def clear(self):
+        with self._lock:
+            self._masks.clear()
+            self._bytes = 0
+
+
+# Each worker process keeps its own cache
+mask_cache = MaskCache(int(os.getenv("MASK_CACHE_BYTES", 128 * 1024 * 1024)))
+
+
+def _grid(width: int, top: int, bottom: int):
+    Y, X = np.ogrid[top:bottom, :width]
+    return Y.astype(np.float32), X.astype(np.float32)
+
+
+def _vignette(width: int, height: int, top: int, bottom: int) -> np.ndarray:
+    Y, X = _grid(width, top, bottom)
+    center_x, center_y = width // 2, height // 2
+    distance = np.hypot(X - center_x, Y - center_y)
+    # Farthest corner of the whole image, so bands normalize like the full mask
+    distance /= np.hypot(
+        np.float32(max(center_x, width - 1 - center_x)),
+        np.float32(max(center_y, height - 1 - center_y)),
+    )
+    return np.clip(1.2 - distance, 0.6, 1.0)
+
+
+def _border_fade(width: int, height: int, top: int, bottom: int) -> np.ndarray:
+    Y, X = np.ogrid[top:bottom, :width]
+    scale = 4.0 / min(width, height)
+    # min() commutes with the monotonic scale/clip, so shape each axis first
+    columns = np.clip(np.minimum(X, width - X) * scale, 0.7, 1.0).astype(np.float32)
+    rows = np.clip(np.minimum(Y, height - Y) * scale, 0.7, 1.0).astype(np.float32)
+    return np.minimum(rows, columns)
+
+
+# Every mask takes the image size plus an optional band of rows
+# [top, bottom), so tiled processing can build just the rows it needs.
+
+def vignette(width: int, height: int, top: int = 0, bottom: Optional[int] = None) -> np.ndarray:
+    """Radial lomo vignette, 1.0 in the center falling to 0.6 at the corners"""
+    bottom = height if bottom is None else bottom
+    return mask_cache.get(
+        ("vignette", width, height, top, bottom),
+        lambda: _vignette(width, height, top, bottom),
+    )
+
+
+def border_fade(width: int, height: int, top: int = 0, bottom: Optional[int] = None) -> np.ndarray:
+    """Polaroid border fade, 0.7 at the edges rising to 1.0 inside"""
+    bottom = height if bottom is None else bottom
+    return mask_cache.get(
+        ("border_fade", width, height, top, bottom),
+        lambda: _border_fade(width, height, top, bottom),
+    )
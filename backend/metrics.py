@@ -0,0 +1,281 @@
+"""Prometheus metrics and per-stage timing.
+
+Processing code marks its stages with :func:`stage`. Stages run in the
+worker pool, possibly in another process, so :meth:`WorkerPool.run` calls
+the task through :func:`timed_call`, which collects the stage timings in
+the worker and hands them back with the result; they are then recorded in
+the server process by :func:`observe_stage`. Timings are also collected
+per request for the optional ``Server-Timing`` header (``SERVER_TIMING``).
+
+Metrics are rendered in the Prometheus text format by :func:`render`,
+without a client library.
+"""
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Collection, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from starlette.routing import Match
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").strip().lower() in ("1", "true", "yes")
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PIXEL_BUCKETS = (1e5, 3e5, 1e6, 2e6, 5e6, 1.2e7, 2.4e7, 4.8e7, 1e8)
+BYTE_BUCKETS = (1e4, 5e4, 1e5, 5e5, 1e6, 2e6, 5e6, 1e7, 5e7)
+
+Labels = Tuple[Tuple[str, str], ...]
+Stage = Tuple[str, float, Dict[str, str]]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def samples(self) -> Iterator[Tuple[str, Labels, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return ((self.name, labels, value) for labels, value in values)
+
+
+class ErrorCounter(Counter):
+    """Counter that also notes an error was recorded for the current request"""
+
+    def inc(self, amount: float = 1, **labels: Any):
+        super().inc(amount, **labels)
+        errors = _request_errors.get()
+        if errors is not None:
+            errors.append(labels.get("cause", ""))
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: Any):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: Any):
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+
+class CallbackGauge(_Metric):
+    """Gauge read from ``fn()`` at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def samples(self):
+        return [(self.name, (), self.fn())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, **labels: Any):
+        key = _labels(labels)
+        with self._lock:
+            # Bucket counts, then sum
+            counts = self._values.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+        for labels, counts in values:
+            for bound, count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket", labels + (("le", _format_value(bound)),), count
+            yield f"{self.name}_count", labels, counts[len(self.buckets) - 1]
+            yield f"{self.name}_sum", labels, counts[-1]
+
+
+REGISTRY: List[_Metric] = []
+
+STAGE_SECONDS = Histogram(
+    "lensify_stage_seconds",
+    "Time spent per processing stage (read, admission, decode, convert, effect, encode, zip)",
+    SECONDS_BUCKETS,
+)
+REQUEST_SECONDS = Histogram("lensify_request_seconds", "Request handling time", SECONDS_BUCKETS)
+REQUESTS = Counter("lensify_requests_total", "Requests by endpoint and status code")
+IN_FLIGHT = Gauge("lensify_requests_in_flight", "Requests being handled, by endpoint")
+INPUT_PIXELS = Histogram("lensify_input_pixels", "Pixels of uploaded images", PIXEL_BUCKETS)
+OUTPUT_BYTES = Histogram("lensify_output_bytes", "Size of encoded results", BYTE_BUCKETS)
+ERRORS = ErrorCounter("lensify_errors_total", "Failed uploads and requests by cause")
+
+# Status codes of processing endpoints counted as errors, by cause, unless
+# the handler already recorded why the request failed
+ERROR_CAUSES = {400: "bad_request", 413: "too_large", 429: "client_limit", 503: "overloaded"}
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+_worker = threading.local()
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+_request_errors: ContextVar[Optional[List[str]]] = ContextVar("request_errors", default=None)
+
+
+def observe_stage(name: str, seconds: float, labels: Optional[Dict[str, str]] = None):
+    """Record a stage in the metrics and the current request's timings"""
+    labels = labels or {}
+    STAGE_SECONDS.observe(seconds, stage=name, effect=labels.get("effect", ""))
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str, **labels: str):
+    """Time the enclosed block as processing stage ``name``"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        stages = getattr(_worker, "stages", None)
+        if stages is not None:
+            stages.append((name, seconds, labels))
+        else:
+            observe_stage(name, seconds, labels)
+
+
+def timed_call(fn: Callable[..., Any], *args: Any) -> Tuple[Any, List[Stage]]:
+    """Call ``fn(*args)`` in a worker, returning its result and stage timings"""
+    _worker.stages = []
+    try:
+        return fn(*args), _worker.stages
+    finally:
+        _worker.stages = None
+
+
+def server_timing(timings: List[Tuple[str, float]], total: float) -> str:
+    """``Server-Timing`` header value, summing repeated stages"""
+    durations: Dict[str, float] = {}
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0) + seconds
+    durations["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items())
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and adding ``Server-Timing``
+
+    Endpoints are labelled by route template (``/jobs/{job_id}``), so
+    metrics stay bounded whatever paths clients request. Error responses
+    are counted in ``lensify_errors_total`` only for ``error_endpoints``
+    (all of them when None), so a 503 from a readiness check isn't an
+    overload.
+    """
+
+    def __init__(
+        self,
+        app: Callable,
+        server_timing: bool = SERVER_TIMING,
+        error_endpoints: Optional[Collection[str]] = None,
+    ):
+        self.app = app
+        self.server_timing = server_timing
+        self.error_endpoints = error_endpoints
+
+    def _endpoint(self, scope: dict) -> str:
+        router = getattr(scope.get("app"), "router", None)
+        for route in getattr(router, "routes", ()):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        endpoint = self._endpoint(scope)
+        timings: List[Tuple[str, float]] = []
+        errors: List[str] = []
+        token = _request_timings.set(timings)
+        errors_token = _request_errors.set(errors)
+        start = time.perf_counter()
+        status = 500
+
+        async def timed_send(message: dict):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    header = server_timing(timings, time.perf_counter() - start)
+                    message["headers"] = [*message.get("headers", []), (b"server-timing", header.encode())]
+            await send(message)
+
+        IN_FLIGHT.inc(endpoint=endpoint)
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            IN_FLIGHT.dec(endpoint=endpoint)
+            _request_timings.reset(token)
+            _request_errors.reset(errors_token)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+            REQUESTS.inc(endpoint=endpoint, status=status)
+            counted = self.error_endpoints is None or endpoint in self.error_endpoints
+            if status in ERROR_CAUSES and counted and not errors:
+                ERRORS.inc(cause=ERROR_CAUSES[status])
@@ -0,0 +1,156 @@
+"""Additive overlays for light leaks and scratches.
+
+An :class:`Overlay` collects everything an effect adds on top of the
+image and applies it in one pass with one clip. Three kinds of shapes
+are supported:
+
+- glows, smooth radial falloffs (the light leaks). They are summed into a
+  field at up to 1/``OVERLAY_SCALE`` resolution and upsampled with linear
+  interpolation as they are applied, so the exponentials are evaluated for
+  a fraction of the pixels. The interpolation error grows with the grid's
+  cell size relative to the image, so the grid keeps at least
+  ``OVERLAY_MIN_GRID`` samples across the short side: large photos get the
+  full reduction, and previews and other small images an exact glow.
+- discs with a hard edge, added only inside their bounding box.
+- columns one or two pixels wide (the scratches), added through a single
+  gather of the affected columns.
+
+Everything is positioned in full-image coordinates, and :meth:`Overlay.apply`
+takes the first row of the band it is given, so banded processing gives
+the same result as the whole image. Overlays only add non-negative
+values, so clipping once at the end is the same as clipping after each
+shape.
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import kernels
+
+# Glow fields are at most this many times smaller than the image on each
+# side, and keep at least OVERLAY_MIN_GRID samples across its short side,
+# which holds the error under half a level. Part of the output, so changing
+# either changes cached results.
+OVERLAY_SCALE = 8
+OVERLAY_MIN_GRID = 256
+
+
+def grid_scale(height: int, width: int, scale: int = OVERLAY_SCALE, min_grid: int = OVERLAY_MIN_GRID) -> int:
+    """Reduction of the glow field for an image of ``height`` x ``width``; 1 is exact"""
+    return max(1, min(scale, min(height, width) // min_grid))
+
+
+def _interpolation(positions: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Neighbour indices and weights for linear interpolation at ``positions``"""
+    positions = np.clip(positions, 0, size - 1)
+    lower = np.minimum(positions.astype(np.intp), max(size - 2, 0))
+    upper = np.minimum(lower + 1, size - 1)
+    return lower, upper, (positions - lower).astype(np.float32)
+
+
+class Overlay:
+    """Additive RGB overlay for an image of ``height`` x ``width``
+
+    ``scale`` defaults to :func:`grid_scale` of the image size.
+    """
+
+    def __init__(self, height: int, width: int, scale: Optional[int] = None):
+        if scale is None:
+            scale = grid_scale(height, width)
+        self.height = height
+        self.width = width
+        self.grid_height = max(1, math.ceil(height / scale))
+        self.grid_width = max(1, math.ceil(width / scale))
+        # Low-resolution glow fields, one per tint
+        self._glows: Dict[Tuple[float, ...], np.ndarray] = {}
+        self._discs: List[Tuple[int, int, int, np.ndarray]] = []
+        self._columns = np.zeros(width, dtype=np.float32)
+
+    def add_glow(self, center_y: float, center_x: float, falloff: float, strength: float, tint: np.ndarray):
+        """Add ``strength * tint * exp(-distance / falloff)`` around a center"""
+        # Sample at the full-resolution coordinates of the grid's pixel centers
+        y = (np.arange(self.grid_height) + 0.5) * (self.height / self.grid_height) - 0.5
+        x = (np.arange(self.grid_width) + 0.5) * (self.width / self.grid_width) - 0.5
+        field = np.exp(-np.hypot(y[:, None] - center_y, x[None, :] - center_x) / falloff) * strength
+
+        key = tuple(np.asarray(tint, dtype=np.float32).tolist())
+        if key in self._glows:
+            self._glows[key] += field.astype(np.float32)
+        else:
+            self._glows[key] = field.astype(np.float32)
+
+    def add_disc(self, center_y: int, center_x: int, radius: int, color: np.ndarray):
+        """Add ``color`` to every pixel within ``radius`` of a center"""
+        self._discs.append((center_y, center_x, radius, np.asarray(color, dtype=np.float32)))
+
+    def add_columns(self, start: int, end: int, intensity: float):
+        """Add ``intensity`` to every channel of columns ``start`` to ``end``"""
+        self._columns[start:end] += np.float32(intensity)
+
+    def apply(self, pixels: np.ndarray, top: int = 0):
+        """Add the overlay to float32 ``pixels`` holding rows from ``top`` on, in place"""
+        boxes = [self._add_disc(pixels, top, *disc) for disc in self._discs]
+
+        if self._glows:
+            self._add_glows(pixels, top)
+            np.clip(pixels, 0, 255, out=pixels)
+        else:
+            # Only the discs changed anything
+            for box in boxes:
+                if box is not None:
+                    region = pixels[box]
+                    np.clip(region, 0, 255, out=region)
+
+        columns = np.flatnonzero(self._columns)
+        if len(columns):
+            strip = pixels[:, columns, :]
+            strip += self._columns[columns][None, :, None]
+            np.clip(strip, 0, 255, out=strip)
+            pixels[:, columns, :] = strip
+
+    def _add_glows(self, pixels: np.ndarray, top: int):
+        rows, width = pixels.shape[:2]
+        y = (np.arange(top, top + rows) + 0.5) * (self.grid_height / self.height) - 0.5
+        x = (np.arange(width) + 0.5) * (self.grid_width / self.width) - 0.5
+        y0, y1, fy = _interpolation(y, self.grid_height)
+        x0, x1, fx = _interpolation(x, self.grid_width)
+
+        upsampled = kernels.scratch("glow", (rows, width))
+        scratch = kernels.scratch("overlay", (rows, width))
+        for tint, field in self._glows.items():
+            # Rows first, on the narrow grid, then columns at full size
+            band = field[y0] * (1 - fy[:, None]) + field[y1] * fy[:, None]
+            np.take(band, x0, axis=1, out=upsampled)
+            upsampled *= 1 - fx
+            np.multiply(band[:, x1], fx, out=scratch)
+            upsampled += scratch
+            for channel, weight in enumerate(tint):
+                if weight:
+                    np.multiply(upsampled, np.float32(weight), out=scratch)
+                    pixels[:, :, channel] += scratch
+
+    def _add_disc(
+        self,
+        pixels: np.ndarray,
+        top: int,
+        center_y: int,
+        center_x: int,
+        radius: int,
+        color: np.ndarray,
+    ) -> Optional[Tuple[slice, slice]]:
+        """Add a disc within its bounding box; returns the box, or None if it misses the band"""
+        y_start, y_end = max(top, center_y - radius), min(top + pixels.shape[0], center_y + radius + 1)
+        x_start, x_end = max(0, center_x - radius), min(self.width, center_x + radius + 1)
+        if y_start >= y_end or x_start >= x_end:
+            return None
+
+        Y, X = np.ogrid[y_start:y_end, x_start:x_end]
+        inside = (X - center_x)**2 + (Y - center_y)**2 <= radius**2
+        box = (slice(y_start - top, y_end - top), slice(x_start, x_end))
+        for channel, value in enumerate(color):
+            if value:
+                region = pixels[box + (channel,)]
+                np.add(region, value, out=region, where=inside)
+        return box
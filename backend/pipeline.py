@@ -0,0 +1,480 @@
+"""Effect chains compiled into fused stages.
+
+A pipeline runs an ordered list of effects on one decoded image without
+encoding between them. Each effect is described as a short sequence of
+stages (color lookup tables, spatial masks, float kernels and opaque PIL
+filters), and the compiler merges neighbouring stages before anything
+runs: adjacent lookup tables are composed into one table and adjacent
+masks are multiplied into one cached mask. Numeric stages work in place
+on a single float32 buffer from the worker's scratch pool, so images of
+the same size reuse it instead of allocating their own.
+
+A one-step pipeline gives the same pixels as calling the effect directly.
+Longer chains match running the effects one after another, except that
+rounding between two fused masks is skipped.
+
+Images whose working buffers would exceed ``TILE_MEMORY_BYTES`` are
+processed in bands of full-width rows. Masks and grain are positioned
+relative to the whole image, and neighbourhood filters get overlapping
+halo rows, so banded output is identical to processing the whole image
+while intermediate memory stays within the budget.
+
+Several images of the same size can run as one (images, rows, width, 3)
+stack with :meth:`Pipeline.run_batch`. Tables, masks and rounding then
+run once for the whole stack, while kernels and filters still run per
+image with that image's generator, so each result is the same as
+running the image alone.
+"""
+
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+import effects
+import grain
+import kernels
+import lut
+import masks
+from effects import EFFECTS, RANDOM_EFFECTS, ImageEffects
+
+# Longest chain a single request may ask for
+MAX_STEPS = 16
+
+# Budget for intermediate buffers of one image; larger images run in bands
+TILE_MEMORY_BYTES = int(os.getenv("TILE_MEMORY_BYTES", 256 * 1024 * 1024))
+
+# Working memory per band pixel: float32 buffer, mask, uint8 copies in
+# and out, a blend snapshot and overlay scratch
+BYTES_PER_PIXEL = 48
+
+MIN_BAND_ROWS = 16
+
+
+class Lut(NamedTuple):
+    """Per-channel lookup, a (3, 256) table of float results"""
+    tables: np.ndarray
+
+
+class Mask(NamedTuple):
+    """Broadcast multiply by the product of named masks, each with a strength"""
+    factors: Tuple[Tuple[str, float], ...]
+
+
+class Kernel(NamedTuple):
+    """In-place float32 operation ``apply(pixels, plan, top)``
+
+    ``plan(height, width, rng)`` draws the kernel's randomness for the
+    whole image once, before any band is processed.
+    """
+    plan: Callable[[int, int, np.random.Generator], Any]
+    apply: Callable[[np.ndarray, Any, int], None]
+
+
+class Filter(NamedTuple):
+    """Opaque ``fn(image, rng)`` on a PIL image
+
+    ``halo`` is how many rows around a band the filter reads: 0 for
+    per-pixel filters, None when it needs the whole image.
+    """
+    fn: Callable[[Image.Image, np.random.Generator], Image.Image]
+    halo: Optional[int] = None
+
+
+class Quantize(NamedTuple):
+    """Truncate to whole levels, as converting to uint8 at the end of an effect does"""
+
+
+class Blend(NamedTuple):
+    """Run ``stages`` and mix the result with their input by ``amount``"""
+    stages: Tuple[Any, ...]
+    amount: float
+
+
+Stage = Union[Lut, Mask, Kernel, Filter, Quantize, Blend]
+
+MASKS = {
+    "vignette": masks.vignette,
+    "border_fade": masks.border_fade,
+}
+
+
+def _lomo_saturation(image: Image.Image, rng: np.random.Generator) -> Image.Image:
+    return effects.saturate(image, 1.5)
+
+
+def _fuji_saturation(image: Image.Image, rng: np.random.Generator) -> Image.Image:
+    return effects.saturate(image, 1.15)
+
+
+def _grade(luts: Sequence[np.ndarray]) -> Lut:
+    return Lut(np.stack(luts))
+
+
+def _plan_grain(height: int, width: int, rng: np.random.Generator) -> grain.GrainPlan:
+    return grain.plan_grain(height, width, rng)
+
+
+# How each effect decomposes into stages; see the matching ImageEffects method
+EFFECT_STAGES = {
+    "vintage": (Filter(ImageEffects.vintage, halo=0),),
+    "black_white": (Filter(ImageEffects.black_white, halo=0),),
+    # Contrast pivots on the mean of the whole image
+    "cinematic": (Filter(ImageEffects.cinematic),),
+    "lomo": (Filter(_lomo_saturation, halo=0), Mask((("vignette", 1.0),))),
+    "warm": (_grade(effects.WARM_LUTS),),
+    "cool": (_grade(effects.COOL_LUTS),),
+    # 3x3 and 5x5 convolution kernels
+    "sharp": (Filter(ImageEffects.sharp, halo=1),),
+    "soft": (Filter(ImageEffects.soft, halo=2),),
+    "analog_kodak": (_grade(effects.KODAK_LUTS), Kernel(_plan_grain, effects.kodak_finish)),
+    "analog_fuji": (
+        _grade(effects.FUJI_LUTS),
+        Kernel(_plan_grain, effects.fuji_grain),
+        Quantize(),
+        Filter(_fuji_saturation, halo=0),
+    ),
+    "analog_polaroid": (
+        _grade(effects.POLAROID_LUTS),
+        Mask((("border_fade", 1.0),)),
+        Kernel(_plan_grain, effects.polaroid_finish),
+    ),
+    "analog_expired": (_grade(effects.EXPIRED_LUTS), Kernel(effects.plan_expired, effects.expired_artifacts)),
+    "analog_cross_process": (_grade(effects.CROSS_PROCESS_LUTS), Kernel(_plan_grain, effects.cross_process_grain)),
+    "analog_light_leak": (Kernel(effects.plan_light_leaks, effects.light_leaks),),
+}
+
+
+@dataclass(frozen=True)
+class Step:
+    """One effect of a chain; ``amount`` blends its result with its input"""
+
+    effect: str
+    amount: float = 1.0
+
+
+def parse_steps(spec: str) -> Tuple[Step, ...]:
+    """Parse a chain given as comma-separated effect names or a JSON list
+
+    JSON items are effect names or objects like
+    ``{"effect": "lomo", "amount": 0.5}``. Raises ``ValueError`` with a
+    message suitable for the client.
+    """
+    spec = spec.strip()
+    if spec.startswith("["):
+        try:
+            items = json.loads(spec)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid pipeline JSON: {e.msg}")
+        if not isinstance(items, list):
+            raise ValueError("Pipeline must be a list of steps")
+    else:
+        items = [name.strip() for name in spec.split(",") if name.strip()]
+
+    steps = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"effect": item}
+        if not isinstance(item, dict) or not isinstance(item.get("effect"), str):
+            raise ValueError("Each pipeline step needs an 'effect' name")
+        unknown = set(item) - {"effect", "amount"}
+        if unknown:
+            raise ValueError(f"Unknown pipeline step parameter '{sorted(unknown)[0]}'")
+
+        effect = item["effect"]
+        amount = item.get("amount", 1.0)
+        if effect not in EFFECTS:
+            raise ValueError(f"Effect '{effect}' not found")
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not 0 <= amount <= 1:
+            raise ValueError(f"Amount for '{effect}' must be a number between 0 and 1")
+        steps.append(Step(effect, float(amount)))
+
+    if not steps:
+        raise ValueError("No effects requested")
+    if len(steps) > MAX_STEPS:
+        raise ValueError(f"Pipelines are limited to {MAX_STEPS} steps")
+    return tuple(steps)
+
+
+def is_random(steps: Sequence[Step]) -> bool:
+    """Whether the chain's output depends on the random generator"""
+    return any(step.effect in RANDOM_EFFECTS and step.amount > 0 for step in steps)
+
+
+def cache_params(steps: Sequence[Step]) -> List[List[Any]]:
+    """Steps as plain values for result cache keys"""
+    return [[step.effect, step.amount] for step in steps]
+
+
+def _expand(step: Step) -> List[Stage]:
+    """Stages of one step, ending on whole levels like the effect's output"""
+    stages = list(EFFECT_STAGES[step.effect])
+    if step.amount == 0:
+        return []
+
+    if step.amount < 1:
+        # Point and mask effects blend exactly inside their tables
+        if len(stages) == 1 and isinstance(stages[0], Lut):
+            tables = stages[0].tables
+            stages = [Lut(lut.LEVELS + step.amount * (tables - lut.LEVELS))]
+        elif len(stages) == 1 and isinstance(stages[0], Mask):
+            stages = [Mask(tuple((name, strength * step.amount) for name, strength in stages[0].factors))]
+        else:
+            stages = [Blend(tuple(optimize(stages + [Quantize()])), step.amount)]
+
+    return stages + [Quantize()]
+
+
+def optimize(stages: Sequence[Stage]) -> List[Stage]:
+    """Drop redundant rounding and fuse neighbouring tables and masks"""
+    fused: List[Stage] = []
+    for stage in stages:
+        previous = fused[-1] if fused else None
+
+        if isinstance(stage, (Lut, Filter)) and isinstance(previous, Quantize):
+            # Both truncate their input anyway
+            fused.pop()
+            previous = fused[-1] if fused else None
+        elif isinstance(stage, Mask) and isinstance(previous, Quantize) and len(fused) > 1 and isinstance(fused[-2], Mask):
+            # Skip rounding between masks so they can be fused
+            fused.pop()
+            previous = fused[-1]
+
+        if isinstance(stage, Quantize):
+            if previous is None or isinstance(previous, (Quantize, Filter)):
+                continue
+            if isinstance(previous, Lut):
+                fused[-1] = Lut(np.floor(previous.tables))
+                continue
+        elif isinstance(stage, Lut) and isinstance(previous, Lut):
+            fused[-1] = Lut(lut.compose(previous.tables, stage.tables))
+            continue
+        elif isinstance(stage, Mask) and isinstance(previous, Mask):
+            fused[-1] = Mask(previous.factors + stage.factors)
+            continue
+
+        fused.append(stage)
+
+    # The final uint8 conversion truncates
+    if fused and isinstance(fused[-1], Quantize):
+        fused.pop()
+    return fused
+
+
+class _Frame:
+    """Working images of a batch, held either as PIL images or as one float32 stack
+
+    Opaque filters and whole-level lookups work on the images, everything
+    else on the (images, rows, width, 3) stack, which is the worker's
+    "frame" scratch. A single image is a stack of one.
+    """
+
+    def __init__(self, images: Sequence[Image.Image]):
+        self._images: Optional[List[Image.Image]] = None
+        self._pixels: Optional[np.ndarray] = None
+        self.set_images(images)
+
+    def set_images(self, images: Sequence[Image.Image]):
+        self._images = [image if image.mode == "RGB" else image.convert("RGB") for image in images]
+
+    def images(self) -> List[Image.Image]:
+        if self._images is None:
+            self._images = [kernels.to_image(pixels) for pixels in self._pixels]
+        return self._images
+
+    def _buffer(self, shape: Tuple[int, ...]) -> np.ndarray:
+        if self._pixels is None or self._pixels.shape != shape:
+            self._pixels = kernels.scratch("frame", shape)
+        return self._pixels
+
+    def pixels(self) -> np.ndarray:
+        if self._images is not None:
+            first = np.asarray(self._images[0])
+            stack = self._buffer((len(self._images),) + first.shape)
+            stack[0] = first
+            for index, image in enumerate(self._images[1:], 1):
+                stack[index] = np.asarray(image)
+            self._images = None
+        return self._pixels
+
+    def lookup(self, tables: np.ndarray):
+        if np.array_equal(tables, np.floor(tables)):
+            # Whole-level tables are faster on Pillow's uint8 path
+            self._images = [lut.apply(image, tables) for image in self.images()]
+            return
+
+        if self._images is None:
+            # The stack is contiguous, so one lookup covers every image
+            stack = self._pixels
+            lut.apply_into(stack.reshape(-1, *stack.shape[2:]), tables, stack.reshape(-1, *stack.shape[2:]))
+            return
+
+        # Index straight from the PIL images when the stack is stale
+        sources = [np.asarray(image) for image in self._images]
+        stack = self._buffer((len(sources),) + sources[0].shape)
+        for source, out in zip(sources, stack):
+            lut.apply_into(source, tables, out)
+        self._images = None
+
+
+def _mask(factors: Tuple[Tuple[str, float], ...], width: int, height: int, top: int, bottom: int) -> np.ndarray:
+    if len(factors) == 1 and factors[0][1] == 1.0:
+        return MASKS[factors[0][0]](width, height, top, bottom)
+
+    def build() -> np.ndarray:
+        product = np.ones((bottom - top, width), dtype=np.float32)
+        for name, strength in factors:
+            mask = MASKS[name](width, height, top, bottom)
+            product *= mask if strength == 1.0 else 1 + np.float32(strength) * (mask - 1)
+        return product
+
+    return masks.mask_cache.get(("fused", factors, width, height, top, bottom), build)
+
+
+def _plan(stages: Sequence[Stage], height: int, width: int, rng: np.random.Generator) -> List[Any]:
+    """Kernel plans of one image in the order :func:`_run` consumes them"""
+    plans = []
+    for stage in stages:
+        if isinstance(stage, Kernel):
+            plans.append(stage.plan(height, width, rng))
+        elif isinstance(stage, Blend):
+            plans.extend(_plan(stage.stages, height, width, rng))
+    return plans
+
+
+def _halo(stages: Sequence[Stage]) -> Optional[int]:
+    """Rows of context a band needs on each side, None if it can't be banded"""
+    total = 0
+    for stage in stages:
+        if isinstance(stage, Filter):
+            halo = stage.halo
+        elif isinstance(stage, Blend):
+            halo = _halo(stage.stages)
+        else:
+            continue
+        if halo is None:
+            return None
+        total += halo
+    return total
+
+
+def _run(
+    stages: Sequence[Stage],
+    frame: _Frame,
+    rngs: Sequence[np.random.Generator],
+    plans: Sequence[Iterator[Any]],
+    top: int,
+    height: int,
+):
+    """Run ``stages`` on a frame holding the image rows from ``top`` of ``height`` row images
+
+    ``rngs`` and ``plans`` hold one generator and one plan iterator per
+    image, so every image of a stack gets its own randomness.
+    """
+    for stage in stages:
+        if isinstance(stage, Filter):
+            frame.set_images([stage.fn(image, rng) for image, rng in zip(frame.images(), rngs)])
+        elif isinstance(stage, Lut):
+            frame.lookup(stage.tables)
+        elif isinstance(stage, Mask):
+            pixels = frame.pixels()
+            rows, width = pixels.shape[1:3]
+            # One mask broadcast over the whole stack
+            pixels *= _mask(stage.factors, width, height, top, top + rows)[:, :, None]
+        elif isinstance(stage, Kernel):
+            for pixels, image_plans in zip(frame.pixels(), plans):
+                stage.apply(pixels, next(image_plans), top)
+        elif isinstance(stage, Quantize):
+            pixels = frame.pixels()
+            np.floor(pixels, out=pixels)
+        elif isinstance(stage, Blend):
+            before = kernels.scratch("blend", frame.pixels().shape)
+            np.copyto(before, frame.pixels())
+            _run(stage.stages, frame, rngs, plans, top, height)
+            after = frame.pixels()
+            after -= before
+            after *= np.float32(stage.amount)
+            after += before
+
+
+def band_rows(width: int, halo: int, memory_budget: int) -> int:
+    """Rows per band that keep a band's working buffers within ``memory_budget``"""
+    return max(MIN_BAND_ROWS, memory_budget // (width * BYTES_PER_PIXEL) - 2 * halo)
+
+
+class Pipeline:
+    """A compiled effect chain; call it like an effect"""
+
+    def __init__(self, steps: Sequence[Step]):
+        self.steps = tuple(steps)
+        self.stages = tuple(optimize([stage for step in self.steps for stage in _expand(step)]))
+        self.halo = _halo(self.stages)
+
+    def __call__(
+        self,
+        image: Image.Image,
+        rng: Optional[np.random.Generator] = None,
+        memory_budget: Optional[int] = None,
+    ) -> Image.Image:
+        """Run the chain, in bands of rows if the image is too large for ``memory_budget``"""
+        return self.run_batch([image], [rng or np.random.default_rng()], memory_budget)[0]
+
+    def run_batch(
+        self,
+        images: Sequence[Image.Image],
+        rngs: Sequence[np.random.Generator],
+        memory_budget: Optional[int] = None,
+    ) -> List[Image.Image]:
+        """Run the chain on same-sized images as one stack
+
+        Tables, masks and quantization run once over the whole
+        (images, rows, width, 3) stack, kernels and filters per image with
+        that image's generator, so each result matches calling the
+        pipeline on the image alone. The budget covers the whole stack.
+        """
+        images = [image if image.mode == "RGB" else image.convert("RGB") for image in images]
+        if not self.stages:
+            return images
+        if len({image.size for image in images}) > 1:
+            raise ValueError("Stacked images must all have the same size")
+
+        width, height = images[0].size
+        budget = TILE_MEMORY_BYTES if memory_budget is None else memory_budget
+        if self.halo is None and len(images) > 1 and len(images) * width * height * BYTES_PER_PIXEL > budget:
+            # Can't be banded, and the stack won't fit: one image at a time
+            return [self.run_batch([image], [rng], budget)[0] for image, rng in zip(images, rngs)]
+
+        plans = [_plan(self.stages, height, width, rng) for rng in rngs]
+        rows = band_rows(width, self.halo or 0, budget // len(images))
+        if self.halo is None or rows >= height:
+            frame = _Frame(images)
+            _run(self.stages, frame, rngs, [iter(image_plans) for image_plans in plans], 0, height)
+            return frame.images()
+
+        outputs = [Image.new("RGB", (width, height)) for _ in images]
+        frame = None
+        for top in range(0, height, rows):
+            bottom = min(top + rows, height)
+            # Halo rows give neighbourhood filters real context at band edges
+            band_top = max(0, top - self.halo)
+            band_bottom = min(height, bottom + self.halo)
+            bands = [image.crop((0, band_top, width, band_bottom)) for image in images]
+            if frame is None:
+                frame = _Frame(bands)
+            else:
+                frame.set_images(bands)
+
+            _run(self.stages, frame, rngs, [iter(image_plans) for image_plans in plans], band_top, height)
+            for output, result in zip(outputs, frame.images()):
+                output.paste(result.crop((0, top - band_top, width, bottom - band_top)), (0, top))
+        return outputs
+
+
+@lru_cache(maxsize=256)
+def compile_steps(steps: Tuple[Step, ...]) -> Pipeline:
+    """Compiled pipeline for ``steps``, cached per process"""
+    return Pipeline(steps)
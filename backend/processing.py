@@ -0,0 +1,182 @@
+"""Per-image processing pipeline executed inside the worker pool."""
+
+import io
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from encoding import EncodeOptions, encode, source_metadata
+from geometry import Geometry
+from metrics import stage
+from pipeline import Step, compile_steps
+
+
+def load(
+    data: bytes,
+    max_size: Optional[int] = None,
+    geometry: Geometry = Geometry(),
+) -> Tuple[Image.Image, Dict[str, Any]]:
+    """Decode an upload to RGB pixels, returning the image and its source metadata
+
+    ``geometry`` crops and resizes the image as it is decoded, before any
+    effect sees it.
+    """
+    with stage("decode"):
+        image = Image.open(io.BytesIO(data))
+        source = source_metadata(image)
+        image = geometry.apply(image, max_size)
+        image.load()
+
+    with stage("convert"):
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+    return image, source
+
+
+def effect_label(steps: Tuple[Step, ...]) -> str:
+    """Effect name for stage metrics, "pipeline" for chains"""
+    return steps[0].effect if len(steps) == 1 else "pipeline"
+
+
+def run_steps(
+    image: Image.Image,
+    steps: Tuple[Step, ...],
+    seed: Optional[Union[int, Sequence[int]]],
+    options: EncodeOptions,
+    source: Optional[Dict[str, Any]],
+) -> bytes:
+    """Apply compiled ``steps`` and encode the result"""
+    with stage("effect", effect=effect_label(steps)):
+        processed_image = compile_steps(steps)(image, np.random.default_rng(seed))
+
+    with stage("encode"):
+        return encode(processed_image, options, source)
+
+
+def process_pipeline(
+    data: bytes,
+    steps: Tuple[Step, ...],
+    seed: Optional[Union[int, Sequence[int]]] = None,
+    max_size: Optional[int] = None,
+    options: EncodeOptions = EncodeOptions(),
+    geometry: Geometry = Geometry(),
+) -> bytes:
+    """Decode an uploaded image, apply a chain of effects and encode the result
+
+    ``steps`` run as one compiled pipeline, so very large images are
+    processed in bands within ``TILE_MEMORY_BYTES`` and the image is decoded
+    and encoded once whatever the number of effects. ``seed`` makes the
+    effects' randomness reproducible; without it every call draws fresh
+    grain. ``geometry`` crops and resizes the image first and ``max_size``
+    then downscales it (used for previews), so effects only run on the kept
+    pixels and their vignettes and borders follow the output frame.
+    ``options`` picks the output format.
+    """
+    image, source = load(data, max_size, geometry)
+    return run_steps(image, steps, seed, options, source)
+
+
+def process_batch(
+    datas: Sequence[bytes],
+    steps: Tuple[Step, ...],
+    seeds: Sequence[Optional[Union[int, Sequence[int]]]],
+    max_size: Optional[int] = None,
+    options: Sequence[EncodeOptions] = (),
+    geometry: Geometry = Geometry(),
+) -> List[Union[bytes, Exception]]:
+    """Like :func:`process_pipeline` for several uploads in one worker call
+
+    Images that decode to the same size run through the pipeline as one
+    stack (see :meth:`~pipeline.Pipeline.run_batch`), each with the grain
+    and leaks of its own seed, so every result matches processing the
+    upload alone. ``options`` holds one entry per upload. A file that
+    fails gets its exception in place of its result.
+    """
+    results: List[Union[bytes, Exception, None]] = [None] * len(datas)
+    loaded: Dict[int, Tuple[Image.Image, Dict[str, Any]]] = {}
+    for index, data in enumerate(datas):
+        try:
+            loaded[index] = load(data, max_size, geometry)
+        except Exception as e:
+            results[index] = e
+
+    groups: Dict[Tuple[int, int], List[int]] = {}
+    for index, (image, _) in loaded.items():
+        groups.setdefault(image.size, []).append(index)
+
+    pipeline = compile_steps(steps)
+    for indices in groups.values():
+        try:
+            with stage("effect", effect=effect_label(steps)):
+                images = pipeline.run_batch(
+                    [loaded[index][0] for index in indices],
+                    [np.random.default_rng(seeds[index]) for index in indices],
+                )
+        except Exception as e:
+            for index in indices:
+                results[index] = e
+            continue
+
+        for index, image in zip(indices, images):
+            try:
+                with stage("encode"):
+                    results[index] = encode(image, options[index], loaded[index][1])
+            except Exception as e:
+                results[index] = e
+    return results
+
+
+def decoded_shape(data: bytes, max_size: Optional[int] = None, geometry: Geometry = Geometry()) -> Tuple[int, int, int]:
+    """Shape of the RGB array :func:`decode_into_shared` will produce
+
+    Only parses the image header, so it is cheap enough for the event loop.
+    """
+    width, height = geometry.output_size(Image.open(io.BytesIO(data)).size, max_size)
+    return height, width, 3
+
+
+def decode_into_shared(
+    data: bytes,
+    shm_name: str,
+    shape: Tuple[int, int, int],
+    max_size: Optional[int] = None,
+    geometry: Geometry = Geometry(),
+) -> Dict[str, Any]:
+    """Decode an image once as RGB into an existing shared memory block
+
+    Returns the input's :func:`~encoding.source_metadata` for encoding the
+    results.
+    """
+    image, source = load(data, max_size, geometry)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        pixels = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        pixels[...] = np.asarray(image)
+        del pixels
+    finally:
+        shm.close()
+    return source
+
+
+def process_shared(
+    shm_name: str,
+    shape: Tuple[int, int, int],
+    effect: str,
+    seed: Optional[Union[int, Sequence[int]]] = None,
+    options: EncodeOptions = EncodeOptions(),
+    source: Optional[Dict[str, Any]] = None,
+) -> bytes:
+    """Apply an effect to an image decoded by :func:`decode_into_shared`"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        pixels = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        # fromarray copies RGB data, so the shared block stays read-only
+        image = Image.fromarray(pixels)
+        del pixels
+    finally:
+        shm.close()
+
+    return run_steps(image, (Step(effect),), seed, options, source)
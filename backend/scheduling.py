@@ -0,0 +1,181 @@
+"""Per-effect cost model and cost-aware ordering of queued work.
+
+Effects differ in cost by more than an order of magnitude: ``warm`` is a
+table lookup, ``soft`` several full-resolution blurs. :class:`CostModel`
+keeps each effect's measured seconds per megapixel, plus the cost of
+decoding and encoding, and turns a request into expected seconds of
+worker time. It is calibrated at startup from the workers' warm-up
+timings; a ``benchmarks.throughput`` report named by ``COST_MODEL``
+takes precedence for the effects it covers, since it measures
+full-size frames.
+
+:class:`CostQueue` orders waiting work shortest-expected-job-first with
+aging: an entry's priority is its expected seconds minus
+``SCHEDULER_AGING`` times the seconds it has waited. Cheap requests go
+ahead of queued expensive ones, and an expensive request still runs once
+it has waited about as long as it is expected to take.
+"""
+
+import heapq
+import itertools
+import json
+import os
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Generic, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from pipeline import Step
+
+# benchmarks.throughput JSON report to take effect costs from
+COST_MODEL = os.getenv("COST_MODEL") or None
+
+# Seconds of expected work forgiven per second waited; 0 is pure shortest-first
+SCHEDULER_AGING = float(os.getenv("SCHEDULER_AGING", 1.0))
+
+# Seconds per megapixel assumed for anything not measured yet
+DEFAULT_SECONDS_PER_MP = 0.05
+
+T = TypeVar("T")
+
+
+class CostModel:
+    """Expected worker seconds per megapixel, per effect
+
+    ``base`` covers decoding, conversion and encoding, paid once per image
+    whatever the effects.
+    """
+
+    def __init__(self, effects: Optional[Dict[str, float]] = None, base: float = DEFAULT_SECONDS_PER_MP):
+        self.effects = dict(effects or {})
+        self.base = base
+        self.sources = {name: "benchmark" for name in self.effects}
+
+    @classmethod
+    def from_env(cls) -> "CostModel":
+        """Model from the COST_MODEL report, or an uncalibrated one"""
+        return cls.from_benchmark(COST_MODEL) if COST_MODEL else cls()
+
+    @classmethod
+    def from_benchmark(cls, path: str) -> "CostModel":
+        """Effect costs from a ``benchmarks.throughput`` report, at the largest size measured"""
+        with open(path) as f:
+            report = json.load(f)
+
+        largest: Dict[str, Dict[str, Any]] = {}
+        for row in report["results"]:
+            if row["effect"] not in largest or row["megapixels"] > largest[row["effect"]]["megapixels"]:
+                largest[row["effect"]] = row
+        return cls({name: 1 / row["mp_per_s"] for name, row in largest.items()})
+
+    def calibrate(self, reports: Iterable[Optional[Dict[str, Any]]]):
+        """Take costs from worker warm-up reports, the median over workers
+
+        Effects already measured by a benchmark report keep those costs.
+        """
+        rates: Dict[str, List[float]] = {}
+        bases = []
+        for report in reports:
+            if not report or "rates" not in report:
+                continue
+            for name, seconds in report["rates"].items():
+                rates.setdefault(name, []).append(seconds)
+            if report.get("base") is not None:
+                bases.append(report["base"])
+
+        for name, values in rates.items():
+            if self.sources.get(name) != "benchmark":
+                self.effects[name] = statistics.median(values)
+                self.sources[name] = "warmup"
+        if bases:
+            self.base = statistics.median(bases)
+
+    def effect_seconds(self, name: str) -> float:
+        """Seconds per megapixel of effect ``name``; the median effect's if never measured"""
+        if name in self.effects:
+            return self.effects[name]
+        return statistics.median(self.effects.values()) if self.effects else DEFAULT_SECONDS_PER_MP
+
+    def seconds(self, steps: Sequence[Step], pixels: int) -> float:
+        """Expected worker seconds to decode, process and encode an image of ``pixels``"""
+        return pixels / 1e6 * (self.base + sum(self.effect_seconds(step.effect) for step in steps))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "base_mp_per_s": 1 / self.base if self.base else None,
+            "effects": {
+                name: {"mp_per_s": 1 / seconds if seconds else None, "source": self.sources.get(name)}
+                for name, seconds in sorted(self.effects.items())
+            },
+        }
+
+
+@dataclass(order=True)
+class _Entry:
+    key: float
+    sequence: int
+    item: Any = field(compare=False)
+    seconds: float = field(compare=False)
+    removed: bool = field(default=False, compare=False)
+
+
+class CostQueue(Generic[T]):
+    """Waiting items, cheapest expected first, with aging
+
+    Aging lowers every waiting item's priority at the same rate, so the
+    order only depends on ``seconds + aging * arrival`` and a heap keeps it.
+    Ties go to the earlier arrival.
+    """
+
+    def __init__(self, aging: float = SCHEDULER_AGING):
+        self.aging = max(0.0, aging)
+        self._heap: List[_Entry] = []
+        self._sequence = itertools.count()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _key(self, seconds: float) -> float:
+        return seconds + self.aging * time.monotonic()
+
+    def push(self, item: T, seconds: float) -> _Entry:
+        """Queue ``item``, expected to take ``seconds``; the entry can be passed to :meth:`remove`"""
+        entry = _Entry(self._key(seconds), next(self._sequence), item, seconds)
+        heapq.heappush(self._heap, entry)
+        self._size += 1
+        return entry
+
+    def _head(self) -> _Entry:
+        while self._heap[0].removed:
+            heapq.heappop(self._heap)
+        return self._heap[0]
+
+    def peek(self) -> T:
+        """Item that would be popped next; the queue must not be empty"""
+        return self._head().item
+
+    def pop(self) -> Tuple[T, float]:
+        """Remove the next item, returning it and its expected seconds"""
+        entry = self._head()
+        heapq.heappop(self._heap)
+        entry.removed = True
+        self._size -= 1
+        return entry.item, entry.seconds
+
+    def remove(self, entry: _Entry):
+        if not entry.removed:
+            entry.removed = True
+            self._size -= 1
+
+    def __iter__(self) -> Iterator[T]:
+        return (entry.item for entry in self._heap if not entry.removed)
+
+    def total(self) -> float:
+        """Expected seconds of all queued work"""
+        return sum(entry.seconds for entry in self._heap if not entry.removed)
+
+    def ahead(self, seconds: float) -> float:
+        """Expected seconds of queued work that would go before an item of ``seconds`` queued now"""
+        key = self._key(seconds)
+        return sum(entry.seconds for entry in self._heap if not entry.removed and entry.key <= key)
@@ -0,0 +1,11 @@
+import os
+import sys
+
+# Keep the app light and deterministic under test; set before anything imports it
+os.environ.setdefault("WORKER_MODE", "thread")
+os.environ.setdefault("WORKER_COUNT", "2")
+os.environ.setdefault("WARMUP_EFFECTS", "none")
+os.environ.setdefault("RESULT_CACHE_DIR", "")
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
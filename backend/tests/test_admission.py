@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from admission import AdmissionControl
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_client_cap():
+    async def scenario():
+        admission = AdmissionControl(max_pixels=100, max_client_requests=2)
+        grants = [await admission.acquire("a", 10), await admission.acquire("a", 10)]
+
+        with pytest.raises(HTTPException) as rejected:
+            await admission.acquire("a", 10)
+        assert rejected.value.status_code == 429
+        assert rejected.value.headers["Retry-After"] == str(admission.retry_after)
+
+        # Other clients and background work aren't affected
+        grants.append(await admission.acquire("b", 10))
+        grants.append(await admission.acquire(None, 10))
+
+        admission.release(grants[0])
+        grants.append(await admission.acquire("a", 10))
+        assert admission.stats()["rejected_client"] == 1
+
+    run(scenario())
+
+
+def test_full_queue_and_timeout_are_busy():
+    async def scenario():
+        admission = AdmissionControl(max_pixels=100, queue_size=1, timeout=0.05)
+        await admission.acquire("a", 100)
+
+        waiting = asyncio.create_task(admission.acquire("b", 10))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as rejected:
+            admission.check("c")
+        assert rejected.value.status_code == 503
+
+        with pytest.raises(HTTPException) as timed_out:
+            await waiting
+        assert timed_out.value.status_code == 503
+        assert admission.stats()["timed_out"] == 1
+        assert admission.stats()["queued"] == 0
+
+    run(scenario())
+
+
+def test_release_admits_cheapest_first():
+    async def scenario():
+        admission = AdmissionControl(max_pixels=100)
+        first = await admission.acquire("a", 100)
+
+        order = []
+
+        async def wait(client, cost, seconds):
+            admission.release(await admission.acquire(client, cost, seconds))
+            order.append(client)
+
+        tasks = [asyncio.create_task(wait("big", 100, 5.0)), asyncio.create_task(wait("small", 10, 0.1))]
+        await asyncio.sleep(0)
+        admission.release(first)
+        await asyncio.gather(*tasks)
+
+        assert order == ["small", "big"]
+        assert admission.in_flight == 0
+
+    run(scenario())
+
+
+def test_oversized_request_leaves_headroom():
+    async def scenario():
+        admission = AdmissionControl(max_pixels=100, headroom=20)
+        grant = await admission.acquire("a", 1000)
+        assert grant.cost == 80
+
+        # A small request still fits next to it
+        small = await asyncio.wait_for(admission.acquire("b", 20), 1)
+        admission.release(small)
+        admission.release(grant)
+        assert admission.in_flight == 0
+
+    run(scenario())
@@ -0,0 +1,54 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from encoding import EncodeOptions
+from pipeline import Pipeline, parse_steps
+from processing import process_batch, process_pipeline
+
+
+def photo(width: int = 96, height: int = 80, seed: int = 0) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8))
+
+
+def jpeg(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("spec, memory_budget", [
+    ("analog_kodak,soft,lomo", None),
+    # Bands of the stack
+    ("analog_kodak,soft,lomo", 1),
+    # Too large to stack and can't be banded: one image at a time
+    ("cinematic,analog_fuji", 1),
+])
+def test_batch_matches_single_images(spec, memory_budget):
+    pipeline = Pipeline(parse_steps(spec))
+    images = [photo(seed=seed) for seed in range(3)]
+    batch = pipeline.run_batch(images, [np.random.default_rng(seed) for seed in range(3)], memory_budget)
+    for seed, (image, result) in enumerate(zip(images, batch)):
+        alone = pipeline(image, np.random.default_rng(seed), memory_budget)
+        np.testing.assert_array_equal(np.asarray(result), np.asarray(alone))
+
+
+def test_stacked_images_must_match_in_size():
+    pipeline = Pipeline(parse_steps("warm"))
+    with pytest.raises(ValueError, match="same size"):
+        pipeline.run_batch([photo(), photo(width=40)], [np.random.default_rng()] * 2)
+
+
+def test_process_batch_matches_single_uploads():
+    steps = parse_steps("analog_polaroid")
+    datas = [jpeg(photo(seed=0)), b"not an image", jpeg(photo(width=40, seed=1)), jpeg(photo(seed=2))]
+    seeds = [[7, index] for index in range(len(datas))]
+    options = [EncodeOptions()] * len(datas)
+
+    results = process_batch(datas, steps, seeds, 64, options)
+    assert isinstance(results[1], Exception)
+    for index in (0, 2, 3):
+        assert results[index] == process_pipeline(datas[index], steps, seeds[index], 64, options[index])
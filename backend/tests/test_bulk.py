@@ -0,0 +1,64 @@
+import os
+
+import pytest
+from PIL import Image
+
+from bulk import main
+
+
+@pytest.fixture
+def photos(tmp_path):
+    source = tmp_path / "in"
+    (source / "trip").mkdir(parents=True)
+    Image.new("RGB", (64, 48), "red").save(source / "a.jpg")
+    Image.new("RGB", (48, 64), "blue").save(source / "trip" / "b.png")
+    (source / "notes.txt").write_text("not a photo")
+    return source
+
+
+def outputs(directory) -> dict:
+    return {
+        os.path.relpath(os.path.join(root, name), directory): os.stat(os.path.join(root, name)).st_mtime_ns
+        for root, _, files in os.walk(directory)
+        for name in files
+    }
+
+
+def test_rerun_skips_finished_files(photos, tmp_path, capsys):
+    output = tmp_path / "out"
+    args = [str(photos), str(output), "--effects", "warm,lomo", "--workers", "1", "--max-size", "32"]
+
+    main(args)
+    first = outputs(output)
+    assert sorted(first) == ["lomo/a.jpg", "lomo/trip/b.jpg", "warm/a.jpg", "warm/trip/b.jpg"]
+    with Image.open(output / "warm" / "trip" / "b.jpg") as image:
+        assert image.size == (24, 32)
+    assert "2 done, 0 skipped, 0 failed" in capsys.readouterr().out
+
+    main(args)
+    assert outputs(output) == first
+    assert "0 done, 2 skipped, 0 failed" in capsys.readouterr().out
+
+    # A missing output is redone; the rest are kept
+    os.remove(output / "lomo" / "a.jpg")
+    main(args)
+    assert "1 done, 1 skipped" in capsys.readouterr().out
+    assert outputs(output)["warm/trip/b.jpg"] == first["warm/trip/b.jpg"]
+
+    main(args + ["--overwrite"])
+    assert "2 done, 0 skipped" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("extra, message", [
+    (["--effects", "warm", "--max-size", "0"], "--max-size must be positive"),
+    (["--effects", "warm", "--max-size", "-5"], "--max-size must be positive"),
+    (["--effects", "warm", "--workers", "0"], "--workers must be at least 1"),
+    (["--effects", "warm,lomo,warm"], "effect 'warm' is given more than once"),
+    (["--effects", "sepia"], "Effect 'sepia' not found"),
+])
+def test_invalid_arguments(photos, tmp_path, capsys, extra, message):
+    with pytest.raises(SystemExit) as exited:
+        main([str(photos), str(tmp_path / "out")] + extra)
+    assert exited.value.code == 2
+    assert message in capsys.readouterr().err
+    assert not (tmp_path / "out").exists()
@@ -0,0 +1,115 @@
+import io
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from cache import ResultCache, result_key
+
+
+def jpeg(color: str = "red") -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def test_etag_and_not_modified():
+    import main
+
+    with TestClient(main.app) as client:
+        files = {"files": ("a.jpg", jpeg(), "image/jpeg")}
+        first = client.post("/apply-effect", data={"effect": "warm", "seed": "1"}, files=files)
+        assert first.status_code == 200
+        etag = first.headers["etag"]
+
+        hits = client.get("/cache/stats").json()["hits"]
+        second = client.post("/apply-effect", data={"effect": "warm", "seed": "1"}, files=files)
+        assert second.content == first.content
+        assert second.headers["etag"] == etag
+        assert client.get("/cache/stats").json()["hits"] == hits + 1
+
+        revalidated = client.post(
+            "/apply-effect", data={"effect": "warm", "seed": "1"}, files=files, headers={"If-None-Match": etag}
+        )
+        assert revalidated.status_code == 304
+        assert revalidated.content == b""
+
+        # Deterministic effects ignore the seed; random ones are only cached when seeded
+        assert client.post("/apply-effect", data={"effect": "warm", "seed": "2"}, files=files).headers["etag"] == etag
+        seeded = client.post("/apply-effect", data={"effect": "analog_kodak", "seed": "1"}, files=files)
+        assert seeded.headers["etag"] != etag
+        unseeded = client.post("/apply-effect", data={"effect": "analog_kodak"}, files=files)
+        assert "etag" not in unseeded.headers
+
+
+def test_result_key_depends_on_every_param():
+    key = result_key("digest", effect="warm", seed=1)
+    assert key == result_key("digest", seed=1, effect="warm")
+    assert key != result_key("digest", effect="warm", seed=2)
+    assert key != result_key("other", effect="warm", seed=1)
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache(memory_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("c") == b"cccc"
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(memory_bytes=0, disk_dir=str(tmp_path), disk_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a", "c"]
+    assert cache.get("b") is None
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.stats()["disk_bytes"] == 8
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    ResultCache(memory_bytes=0, disk_dir=str(tmp_path), disk_bytes=10).put("a", b"aaaa")
+
+    cache = ResultCache(memory_bytes=0, disk_dir=str(tmp_path), disk_bytes=10)
+    assert cache.get("a") == b"aaaa"
+    assert cache.stats()["disk_entries"] == 1
+
+    # A smaller limit evicts down to size on start
+    cache = ResultCache(memory_bytes=0, disk_dir=str(tmp_path), disk_bytes=2)
+    assert cache.get("a") is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_memory_hits_dont_wait_for_disk(tmp_path):
+    import threading
+
+    cache = ResultCache(memory_bytes=100, disk_dir=str(tmp_path), disk_bytes=100)
+    cache.put("memory", b"fast")
+
+    reading = threading.Event()
+    release = threading.Event()
+    disk_get = cache._disk.get
+
+    def slow_get(key):
+        reading.set()
+        release.wait(5)
+        return disk_get(key)
+
+    cache._disk.get = slow_get
+    lookup = threading.Thread(target=cache.get, args=("on-disk",))
+    lookup.start()
+    try:
+        assert reading.wait(5)
+        # Served while the other thread is still reading from disk
+        assert cache.get("memory") == b"fast"
+        assert lookup.is_alive()
+    finally:
+        release.set()
+        lookup.join()
+    assert cache.stats()["misses"] == 1
@@ -0,0 +1,104 @@
+import io
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image, JpegImagePlugin
+
+from encoding import JPEG_QUALITY
+
+
+def upload(fmt: str = "JPEG", **params) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), (200, 120, 40)).save(buffer, fmt, **params)
+    return buffer.getvalue()
+
+
+def exif() -> bytes:
+    data = Image.Exif()
+    data[0x010F] = "Lensify Camera"  # Make
+    return data.tobytes()
+
+
+@pytest.fixture(scope="module")
+def client():
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+def post(client, data: bytes, filename: str = "a.jpg", **fields):
+    return client.post(
+        "/apply-effect", data={"effect": "warm", **fields}, files={"files": (filename, data, "application/octet-stream")}
+    )
+
+
+def quantization(quality: int) -> dict:
+    return Image.open(io.BytesIO(upload(quality=quality, subsampling="4:2:0"))).quantization
+
+
+def test_defaults(client):
+    response = post(client, upload())
+    assert response.headers["content-type"] == "image/jpeg"
+    image = Image.open(io.BytesIO(response.content))
+    assert image.format == "JPEG"
+    assert image.quantization == quantization(JPEG_QUALITY)
+    assert JpegImagePlugin.get_sampling(image) == 2  # 4:2:0
+    assert "progressive" not in image.info
+    assert "exif" not in image.info
+
+
+def test_encoding_fields(client):
+    response = post(client, upload(), quality="60", subsampling="4:4:4", progressive="true")
+    image = Image.open(io.BytesIO(response.content))
+    assert image.quantization == Image.open(io.BytesIO(upload(quality=60, subsampling="4:4:4"))).quantization
+    assert JpegImagePlugin.get_sampling(image) == 0
+    assert image.info.get("progressive")
+
+    response = post(client, upload(), format="png")
+    assert response.headers["content-type"] == "image/png"
+    assert Image.open(io.BytesIO(response.content)).format == "PNG"
+
+
+def test_original_format(client):
+    response = post(client, upload("PNG"), filename="a.png", format="original")
+    assert response.headers["content-type"] == "image/png"
+
+    # Formats that can't be written fall back to JPEG
+    response = post(client, upload("BMP"), filename="a.bmp", format="original")
+    assert response.headers["content-type"] == "image/jpeg"
+
+    # Batches keep each file's format and name
+    files = [("files", ("a.png", upload("PNG"), "image/png")), ("files", ("b.jpg", upload(), "image/jpeg"))]
+    response = client.post("/apply-effect", data={"effect": "warm", "format": "original"}, files=files)
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        assert zf.namelist() == ["processed_a.png", "processed_b.jpg"]
+
+
+def test_keep_metadata(client):
+    source = upload(exif=exif())
+    assert "exif" not in Image.open(io.BytesIO(post(client, source).content)).info
+
+    kept = Image.open(io.BytesIO(post(client, source, keep_metadata="true").content))
+    assert kept.getexif()[0x010F] == "Lensify Camera"
+
+
+def test_invalid_encoding_fields(client, monkeypatch):
+    import main
+
+    response = post(client, upload(), format="tiff")
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Format 'tiff' not supported, expected one of jpeg")
+
+    # A format this Pillow build can't write
+    monkeypatch.setattr(main, "available_formats", lambda: {"jpeg": "JPEG"})
+    response = post(client, upload(), format="png")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Format 'png' not supported, expected one of jpeg, original"
+
+    response = post(client, upload(), subsampling="4:1:1")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Subsampling '4:1:1' not supported, expected one of 4:4:4, 4:2:2, 4:2:0"
+
+    assert post(client, upload(), quality="0").status_code == 422
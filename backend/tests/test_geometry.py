@@ -0,0 +1,73 @@
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from geometry import Geometry, scaled_size
+
+
+def test_parse():
+    geometry = Geometry.parse(crop="10, 20, 300, 200", aspect="16:9", size="640X360")
+    assert geometry == Geometry(crop=(10, 20, 300, 200), aspect=(16, 9), size=(640, 360))
+    assert not Geometry.parse()
+
+    for fields, message in [
+        ({"crop": "1,2,3"}, "Invalid crop '1,2,3', expected 'left,top,width,height'"),
+        ({"crop": "-1,0,10,10"}, "non-negative position"),
+        ({"crop": "0,0,0,10"}, "positive width and height"),
+        ({"aspect": "16/9"}, "Invalid aspect ratio"),
+        ({"aspect": "0:1"}, "Aspect ratio sides must be positive"),
+        ({"size": "wide"}, "Invalid size 'wide', expected 'WIDTHxHEIGHT'"),
+        ({"size": "20000x10"}, "Size sides must be between 1 and 10000"),
+    ]:
+        with pytest.raises(ValueError, match=message):
+            Geometry.parse(**fields)
+
+
+def test_box_and_output_size():
+    # Crops are clamped to the image
+    assert Geometry(crop=(50, 50, 500, 500)).box((200, 100)) == (50, 50, 200, 100)
+    # Largest centered box of the ratio
+    assert Geometry(aspect=(1, 1)).box((300, 100)) == (100, 0, 200, 100)
+    # A size without an aspect crops to its ratio instead of stretching
+    assert Geometry(size=(50, 50)).box((300, 100)) == (100, 0, 200, 100)
+    assert Geometry(size=(50, 50)).output_size((300, 100)) == (50, 50)
+    assert Geometry(crop=(0, 0, 400, 200)).output_size((1000, 1000), max_size=100) == (100, 50)
+
+    with pytest.raises(ValueError, match=r"Crop \(300, 0, 10, 10\) lies outside the 200x100 image"):
+        Geometry(crop=(300, 0, 10, 10)).box((200, 100))
+
+
+def test_scaled_size_never_upscales():
+    assert scaled_size((4000, 3000), 512) == (512, 384)
+    assert scaled_size((300, 200), 512) == (300, 200)
+    assert scaled_size((300, 200)) == (300, 200)
+
+
+def test_apply():
+    image = Image.new("RGB", (200, 100))
+    image.paste((255, 0, 0), (100, 0, 200, 100))
+    result = Geometry(crop=(100, 0, 100, 100), size=(20, 20)).apply(image)
+    assert result.size == (20, 20)
+    assert result.getpixel((10, 10)) == (255, 0, 0)
+
+
+def test_crop_errors_are_client_errors():
+    import main
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48)).save(buffer, "JPEG")
+    files = {"files": ("a.jpg", buffer.getvalue(), "image/jpeg")}
+    with TestClient(main.app) as client:
+        response = client.post("/apply-effect", data={"effect": "warm", "crop": "1,2"}, files=files)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid crop '1,2', expected 'left,top,width,height'"
+
+        response = client.post("/apply-effect", data={"effect": "warm", "crop": "100,0,10,10"}, files=files)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "a.jpg: Crop (100, 0, 10, 10) lies outside the 64x48 image"
+
+        response = client.post("/apply-effect", data={"effect": "warm", "crop": "0,0,32,48", "size": "16x24"}, files=files)
+        assert response.status_code == 200
+        assert Image.open(io.BytesIO(response.content)).size == (16, 24)
@@ -0,0 +1,45 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from grain import TILE_SIZE, apply_grain, plan_grain
+from pipeline import Step
+from processing import process_pipeline
+
+
+def grain(height: int, width: int, seed: int, top: int = 0, rows=None) -> np.ndarray:
+    plan = plan_grain(height, width, np.random.default_rng(seed))
+    pixels = np.full((rows or height, width, 3), 128, dtype=np.float32)
+    return apply_grain(pixels, 12.0, plan, top)
+
+
+def test_same_seed_same_grain():
+    first = grain(600, 700, seed=42)
+    assert first.tobytes() == grain(600, 700, seed=42).tobytes()
+    assert first.tobytes() != grain(600, 700, seed=43).tobytes()
+
+
+def test_grain_statistics():
+    noise = grain(2 * TILE_SIZE, 3 * TILE_SIZE, seed=1) - 128
+    assert abs(noise.mean()) < 0.5
+    assert noise.std() == pytest.approx(12.0, rel=0.05)
+
+
+@pytest.mark.parametrize("top, rows", [(0, 100), (TILE_SIZE - 10, 30), (300, 250), (500, 100)])
+def test_banded_grain_matches_whole_image(top, rows):
+    height, width = 600, 700
+    whole = grain(height, width, seed=7)
+    band = grain(height, width, seed=7, top=top, rows=rows)
+    assert band.tobytes() == whole[top:top + rows].tobytes()
+
+
+@pytest.mark.parametrize("effect", ["analog_kodak", "analog_fuji", "analog_cross_process"])
+def test_seeded_effect_is_byte_identical(effect):
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 200), (120, 90, 60)).save(buffer, "JPEG")
+    steps = (Step(effect),)
+    first = process_pipeline(buffer.getvalue(), steps, seed=5)
+    assert first == process_pipeline(buffer.getvalue(), steps, seed=5)
+    assert first != process_pipeline(buffer.getvalue(), steps, seed=6)
@@ -0,0 +1,176 @@
+import asyncio
+
+import pytest
+
+from jobs import DONE, FAILED, JobLimitExceeded, JobManager
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def wait_until(condition, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_job_lifecycle(tmp_path):
+    async def item(job, index):
+        if index == 1:
+            raise ValueError("bad image")
+        return f"result {index}".encode()
+
+    async def scenario():
+        manager = JobManager(item, directory=str(tmp_path), concurrency=2)
+        await manager.start()
+        try:
+            job = await manager.submit("client", ["a.jpg", "b.jpg", "c.jpg"], [b"a", b"b", b"c"], {})
+            assert manager.get(job.id) is job
+            await wait_until(lambda: job.complete)
+
+            assert job.statuses == [DONE, FAILED, DONE]
+            assert job.status == "done"
+            assert await manager.read_result(job, 2) == b"result 2"
+            assert job.expires_at(manager.ttl) == job.finished + manager.ttl
+
+            await manager.delete(job)
+            assert manager.get(job.id) is None
+            assert not (tmp_path / job.id).exists()
+        finally:
+            await manager.shutdown()
+
+    run(scenario())
+
+
+def test_clients_take_turns(tmp_path):
+    order = []
+    submitted = asyncio.Event()
+
+    async def item(job, index):
+        await submitted.wait()
+        order.append(job.client)
+        return b""
+
+    async def scenario():
+        manager = JobManager(item, directory=str(tmp_path), concurrency=1)
+        await manager.start()
+        try:
+            big = await manager.submit("big", ["x"] * 4, [b"x"] * 4, {})
+            small = await manager.submit("small", ["y"] * 2, [b"y"] * 2, {})
+            submitted.set()
+            await wait_until(lambda: big.complete and small.complete)
+        finally:
+            await manager.shutdown()
+
+    run(scenario())
+    # The first image was dispatched before the second job arrived
+    assert order == ["big", "big", "small", "big", "small", "big"]
+
+
+def test_running_job_is_not_expired(tmp_path):
+    release = asyncio.Event()
+
+    async def item(job, index):
+        await release.wait()
+        return b"done"
+
+    async def scenario():
+        manager = JobManager(item, directory=str(tmp_path), ttl=1)
+        await manager.start()
+        try:
+            job = await manager.submit("client", ["a.jpg"], [b"a"], {})
+            assert job.expires_at(manager.ttl) is None
+
+            # Several cleanup passes go by while the job runs past its TTL
+            await asyncio.sleep(2.5)
+            assert manager.get(job.id) is job
+            assert (tmp_path / job.id / "inputs" / "0").exists()
+
+            release.set()
+            await wait_until(lambda: job.complete)
+            assert job.statuses == [DONE]
+            assert await manager.read_result(job, 0) == b"done"
+
+            # Expired TTL seconds after finishing
+            await wait_until(lambda: manager.get(job.id) is None, timeout=5)
+            await wait_until(lambda: not (tmp_path / job.id).exists())
+        finally:
+            await manager.shutdown()
+
+    run(scenario())
+
+
+def test_client_limits(tmp_path):
+    release = asyncio.Event()
+
+    async def item(job, index):
+        await release.wait()
+        return b""
+
+    async def scenario():
+        manager = JobManager(item, directory=str(tmp_path), max_client_jobs=2, max_client_bytes=10)
+        await manager.start()
+        try:
+            first = await manager.submit("client", ["a"], [b"1234"], {})
+            await manager.submit("client", ["b"], [b"1234"], {})
+            with pytest.raises(JobLimitExceeded, match="unfinished"):
+                await manager.submit("client", ["c"], [b"1"], {})
+            # Other clients aren't affected
+            await manager.submit("other", ["d"], [b"1234"], {})
+
+            release.set()
+            await wait_until(lambda: first.complete)
+            await wait_until(lambda: all(job.complete for job in manager._jobs.values()))
+            # Finished jobs still count against the stored bytes until deleted
+            with pytest.raises(JobLimitExceeded, match="bytes"):
+                await manager.submit("client", ["e"], [b"123"], {})
+            await manager.delete(first)
+            await manager.submit("client", ["e"], [b"123"], {})
+        finally:
+            await manager.shutdown()
+
+    run(scenario())
+
+
+def test_job_api(monkeypatch):
+    import io
+    import time
+    import zipfile
+
+    from fastapi.testclient import TestClient
+    from PIL import Image
+
+    import main
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), "red").save(buffer, "JPEG")
+    files = [("files", (name, buffer.getvalue(), "image/jpeg")) for name in ("a.jpg", "b.jpg")]
+    files.append(("files", ("notes.txt", b"hello", "text/plain")))
+
+    with TestClient(main.app) as client:
+        response = client.post("/jobs", data={"effect": "warm"}, files=files)
+        assert response.status_code == 202
+        location = response.headers["Location"]
+        assert response.json()["rejected"] == ["notes.txt"]
+
+        deadline = time.monotonic() + 5
+        while (status := client.get(location).json())["status"] in ("queued", "running"):
+            assert time.monotonic() < deadline, "timed out"
+            time.sleep(0.01)
+        assert status["status"] == "done"
+        assert status["expires_at"] is not None
+
+        assert client.get(f"{location}/files/1").headers["content-type"] == "image/jpeg"
+        with zipfile.ZipFile(io.BytesIO(client.get(f"{location}/zip").content)) as zf:
+            assert zf.namelist() == ["processed_a.jpg", "processed_b.jpg"]
+            assert zf.comment == b"Failed files:\nnotes.txt"
+
+        assert client.delete(location).status_code == 204
+        assert client.get(location).status_code == 404
+
+        monkeypatch.setattr(main.job_manager, "max_client_bytes", 1)
+        response = client.post("/jobs", data={"effect": "warm"}, files=files[:1])
+        assert response.status_code == 429
+        assert "Retry-After" in response.headers
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import effects
+import lut
+from effects import ImageEffects
+
+
+def linear(*channels):
+    """Per-pixel ``clip(x * scale + offset)`` per channel, as the effects did before tables"""
+    def grade(pixels):
+        out = pixels.copy()
+        for channel, (scale, offset) in enumerate(channels):
+            out[:, :, channel] = np.clip(pixels[:, :, channel] * scale + offset, 0, 255)
+        return out
+    return grade
+
+
+def cross_process(pixels):
+    pixels = pixels / 255.0
+    pixels[:, :, 0] = np.clip(np.power(pixels[:, :, 0], 0.8) * 1.3, 0, 1)
+    pixels[:, :, 1] = np.clip(np.power(pixels[:, :, 1], 1.4) * 0.9 + 0.1, 0, 1)
+    pixels[:, :, 2] = np.clip(np.power(pixels[:, :, 2], 1.1) * 1.1 + 0.05, 0, 1)
+    return pixels * 255.0
+
+
+REFERENCES = {
+    "WARM_LUTS": linear((1.1, 0), (1, 0), (0.9, 0)),
+    "COOL_LUTS": linear((0.9, 0), (1, 0), (1.1, 0)),
+    "KODAK_LUTS": linear((1.15, 10), (1.05, 5), (0.92, -5)),
+    "FUJI_LUTS": linear((0.95, 0), (1.12, 8), (1.08, 5)),
+    "POLAROID_LUTS": linear((1.08, 12), (1.03, 8), (0.88, -8)),
+    "EXPIRED_LUTS": linear((1.12, 15), (0.92, -10), (1.05, 5)),
+    "CROSS_PROCESS_LUTS": cross_process,
+}
+
+
+@pytest.fixture
+def image():
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, size=(64, 96, 3), dtype=np.uint8))
+
+
+@pytest.mark.parametrize("name", sorted(REFERENCES))
+def test_tables_match_per_pixel_math(image, name):
+    expected = REFERENCES[name](np.asarray(image).astype(float))
+    luts = getattr(effects, name)
+
+    np.testing.assert_allclose(lut.apply_float(image, luts), expected, atol=1)
+    np.testing.assert_allclose(np.asarray(lut.apply(image, luts)), expected.astype(np.uint8), atol=1)
+
+
+@pytest.mark.parametrize("effect, name", [("warm", "WARM_LUTS"), ("cool", "COOL_LUTS")])
+def test_pure_grades_are_exact(image, effect, name):
+    expected = REFERENCES[name](np.asarray(image).astype(float)).astype(np.uint8)
+    np.testing.assert_array_equal(np.asarray(getattr(ImageEffects, effect)(image)), expected)
+
+
+def test_compose_matches_applying_in_turn(image):
+    composed = lut.compose(effects.KODAK_LUTS, effects.CROSS_PROCESS_LUTS)
+    in_turn = lut.apply(lut.apply(image, effects.KODAK_LUTS), effects.CROSS_PROCESS_LUTS)
+    np.testing.assert_array_equal(np.asarray(lut.apply(image, composed)), np.asarray(in_turn))
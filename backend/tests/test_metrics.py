@@ -0,0 +1,69 @@
+import io
+
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import metrics
+from metrics import ERRORS, MetricsMiddleware
+
+
+def errors() -> dict:
+    return {dict(labels)["cause"]: value for _, labels, value in ERRORS.samples()}
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, error_endpoints=("/process",))
+
+    @app.get("/ready")
+    async def ready():
+        raise HTTPException(status_code=503, detail="warming up")
+
+    @app.post("/process")
+    async def process(fail: str = ""):
+        if fail == "processing":
+            ERRORS.inc(cause="processing")
+            raise HTTPException(status_code=400, detail="No valid images processed")
+        if fail == "busy":
+            raise HTTPException(status_code=503, detail="busy")
+        return {}
+
+    return app
+
+
+def test_status_causes_only_count_for_processing_endpoints():
+    client = TestClient(make_app())
+    before = errors()
+    assert client.get("/ready").status_code == 503
+    assert errors() == before
+
+    assert client.post("/process?fail=busy").status_code == 503
+    assert errors().get("overloaded", 0) == before.get("overloaded", 0) + 1
+
+
+def test_handler_cause_is_not_counted_twice():
+    client = TestClient(make_app())
+    before = errors()
+    assert client.post("/process?fail=processing").status_code == 400
+    after = errors()
+    assert after["processing"] == before.get("processing", 0) + 1
+    assert after.get("bad_request", 0) == before.get("bad_request", 0)
+
+
+def test_truncated_upload_counts_once():
+    import main
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), "red").save(buffer, "JPEG")
+    truncated = buffer.getvalue()[:200]
+
+    with TestClient(main.app) as client:
+        before = errors()
+        response = client.post(
+            "/apply-effect", data={"effect": "warm"}, files={"files": ("broken.jpg", truncated, "image/jpeg")}
+        )
+        assert response.status_code == 400
+        after = errors()
+    assert sum(after.values()) == sum(before.values()) + 1
+    assert "lensify_errors_total" in metrics.render()
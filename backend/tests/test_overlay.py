@@ -0,0 +1,37 @@
+import math
+
+import numpy as np
+import pytest
+
+from overlay import OVERLAY_MIN_GRID, OVERLAY_SCALE, Overlay, grid_scale
+
+TINT = np.array([1.0, 0.6, 0.2], dtype=np.float32)
+
+
+def glow(height: int, width: int, center, scale=None, top: int = 0, rows=None) -> np.ndarray:
+    overlay = Overlay(height, width, scale)
+    overlay.add_glow(*center, math.hypot(height, width) / 3, 80, TINT)
+    pixels = np.zeros((rows or height, width, 3), dtype=np.float32)
+    overlay.apply(pixels, top)
+    return pixels
+
+
+def test_grid_scale():
+    assert grid_scale(37, 53) == 1
+    assert grid_scale(384, 512) == 1
+    assert grid_scale(768, 1024) == 768 // OVERLAY_MIN_GRID
+    assert grid_scale(3000, 4000) == OVERLAY_SCALE
+
+
+@pytest.mark.parametrize("height,width", [(37, 53), (384, 512), (600, 800), (1200, 1600)])
+def test_glow_close_to_exact(height, width):
+    for center in [(height // 4, width // 4), (0, width // 3), (height - 1, width - 1)]:
+        exact = glow(height, width, center, scale=1)
+        assert np.abs(glow(height, width, center) - exact).max() < 0.5
+
+
+def test_banded_glow_matches_whole_image():
+    height, width = 900, 700
+    whole = glow(height, width, (100, 600))
+    band = glow(height, width, (100, 600), top=300, rows=250)
+    np.testing.assert_allclose(band, whole[300:550], atol=1e-4)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from effects import EFFECTS
+from pipeline import Lut, Mask, Pipeline, Quantize, Step, optimize, parse_steps
+
+
+def photo(width: int = 96, height: int = 80, seed: int = 0) -> Image.Image:
+    """Gradient with noise, so every effect has something to change"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 / width, y * 255 / height, (x + y) * 127 / (width + height)], axis=-1)
+    noise = rng.integers(-40, 40, size=base.shape)
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+
+def pixels(image: Image.Image) -> np.ndarray:
+    return np.asarray(image)
+
+
+def test_parse_steps():
+    assert parse_steps("warm, lomo") == (Step("warm"), Step("lomo"))
+    assert parse_steps('[{"effect": "warm", "amount": 0.5}, "cool"]') == (Step("warm", 0.5), Step("cool"))
+
+    for spec, message in [
+        ("", "No effects requested"),
+        ("sepia", "Effect 'sepia' not found"),
+        ('[{"effect": "warm", "amount": 2}]', "Amount for 'warm'"),
+        ('[{"effect": "warm", "size": 2}]', "Unknown pipeline step parameter 'size'"),
+        ("[1", "Invalid pipeline JSON"),
+        (",".join(["warm"] * 17), "limited to 16 steps"),
+    ]:
+        with pytest.raises(ValueError, match=message):
+            parse_steps(spec)
+
+
+def test_neighbouring_tables_and_masks_fuse():
+    assert [type(stage) for stage in Pipeline(parse_steps("warm,cool,warm")).stages] == [Lut]
+
+    vignette, fade = Mask((("vignette", 1.0),)), Mask((("border_fade", 0.5),))
+    assert optimize([vignette, Quantize(), fade, Quantize()]) == [Mask(vignette.factors + fade.factors)]
+    assert Pipeline(parse_steps('[{"effect": "warm", "amount": 0}]')).stages == ()
+
+
+@pytest.mark.parametrize("effect", sorted(EFFECTS))
+def test_single_step_matches_effect(effect):
+    image = photo()
+    expected = EFFECTS[effect](image.copy(), np.random.default_rng(7))
+    result = Pipeline([Step(effect)])(image.copy(), np.random.default_rng(7))
+    np.testing.assert_array_equal(pixels(result), pixels(expected))
+
+
+@pytest.mark.parametrize("effect", sorted(EFFECTS))
+def test_bands_match_whole_image(effect):
+    image = photo(width=64, height=120)
+    pipeline = Pipeline([Step(effect), Step("warm", 0.5)])
+    whole = pipeline(image.copy(), np.random.default_rng(3))
+    # The smallest budget runs bands of the minimum height
+    banded = pipeline(image.copy(), np.random.default_rng(3), memory_budget=1)
+    np.testing.assert_array_equal(pixels(banded), pixels(whole))
@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+import scheduling
+from pipeline import Step
+from scheduling import DEFAULT_SECONDS_PER_MP, CostModel, CostQueue
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(scheduling.time, "monotonic", lambda: now[0])
+    return now
+
+
+def drain(queue: CostQueue) -> list:
+    return [queue.pop()[0] for _ in range(len(queue))]
+
+
+def test_small_job_overtakes_big_one(clock):
+    queue = CostQueue(aging=1.0)
+    queue.push("big", 10.0)
+    clock[0] += 1
+    queue.push("small", 0.5)
+    queue.push("tie", 0.5)
+
+    assert queue.peek() == "small"
+    assert queue.ahead(0.5) == 1.0
+    assert drain(queue) == ["small", "tie", "big"]
+
+
+def test_aged_big_job_runs_first(clock):
+    queue = CostQueue(aging=1.0)
+    queue.push("big", 10.0)
+    # Waited longer than it is expected to take
+    clock[0] += 11
+    queue.push("small", 0.5)
+    assert drain(queue) == ["big", "small"]
+
+    # Without aging the cheapest always goes first
+    queue = CostQueue(aging=0.0)
+    queue.push("big", 10.0)
+    clock[0] += 1000
+    queue.push("small", 0.5)
+    assert drain(queue) == ["small", "big"]
+
+
+def test_removed_entries_are_skipped(clock):
+    queue = CostQueue()
+    small = queue.push("small", 1.0)
+    queue.push("big", 5.0)
+    queue.remove(small)
+    queue.remove(small)
+
+    assert len(queue) == 1
+    assert list(queue) == ["big"]
+    assert queue.total() == 5.0
+    assert queue.pop() == ("big", 5.0)
+
+
+def test_calibration_updates_estimates():
+    model = CostModel()
+    steps = (Step("warm"), Step("soft"))
+    assert model.seconds(steps, 2_000_000) == pytest.approx(2 * 3 * DEFAULT_SECONDS_PER_MP)
+
+    model.calibrate([
+        {"rates": {"warm": 0.01, "soft": 0.3}, "base": 0.02},
+        {"rates": {"warm": 0.03, "soft": 0.5}, "base": 0.04},
+        {"rates": {"warm": 0.02, "soft": 0.4}, "base": 0.03},
+        None,
+        {"error": "warm-up failed"},
+    ])
+    # Medians over the workers that reported
+    assert model.effects == {"warm": 0.02, "soft": 0.4}
+    assert model.base == 0.03
+    assert model.seconds(steps, 2_000_000) == pytest.approx(2 * (0.03 + 0.02 + 0.4))
+    # Effects never measured cost the median effect
+    assert model.effect_seconds("vintage") == pytest.approx(0.21)
+    assert model.stats()["effects"]["soft"] == {"mp_per_s": 2.5, "source": "warmup"}
+
+
+def test_benchmark_costs_take_precedence(tmp_path):
+    report = tmp_path / "throughput.json"
+    report.write_text(json.dumps({"results": [
+        {"effect": "soft", "megapixels": 1, "mp_per_s": 10},
+        {"effect": "soft", "megapixels": 12, "mp_per_s": 4},
+    ]}))
+    model = CostModel.from_benchmark(str(report))
+    assert model.effects == {"soft": 0.25}
+
+    model.calibrate([{"rates": {"soft": 1.0, "warm": 0.01}}])
+    assert model.effects == {"soft": 0.25, "warm": 0.01}
+    assert model.sources == {"soft": "benchmark", "warm": "warmup"}
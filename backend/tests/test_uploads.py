@@ -0,0 +1,104 @@
+import io
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import uploads
+from uploads import RequestBudget, RequestSizeLimit, ingest
+
+
+def jpeg(width: int = 64, height: int = 48) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def client():
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+        # Rejected requests must hand back everything they were admitted with
+        assert main.admission.in_flight == 0
+        assert main.admission.stats()["queued"] == 0
+        assert not main.admission._clients
+
+
+def make_app(max_bytes: int) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(RequestSizeLimit, max_bytes=max_bytes)
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return {"size": len(await request.body())}
+
+    return app
+
+
+def test_request_size_limit():
+    client = TestClient(make_app(max_bytes=10))
+    assert client.post("/echo", content=b"x" * 10).json() == {"size": 10}
+
+    # Rejected from the declared length, before the body is read
+    response = client.post("/echo", content=b"x" * 11)
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body is too large"}
+
+    # Counted as it streams in when there's no length
+    response = client.post("/echo", content=iter([b"x" * 6, b"x" * 6]))
+    assert response.status_code == 413
+
+
+def test_request_budget():
+    budget = RequestBudget(max_bytes=100)
+    budget.take("a.jpg", 60)
+    with pytest.raises(HTTPException) as rejected:
+        budget.take("b.jpg", 60)
+    assert rejected.value.status_code == 413
+    assert rejected.value.detail == "Uploaded files exceed the request size limit"
+    assert budget.remaining == 40
+
+
+def test_ingest_without_a_known_size():
+    data = jpeg()
+    upload = ingest(io.BytesIO(data), "a.jpg", None, RequestBudget())
+    assert upload.data == data
+    assert (upload.format, upload.width, upload.height) == ("JPEG", 64, 48)
+
+    # The budget is enforced while reading
+    with pytest.raises(HTTPException) as rejected:
+        ingest(io.BytesIO(data), "a.jpg", None, RequestBudget(max_bytes=len(data) - 1))
+    assert rejected.value.status_code == 413
+
+
+def test_file_too_large(client, monkeypatch):
+    data = jpeg()
+    monkeypatch.setattr(uploads, "MAX_FILE_SIZE", len(data) - 1)
+    response = client.post("/apply-effect", data={"effect": "warm"}, files={"files": ("a.jpg", data, "image/jpeg")})
+    assert response.status_code == 413
+    assert response.json()["detail"] == f"File 'a.jpg' is larger than {len(data) - 1} bytes"
+
+
+def test_image_with_too_many_pixels(client, monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_IMAGE_PIXELS", 64 * 48 - 1)
+    files = [("files", ("small.jpg", jpeg(8, 8), "image/jpeg")), ("files", ("big.jpg", jpeg(), "image/jpeg"))]
+    response = client.post("/apply-effect", data={"effect": "warm"}, files=files)
+    assert response.status_code == 413
+    assert response.json()["detail"] == f"Image 'big.jpg' is 64x48, more than {64 * 48 - 1} pixels"
+
+
+def test_too_many_files(client, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "MAX_FILES", 2)
+    monkeypatch.setattr(main, "MAX_JOB_FILES", 2)
+    files = [("files", (f"{index}.jpg", jpeg(), "image/jpeg")) for index in range(3)]
+    for path, data in [("/apply-effect", {"effect": "warm"}), ("/jobs", {"effect": "warm"})]:
+        response = client.post(path, data=data, files=files)
+        assert response.status_code == 413
+        assert response.json()["detail"] == "At most 2 files can be uploaded at once"
+
+    assert client.post("/apply-effect", data={"effect": "warm"}, files=files[:2]).status_code == 200
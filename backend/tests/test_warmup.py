@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from warmup import Startup, warm_up, warmup_effects, worker_report
+
+
+def wait_for_status(client, path: str, status: int, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while (response := client.get(path)).status_code != status:
+        assert time.monotonic() < deadline, f"{path} stayed {response.status_code}"
+        time.sleep(0.01)
+    return response
+
+
+def test_ready_after_warm_up(monkeypatch):
+    import main
+
+    gate = threading.Event()
+    wait_for_workers = main.wait_for_workers
+
+    async def gated(pool, startup):
+        await asyncio.to_thread(gate.wait, 5)
+        await wait_for_workers(pool, startup)
+
+    monkeypatch.setattr(main, "wait_for_workers", gated)
+    monkeypatch.setattr(main, "startup", Startup(time.perf_counter()))
+
+    with TestClient(main.app) as client:
+        # Alive at once, but not ready until the workers are warm
+        assert client.get("/health").status_code == 200
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["ready"] is False
+
+        gate.set()
+        stats = wait_for_status(client, "/ready", 200).json()
+        assert stats["workers_warm"] == main.worker_pool.workers
+        assert "warmup" in stats["phases"]
+
+        # A restarted pool isn't ready until its new workers are warm
+        gate.clear()
+        client.portal.call(main.rewarm_workers)
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["worker_restarts"] == 1
+        assert response.json()["workers_warm"] == 0
+
+        gate.set()
+        stats = wait_for_status(client, "/ready", 200).json()
+        assert stats["workers_warm"] == main.worker_pool.workers
+        assert "rewarm" in stats["phases"]
+
+
+def test_warm_up_reports_effect_costs():
+    result = {}
+
+    def worker():
+        warm_up(("warm", "soft"), size=64)
+        result["report"] = worker_report()[1]
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+
+    report = result["report"]
+    assert report["effects"] == 2
+    assert report["failed"] == []
+    assert set(report["rates"]) == {"warm", "soft"}
+    assert report["base"] > 0
+
+
+def test_warmup_effects():
+    assert warmup_effects("none") == ()
+    assert warmup_effects(" warm, Soft ") == ("warm", "soft")
+    assert len(warmup_effects("all")) > 2
+    with pytest.raises(ValueError, match="Unknown warm-up effects: sepia"):
+        warmup_effects("warm,sepia")
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import signal
+import threading
+
+import pytest
+
+from workers import WorkerLost, WorkerPool
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def fail():
+    raise ValueError("bad image")
+
+
+def die():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def test_slots_are_released():
+    release = threading.Event()
+
+    async def scenario():
+        pool = WorkerPool("thread", workers=1, queue_size=0)
+        pool.start()
+        try:
+            blocked = asyncio.create_task(pool.run(release.wait, cost=1.0))
+            waiting = asyncio.create_task(pool.run(fail, cost=0.5))
+            await asyncio.sleep(0.05)
+            assert pool.stats()["running"] == 1
+            assert pool.stats()["queued"] == 1
+
+            release.set()
+            assert await blocked is True
+            with pytest.raises(ValueError, match="bad image"):
+                await waiting
+            assert await pool.run(lambda: "next") == "next"
+
+            stats = pool.stats()
+            assert (stats["running"], stats["queued"], stats["backlog_seconds"]) == (0, 0, 0.0)
+        finally:
+            pool.shutdown()
+
+    run(scenario())
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    release = threading.Event()
+
+    async def scenario():
+        pool = WorkerPool("thread", workers=1, queue_size=0)
+        pool.start()
+        try:
+            blocked = asyncio.create_task(pool.run(release.wait))
+            waiting = asyncio.create_task(pool.run(lambda: "never"))
+            await asyncio.sleep(0.05)
+            waiting.cancel()
+            await asyncio.sleep(0)
+            assert pool.stats()["queued"] == 0
+
+            release.set()
+            await blocked
+            assert pool.stats()["running"] == 0
+        finally:
+            pool.shutdown()
+
+    run(scenario())
+
+
+@pytest.mark.skipif(os.name != "posix", reason="needs SIGKILL")
+def test_dead_worker_restarts_the_pool():
+    restarted = []
+
+    async def scenario():
+        pool = WorkerPool("process", workers=1)
+        pool.on_restart = lambda: restarted.append(pool.restarts)
+        pool.start()
+        try:
+            assert await pool.run(os.getpid) != os.getpid()
+            with pytest.raises(WorkerLost):
+                await pool.run(die)
+
+            assert restarted == [1]
+            assert not pool.broken
+            assert pool.stats()["running"] == 0
+            assert await pool.run(sum, [1, 2]) == 3
+            assert not pool.restart_if_broken()
+        finally:
+            pool.shutdown()
+
+    run(scenario())
@@ -0,0 +1,62 @@
+import io
+import zipfile
+
+import pytest
+
+import zipstream
+from zipstream import ZipStream
+
+
+def archive(stream: ZipStream, entries) -> bytes:
+    chunks = [stream.add(name, data) for name, data in entries]
+    return b"".join(chunks) + stream.finish()
+
+
+def test_archive_is_valid():
+    entries = [("processed_a.jpg", b"\xff\xd8first"), ("processed_ü.jpg", b"second" * 1000), ("empty.jpg", b"")]
+    data = archive(ZipStream(comment="Failed files:\nnotes.txt"), entries)
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == [name for name, _ in entries]
+        assert [zf.read(name) for name, _ in entries] == [content for _, content in entries]
+        assert zf.comment == b"Failed files:\nnotes.txt"
+
+
+def test_zip64_records(monkeypatch):
+    # Too many entries for the classic end record, without writing 64k files
+    monkeypatch.setattr(zipstream, "ZIP64_COUNT_LIMIT", 2)
+    entries = [(f"{index}.jpg", bytes([index])) for index in range(3)]
+    data = archive(ZipStream(), entries)
+
+    assert b"PK\x06\x06" in data
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert [zf.read(name) for name, _ in entries] == [content for _, content in entries]
+
+
+def test_finished_archive_is_closed():
+    stream = ZipStream()
+    stream.finish()
+    with pytest.raises(ValueError, match="finished archive"):
+        stream.add("a.jpg", b"")
+    with pytest.raises(ValueError, match="already finished"):
+        stream.finish()
+
+
+def test_batch_zip_lists_rejected_files():
+    from fastapi.testclient import TestClient
+    from PIL import Image
+
+    import main
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), "red").save(buffer, "JPEG")
+    files = [("files", ("a.jpg", buffer.getvalue(), "image/jpeg")), ("files", ("notes.txt", b"hello", "text/plain"))]
+    with TestClient(main.app) as client:
+        response = client.post("/apply-effect", data={"effect": "warm"}, files=files)
+
+    assert response.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        assert zf.namelist() == ["processed_a.jpg"]
+        assert zf.comment == b"Failed files:\nnotes.txt"
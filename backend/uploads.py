@@ -0,0 +1,164 @@
+"""Upload ingestion with early validation and size limits.
+
+Request bodies are counted as they stream in and cut off with ``413`` once
+they pass ``MAX_REQUEST_SIZE``, before the multipart parser has spooled
+the rest. Each uploaded file is then checked in two steps: its size against
+``MAX_FILE_SIZE`` and the remaining request budget, and its header (format
+and dimensions, parsed lazily by ``Image.open``) against
+``MAX_IMAGE_PIXELS``. Only files that pass are read into memory and
+hashed, so an oversized or hostile upload costs a few kilobytes of reads
+instead of its full size.
+"""
+
+import hashlib
+import io
+import os
+from typing import Any, BinaryIO, Callable, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+from PIL import Image
+
+MAX_REQUEST_SIZE = int(os.getenv("MAX_REQUEST_SIZE", 200 * 1024 * 1024))
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 50 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 100_000_000))
+MAX_FILES = int(os.getenv("MAX_FILES", 100))
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class Upload(NamedTuple):
+    """An uploaded file read into memory"""
+    data: bytes
+    digest: str
+    format: str
+    width: int
+    height: int
+
+
+class NotAnImage(ValueError):
+    """The upload's header isn't an image format Pillow can decode"""
+
+
+class RequestBudget:
+    """Bytes of uploaded files a single request may still read"""
+
+    def __init__(self, max_bytes: int = MAX_REQUEST_SIZE):
+        self.remaining = max_bytes
+
+    def take(self, filename: str, size: int):
+        if size > MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=413, detail=f"File '{filename}' is larger than {MAX_FILE_SIZE} bytes"
+            )
+        if size > self.remaining:
+            raise HTTPException(status_code=413, detail="Uploaded files exceed the request size limit")
+        self.remaining -= size
+
+
+def probe(file: BinaryIO, filename: str) -> Tuple[str, int, int]:
+    """Format and size from the image header, without decoding pixels"""
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            fmt, (width, height) = image.format, image.size
+    except Image.DecompressionBombError:
+        raise HTTPException(status_code=413, detail=f"Image '{filename}' has too many pixels")
+    except Exception as e:
+        raise NotAnImage(f"'{filename}' is not a supported image") from e
+
+    if width * height > MAX_IMAGE_PIXELS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image '{filename}' is {width}x{height}, more than {MAX_IMAGE_PIXELS} pixels",
+        )
+    return fmt, width, height
+
+
+def ingest(file: BinaryIO, filename: str, size: Optional[int], budget: RequestBudget) -> Upload:
+    """Validate an uploaded file, then read and hash it in chunks
+
+    ``size`` is the byte count from the multipart parser, if known.
+    Blocking; run it off the event loop.
+    """
+    if size is not None:
+        budget.take(filename, size)
+    fmt, width, height = probe(file, filename)
+
+    file.seek(0)
+    digest = hashlib.sha256()
+    # getvalue() hands over the buffer without copying it, so the upload is held once
+    data = io.BytesIO()
+    read = 0
+    while chunk := file.read(CHUNK_SIZE):
+        read += len(chunk)
+        if size is None and read > min(MAX_FILE_SIZE, budget.remaining):
+            budget.take(filename, read)  # raises
+        digest.update(chunk)
+        data.write(chunk)
+    if size is None:
+        budget.take(filename, read)
+
+    return Upload(data.getvalue(), digest.hexdigest(), fmt, width, height)
+
+
+class RequestTooLarge(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=413, detail="Request body is too large")
+
+
+class RequestSizeLimit:
+    """ASGI middleware rejecting request bodies over ``max_bytes`` with 413
+
+    A declared Content-Length over the limit is rejected before any of
+    the body is read; otherwise the body is counted as it arrives.
+    """
+
+    def __init__(self, app: Callable, max_bytes: int = MAX_REQUEST_SIZE):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            return await self._reject(send)
+
+        received = 0
+        started = False
+
+        async def limited_receive() -> Any:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise RequestTooLarge()
+            return message
+
+        async def tracking_send(message: dict):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except RequestTooLarge:
+            if started:
+                raise
+            await self._reject(send)
+
+    async def _reject(self, send: Callable):
+        body = b'{"detail":"Request body is too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
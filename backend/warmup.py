@@ -0,0 +1,231 @@
+"""Worker warm-up and startup readiness.
+
+A fresh instance pays one-off costs on its first requests: worker
+processes are forked, Pillow loads its codec plugins, pipelines are
+compiled, NumPy sets up its ufunc loops and the scratch buffers are
+allocated. :func:`preload` loads the plugins in the main process, and
+:func:`warm_up` runs as the worker pool's initializer and pays the rest
+up front by running every effect in ``WARMUP_EFFECTS`` on a synthetic
+image, so each worker is warm before it takes a task. The timings it
+reports calibrate the scheduler's cost model. :class:`Startup` records
+how long each phase of startup took and whether the instance is ready
+for traffic.
+"""
+
+import asyncio
+import io
+import os
+import statistics
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from effects import EFFECTS
+from encoding import EncodeOptions, available_formats, encode
+from metrics import timed_call
+from pipeline import Step
+from processing import decoded_shape, process_pipeline
+from workers import WorkerLost, WorkerPool
+
+# Effects each worker runs before taking requests: "all", "none" or a comma-separated list
+WARMUP_EFFECTS = os.getenv("WARMUP_EFFECTS", "all")
+
+# Longest side of the synthetic warm-up image; scratch buffers are sized for it
+WARMUP_SIZE = int(os.getenv("WARMUP_SIZE", 512))
+
+# Seconds to wait for every worker to report warm before going ready anyway
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", 120))
+
+_local = threading.local()
+
+
+def warmup_effects(spec: str = WARMUP_EFFECTS) -> Tuple[str, ...]:
+    """Effects named by a ``WARMUP_EFFECTS`` value
+
+    Raises ``ValueError`` for unknown effect names.
+    """
+    spec = spec.strip().lower()
+    if spec == "all":
+        return tuple(EFFECTS)
+    if spec in ("", "none"):
+        return ()
+
+    effects = tuple(name.strip() for name in spec.split(",") if name.strip())
+    unknown = [name for name in effects if name not in EFFECTS]
+    if unknown:
+        raise ValueError(f"Unknown warm-up effects: {', '.join(unknown)}")
+    return effects
+
+
+def sample_image(size: int = WARMUP_SIZE) -> bytes:
+    """A 4:3 JPEG with gradients and noise, so effects see realistic pixels"""
+    width, height = max(size, 4), max(size * 3 // 4, 3)
+    y, x = np.mgrid[0:height, 0:width]
+    noise = np.random.default_rng(0).integers(0, 32, (height, width), dtype=np.uint8)
+    pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) * 127 // (width + height)], axis=-1)
+    pixels = (pixels + noise[..., None]).clip(0, 255).astype(np.uint8)
+
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def preload():
+    """Load every Pillow plugin and parse a sample header in the main process
+
+    Pillow imports most codec plugins only when an image first needs them,
+    which costs the first request tens of milliseconds. Called before the
+    worker processes fork, so they inherit the loaded plugins.
+    """
+    Image.init()
+    available_formats()
+    decoded_shape(sample_image(64))
+
+
+def warm_up(effects: Tuple[str, ...], size: int = WARMUP_SIZE):
+    """Run ``effects`` in the calling worker and remember how long they took
+
+    Each effect runs twice: the first run pays the one-off costs, the
+    second measures the warm cost per megapixel that calibrates the
+    scheduler's cost model. Used as the pool initializer, so it must not
+    raise: a failing effect is logged and the worker carries on cold for it.
+    """
+    start = time.perf_counter()
+    data = sample_image(size)
+    megapixels = max(size, 4) * max(size * 3 // 4, 3) / 1e6
+    jpeg = EncodeOptions(format="JPEG")
+    rates: Dict[str, float] = {}
+    bases = []
+    failed = []
+    for effect in effects:
+        try:
+            # timed_call keeps the warm-up out of the stage metrics
+            timed_call(process_pipeline, data, (Step(effect),), 0, None, jpeg)
+            _, stages = timed_call(process_pipeline, data, (Step(effect),), 0, None, jpeg)
+        except Exception as e:
+            failed.append(effect)
+            print(f"Error warming up {effect}: {e}")
+            continue
+        rates[effect] = sum(seconds for name, seconds, _ in stages if name == "effect") / megapixels
+        bases.append(sum(seconds for name, seconds, _ in stages if name != "effect") / megapixels)
+
+    # Load the encoder plugins of the other output formats
+    if effects:
+        thumbnail = Image.new("RGB", (8, 8))
+        for fmt in available_formats().values():
+            if fmt != "JPEG":
+                try:
+                    encode(thumbnail, EncodeOptions(format=fmt))
+                except Exception as e:
+                    print(f"Error warming up {fmt} encoding: {e}")
+
+    _local.report = {
+        "seconds": time.perf_counter() - start,
+        "effects": len(effects),
+        "failed": failed,
+        "rates": rates,
+        "base": statistics.median(bases) if bases else None,
+    }
+
+
+def worker_report() -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Identity of the calling worker and its warm-up report, if it ran one"""
+    return f"{os.getpid()}:{threading.get_ident()}", getattr(_local, "report", None)
+
+
+def process_seconds() -> Optional[float]:
+    """Seconds since this process started, where ``/proc`` tells"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the parenthesized command name; starttime is field 22
+            started = int(f.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - started)
+
+
+class Startup:
+    """Phases of startup and whether the instance is ready for traffic"""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.phases: Dict[str, float] = {}
+        self.workers: Dict[str, Dict[str, Any]] = {}
+        self.ready = False
+        self.restarts = 0
+        self._mark = started
+
+    def mark(self, phase: str):
+        """Record the time since the previous mark as ``phase``"""
+        now = time.perf_counter()
+        self.phases[phase] = now - self._mark
+        self._mark = now
+
+    def set_ready(self):
+        self.mark("rewarm" if self.restarts else "warmup")
+        self.ready = True
+        age = process_seconds()
+        print(
+            f"Ready in {time.perf_counter() - self.started:.2f}s"
+            + (f" ({age:.2f}s since process start)" if age is not None else "")
+            + ": "
+            + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases.items())
+        )
+
+    def restart(self):
+        """Workers were replaced: not ready until the new ones have warmed up"""
+        self.ready = False
+        self.restarts += 1
+        self.workers.clear()
+        self._mark = time.perf_counter()
+
+    def stats(self) -> Dict[str, Any]:
+        warmups = [report["seconds"] for report in self.workers.values() if report]
+        return {
+            "ready": self.ready,
+            "seconds": time.perf_counter() - self.started,
+            "process_seconds": process_seconds(),
+            "phases": self.phases,
+            "workers_warm": len(self.workers),
+            "worker_restarts": self.restarts,
+            "worker_warmup_seconds": max(warmups) if warmups else None,
+            "warmup_failures": sorted({effect for report in self.workers.values() if report for effect in report["failed"]}),
+        }
+
+
+async def wait_for_workers(pool: WorkerPool, startup: Startup, timeout: float = WARMUP_TIMEOUT):
+    """Start every worker of ``pool`` and wait until each has warmed up
+
+    Workers only take tasks once their initializer has finished, so a
+    report from every worker means all of them are warm. A worker can pick
+    up several report tasks while another is still warming, hence the
+    rounds until each one has answered.
+    """
+    deadline = time.perf_counter() + timeout
+    while len(startup.workers) < pool.workers and time.perf_counter() < deadline:
+        missing = pool.workers - len(startup.workers)
+        try:
+            reports = await asyncio.wait_for(
+                asyncio.gather(*(pool.run(worker_report) for _ in range(missing))),
+                max(0.0, deadline - time.perf_counter()),
+            )
+        except asyncio.TimeoutError:
+            break
+        except WorkerLost:
+            # The pool was restarted, which starts a new warm-up
+            return
+        except Exception as e:
+            print(f"Error warming up workers: {e}")
+            break
+        startup.workers.update(reports)
+        if len(startup.workers) < pool.workers:
+            await asyncio.sleep(0.1)
+
+    if len(startup.workers) < pool.workers:
+        print(f"Warm-up timed out with {len(startup.workers)} of {pool.workers} workers warm")
+    startup.set_ready()
@@ -0,0 +1,216 @@
+"""CPU worker pool used to keep image processing off the event loop."""
+
+import asyncio
+import os
+import signal
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import resource_tracker
+from typing import Any, Callable, Optional, Tuple
+
+from metrics import observe_stage, timed_call
+from scheduling import CostQueue
+
+WORKER_MODES = ("process", "thread")
+
+# Expected seconds of work per worker above which no more tasks are queued in the executor
+WORKER_QUEUE_SECONDS = float(os.getenv("WORKER_QUEUE_SECONDS", 0.1))
+
+
+class WorkerLost(Exception):
+    """A worker process died, breaking the pool; it has been restarted, so the task can be retried"""
+
+
+def _init_process(initializer: Optional[Callable[..., Any]], initargs: Tuple[Any, ...]):
+    """Worker process setup, then ``initializer(*initargs)``"""
+    # Forked workers inherit the server's signal handlers, which would keep
+    # them alive when a broken pool terminates them; shutdown is the server's job
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+class WorkerPool:
+    """Bounded executor for CPU-heavy work.
+
+    ``mode`` is ``"process"`` (one interpreter per core) or ``"thread"``
+    (relies on NumPy and Pillow releasing the GIL). At most
+    ``workers + queue_size`` tasks are handed to the executor at a time,
+    and tasks beyond one per worker only while the expected work handed
+    over stays under ``queue_seconds`` per worker: queued cheap tasks keep
+    workers busy between tasks, while expensive ones would only hold up
+    whatever comes next. Further callers wait in :meth:`run` and get a slot
+    in order of their expected ``cost`` with aging (see ``scheduling``),
+    so cheap tasks aren't stuck behind a queue of expensive ones.
+
+    A process pool breaks for good when one of its workers dies (for
+    example OOM-killed). The pool is then restarted with the same
+    initializer, and the tasks that were on it raise :class:`WorkerLost`.
+    """
+
+    def __init__(
+        self,
+        mode: str = "process",
+        workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        queue_seconds: float = WORKER_QUEUE_SECONDS,
+    ):
+        if mode not in WORKER_MODES:
+            raise ValueError(f"Unknown worker mode '{mode}', expected one of {WORKER_MODES}")
+
+        self.mode = mode
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.queue_size = max(0, self.workers * 2 if queue_size is None else queue_size)
+        self.queue_seconds = queue_seconds
+        self._executor: Optional[Executor] = None
+        self._waiting: CostQueue[asyncio.Future] = CostQueue()
+        self._running = 0
+        self._backlog = 0.0
+        self._initializer: Optional[Callable[..., Any]] = None
+        self._initargs: Tuple[Any, ...] = ()
+        self.restarts = 0
+        self.on_restart: Optional[Callable[[], Any]] = None
+
+    @classmethod
+    def from_env(cls) -> "WorkerPool":
+        """Build a pool from WORKER_MODE, WORKER_COUNT, WORKER_QUEUE_SIZE and WORKER_QUEUE_SECONDS"""
+        workers = os.getenv("WORKER_COUNT")
+        queue_size = os.getenv("WORKER_QUEUE_SIZE")
+        return cls(
+            mode=os.getenv("WORKER_MODE", "process"),
+            workers=int(workers) if workers else None,
+            queue_size=int(queue_size) if queue_size else None,
+            queue_seconds=WORKER_QUEUE_SECONDS,
+        )
+
+    @property
+    def capacity(self) -> int:
+        """Maximum number of tasks submitted to the executor at once"""
+        return self.workers + self.queue_size
+
+    def start(self, initializer: Optional[Callable[..., Any]] = None, initargs: Tuple[Any, ...] = ()):
+        """Create the executor; ``initializer(*initargs)`` runs in each worker before its first task"""
+        if self._executor is not None:
+            return
+
+        self._initializer, self._initargs = initializer, initargs
+        if self.mode == "process":
+            if os.name == "posix":
+                # Workers must share our resource tracker, otherwise shared
+                # memory they attach to is reported as leaked when they exit
+                resource_tracker.ensure_running()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_process, initargs=(initializer, initargs)
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="lensify-worker", initializer=initializer, initargs=initargs
+            )
+
+    def shutdown(self):
+        if self._executor is None:
+            return
+
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+
+    @property
+    def broken(self) -> bool:
+        """Whether a worker process died and the executor can't take tasks any more"""
+        return getattr(self._executor, "_broken", False) is not False
+
+    def restart_if_broken(self) -> bool:
+        """Replace a broken executor with a new one; True if it was broken"""
+        if not self.broken:
+            return False
+        self._restart(self._executor)
+        return True
+
+    def _restart(self, executor: Optional[Executor]):
+        # Several tasks see the same breakage; only the first replaces the executor
+        if executor is not self._executor:
+            return
+
+        print(f"Worker pool broken, a worker process died: restarting {self.workers} workers")
+        self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.restarts += 1
+        self.start(self._initializer, self._initargs)
+        if self.on_restart is not None:
+            self.on_restart()
+
+    async def run(self, fn: Callable[..., Any], *args: Any, cost: float = 0.0) -> Any:
+        """Run ``fn(*args)`` on the pool, waiting for a free slot first
+
+        ``cost`` is the expected seconds of work, used to order waiting tasks.
+        Raises :class:`WorkerLost` if a worker process died before the task
+        finished.
+        """
+        if self._executor is None:
+            self.start()
+
+        await self._acquire(cost)
+        executor = self._executor
+        try:
+            loop = asyncio.get_running_loop()
+            result, stages = await loop.run_in_executor(executor, timed_call, fn, *args)
+        except BrokenExecutor as e:
+            self._restart(executor)
+            raise WorkerLost(str(e)) from e
+        finally:
+            self._release(cost)
+
+        for stage in stages:
+            observe_stage(*stage)
+        return result
+
+    def _has_slot(self) -> bool:
+        if self._running < self.workers:
+            return True
+        return self._running < self.capacity and self._backlog < self.queue_seconds * self.workers
+
+    async def _acquire(self, cost: float):
+        if not self._waiting and self._has_slot():
+            self._running += 1
+            self._backlog += cost
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        entry = self._waiting.push(future, cost)
+        try:
+            await future
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Given a slot just as we were cancelled: pass it on
+                self._release(cost)
+            else:
+                self._waiting.remove(entry)
+            raise
+
+    def _release(self, cost: float):
+        self._running -= 1
+        self._backlog -= cost
+        while self._waiting and self._has_slot():
+            future, seconds = self._waiting.pop()
+            if future.done():
+                continue
+            self._running += 1
+            self._backlog += seconds
+            future.set_result(None)
+
+    def estimate(self, cost: float = 0.0) -> float:
+        """Expected seconds until a task of ``cost`` submitted now would finish"""
+        ahead = max(0.0, self._backlog) + self._waiting.ahead(cost)
+        return ahead / self.workers + cost
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "restarts": self.restarts,
+            "capacity": self.capacity,
+            "running": self._running,
+            "queued": len(self._waiting),
+            "backlog_seconds": max(0.0, self._backlog) + self._waiting.total(),
+        }
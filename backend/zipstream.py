@@ -0,0 +1,154 @@
+"""Incremental ZIP writer for streaming archives to the client."""
+
+import struct
+import time
+import zlib
+from typing import List, NamedTuple
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+# General purpose flag: file names are UTF-8
+FLAG_UTF8 = 0x0800
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+
+
+class _Entry(NamedTuple):
+    name: bytes
+    crc: int
+    size: int
+    offset: int
+    dos_time: int
+    dos_date: int
+
+
+def _dos_timestamp(timestamp: float):
+    t = time.localtime(timestamp)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((max(t.tm_year, 1980) - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+class ZipStream:
+    """Build a ZIP archive one entry at a time.
+
+    Entries are stored without compression (JPEGs don't deflate), so the CRC
+    and size are known before the local header is written and every call to
+    :meth:`add` returns bytes that can be sent immediately. :meth:`finish`
+    returns the central directory, switching to ZIP64 records when the
+    archive outgrows the classic format.
+    """
+
+    def __init__(self, comment: str = ""):
+        self.comment = comment
+        self._entries: List[_Entry] = []
+        self._offset = 0
+        self._finished = False
+
+    def add(self, filename: str, data: bytes) -> bytes:
+        """Return the local header and data for a new stored entry"""
+        if self._finished:
+            raise ValueError("Cannot add entries to a finished archive")
+        if len(data) >= ZIP64_LIMIT:
+            raise ValueError(f"Entry '{filename}' is too large to store")
+
+        name = filename.encode("utf-8")
+        dos_time, dos_date = _dos_timestamp(time.time())
+        entry = _Entry(name, zlib.crc32(data), len(data), self._offset, dos_time, dos_date)
+        self._entries.append(entry)
+
+        header = struct.pack(
+            "<IHHHHHIIIHH",
+            0x04034B50,
+            VERSION_DEFAULT,
+            FLAG_UTF8,
+            0,  # stored
+            entry.dos_time,
+            entry.dos_date,
+            entry.crc,
+            entry.size,
+            entry.size,
+            len(name),
+            0,
+        )
+        chunk = header + name + data
+        self._offset += len(header) + len(name) + len(data)
+        return chunk
+
+    def finish(self) -> bytes:
+        """Return the central directory and end-of-archive records"""
+        if self._finished:
+            raise ValueError("Archive already finished")
+        self._finished = True
+
+        directory = bytearray()
+        for entry in self._entries:
+            extra = b""
+            offset = entry.offset
+            version = VERSION_DEFAULT
+            if offset >= ZIP64_LIMIT:
+                extra = struct.pack("<HHQ", 0x0001, 8, offset)
+                offset = ZIP64_LIMIT
+                version = VERSION_ZIP64
+
+            directory += struct.pack(
+                "<IHHHHHHIIIHHHHHII",
+                0x02014B50,
+                version,
+                version,
+                FLAG_UTF8,
+                0,
+                entry.dos_time,
+                entry.dos_date,
+                entry.crc,
+                entry.size,
+                entry.size,
+                len(entry.name),
+                len(extra),
+                0,  # comment length
+                0,  # disk number
+                0,  # internal attributes
+                0,  # external attributes
+                offset,
+            )
+            directory += entry.name + extra
+
+        comment = self.comment.encode("utf-8")[:0xFFFF]
+        directory_offset = self._offset
+        directory_size = len(directory)
+        count = len(self._entries)
+
+        if count >= ZIP64_COUNT_LIMIT or directory_offset >= ZIP64_LIMIT or directory_size >= ZIP64_LIMIT:
+            zip64_offset = directory_offset + directory_size
+            directory += struct.pack(
+                "<IQHHIIQQQQ",
+                0x06064B50,
+                44,  # size of the remaining record
+                VERSION_ZIP64,
+                VERSION_ZIP64,
+                0,
+                0,
+                count,
+                count,
+                directory_size,
+                directory_offset,
+            )
+            directory += struct.pack("<IIQI", 0x07064B50, 0, zip64_offset, 1)
+            count = min(count, ZIP64_COUNT_LIMIT)
+            directory_size = min(directory_size, ZIP64_LIMIT)
+            directory_offset = min(directory_offset, ZIP64_LIMIT)
+
+        directory += struct.pack(
+            "<IHHHHIIH",
+            0x06054B50,
+            0,
+            0,
+            count,
+            count,
+            directory_size,
+            directory_offset,
+            len(comment),
+        )
+        directory += comment
+        return bytes(directory)
@@ -155,6 +155,11 @@ const effects: Effect[] = [
   }
 ]
 
+// Longest side the preview can take on screen, in device pixels, so effects
+// run on as few pixels as the preview actually shows
+const displayMaxSize = () =>
+  Math.ceil(Math.max(window.innerWidth, window.innerHeight) * (window.devicePixelRatio || 1))
+
 const EffectGallery = () => {
   const dispatch = useDispatch()
   const { files, activePhotoIndex, selectedEffect } = useSelector(
@@ -174,6 +179,7 @@ const EffectGallery = () => {
       const formData = new FormData()
       formData.append('effect', effectId)
       formData.append('files', activeFile.file)
+      formData.append('max_size', String(displayMaxSize()))
 
       const response = await fetch(`${import.meta.env.VITE_API_URL}/apply-effect`, {
         method: 'POST',
@@ -6,6 +6,7 @@ Run this script while the backend server is running to test all endpoints
 
 import requests
 import sys
+import zipfile
 from io import BytesIO
 from PIL import Image
 
@@ -104,6 +105,27 @@ def test_batch_processing():
         print(f"❌ Batch processing failed: {e}")
         return False
 
+def test_apply_effects():
+    """Test applying several effects to one image"""
+    try:
+        test_image = create_test_image()
+        files = {'file': ('test.jpg', test_image, 'image/jpeg')}
+        data = {'effects': 'warm,lomo,analog_kodak', 'preview': 'true'}
+        
+        response = requests.post("http://localhost:8000/apply-effects", files=files, data=data)
+        assert response.status_code == 200
+        assert response.headers['content-type'] == 'application/zip'
+        
+        with zipfile.ZipFile(BytesIO(response.content)) as zip_file:
+            assert len(zip_file.namelist()) == 3
+        
+        print("✅ Multi-effect processing passed")
+        print(f"   ZIP file size: {len(response.content)} bytes")
+        return True
+    except Exception as e:
+        print(f"❌ Multi-effect processing failed: {e}")
+        return False
+
 def test_invalid_effect():
     """Test error handling with invalid effect"""
     try:
@@ -133,6 +155,7 @@ def main():
         test_effects_endpoint,
         test_apply_effect,
         test_batch_processing,
+        test_apply_effects,
         test_invalid_effect
     ]
     